@@ -2,15 +2,151 @@
 Flask API Server for Ride-Sharing Optimizer
 """
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
-from optimizer import RideSharingOptimizer
+from optimizer import (MatrixCostProvider, CLUSTERING_METHODS, OPTIMIZE_MODES, MAX_DETOUR_FACTOR,
+                       configure_distance_cache, get_distance_cache)
+from sharding import ShardedOptimizer, SHARD_OVERLAP_KM
+from jobs import JobManager, JOB_WORKERS
+from telemetry import Telemetry
+from ingest import read_riders, read_drivers, write_matches, detect_format, FORMATS, FORMAT_MIMETYPES
+from serialization import serialize_result, has_orjson, RESPONSE_FORMATS, ENCODERS
+from result_cache import ResultCache, SingleFlight, cache_key, RESULT_CACHE_MAX_ENTRIES, RESULT_CACHE_TTL_S
+from serving import (SolveLimiter, Overloaded, MAX_ACTIVE_SOLVES, MAX_QUEUED_SOLVES, MAX_QUEUED_JOBS,
+                     MAX_REQUEST_MB, RETRY_AFTER_S)
+import atexit
+import io
+import os
 import random
 
 app = Flask(__name__)
 CORS(app)
+app.config['MAX_CONTENT_LENGTH'] = int(float(os.environ.get('MAX_REQUEST_MB', MAX_REQUEST_MB)) * 2**20)
 
-optimizer = RideSharingOptimizer()
+# Price routes on a precomputed road-network matrix when COST_MATRIX_PATH is set
+COST_MATRIX_PATH = os.environ.get('COST_MATRIX_PATH')
+cost_provider = MatrixCostProvider(COST_MATRIX_PATH) if COST_MATRIX_PATH else None
+
+# Centroids of the latest clustering, shared only to seed 'warm' clustering
+warm_start = {'centers': None}
+
+
+def new_optimizer():
+    """A fresh optimizer for every request or job, so concurrent runs never share state"""
+    optimizer = ShardedOptimizer(cost_provider=cost_provider)
+    optimizer.cluster_centers = warm_start['centers']
+    return optimizer
+
+
+def remember_clustering(optimizer):
+    if optimizer.cluster_centers is not None:
+        warm_start['centers'] = optimizer.cluster_centers
+
+
+# Totals over every finished optimization, exported at /api/metrics
+telemetry = Telemetry()
+
+
+def record_result(optimizer, result):
+    """Keep what later runs and /api/metrics need from a finished optimization"""
+    remember_clustering(optimizer)
+    if 'metrics' in result:
+        telemetry.observe(result['metrics'])
+
+
+# Jobs take the same solve slots as requests (solve_limiter below), waiting outside its queue
+jobs = JobManager(new_optimizer, workers=int(os.environ.get('JOB_WORKERS', JOB_WORKERS)),
+                  on_finished=record_result, solve_slot=lambda: solve_limiter.slot(background=True))
+
+# Persist the distance cache across restarts when DISTANCE_CACHE_PATH is set
+DISTANCE_CACHE_PATH = os.environ.get('DISTANCE_CACHE_PATH')
+if DISTANCE_CACHE_PATH:
+    configure_distance_cache(path=DISTANCE_CACHE_PATH)
+
+
+def save_distance_cache():
+    """
+    Write this process's distance cache to DISTANCE_CACHE_PATH, if set. Runs
+    at exit; under gunicorn, workers run it from the worker_exit hook
+    instead and the master never does (see wsgi.py)
+    """
+    cache = get_distance_cache()
+    if DISTANCE_CACHE_PATH and cache is not None:
+        cache.save(DISTANCE_CACHE_PATH)
+
+
+atexit.register(save_distance_cache)
+
+# Solves this process runs and queues at once; requests beyond that get 429
+solve_limiter = SolveLimiter(max_active=int(os.environ.get('MAX_ACTIVE_SOLVES', MAX_ACTIVE_SOLVES)),
+                             max_queued=int(os.environ.get('MAX_QUEUED_SOLVES', MAX_QUEUED_SOLVES)))
+QUEUED_JOBS_LIMIT = int(os.environ.get('MAX_QUEUED_JOBS', MAX_QUEUED_JOBS))
+
+# Results of recent /api/optimize requests, served again to identical ones;
+# RESULT_CACHE_SIZE=0 turns the cache off
+result_cache = ResultCache(max_entries=int(os.environ.get('RESULT_CACHE_SIZE', RESULT_CACHE_MAX_ENTRIES)),
+                           ttl_s=float(os.environ.get('RESULT_CACHE_TTL_S', RESULT_CACHE_TTL_S)))
+
+# Identical cacheable requests running at the same time share one solve
+in_flight = SingleFlight()
+
+
+def cached_optimize(riders, drivers, options, refresh=False):
+    """
+    The result of an optimize request, its cache status (HIT, MISS or
+    BYPASS), its age in seconds and the optimizer that produced it (None
+    when it came from the cache or another request's run). Warm clustering
+    depends on earlier requests and profiles are wanted fresh, so those
+    always run, as does anything asked with refresh (Cache-Control:
+    no-cache); refreshed results still replace the cached one. Identical
+    requests arriving while one is being solved wait for it and share its
+    result. With the cache turned off every answer is a BYPASS.
+    """
+    caching = result_cache.max_entries > 0
+    key = None
+    if options['clustering'] != 'warm' and not options['profile']:
+        key = cache_key(riders, drivers, options)
+        if caching and not refresh:
+            result, age = result_cache.get(key)
+            if result is not None:
+                return result, 'HIT', age, None
+    
+    def solve():
+        with solve_limiter.slot():
+            optimizer = new_optimizer()
+            result = optimizer.optimize(riders, drivers, **options)
+        record_result(optimizer, result)
+        if key is not None and result.get('success'):
+            result_cache.put(key, result, len(riders))
+        return result, optimizer
+    
+    if key is None or refresh:
+        result, optimizer = solve()
+        return result, 'BYPASS', 0, optimizer
+    
+    (result, optimizer), shared = in_flight.run(key, solve)
+    if not caching:
+        return result, 'BYPASS', 0, None if shared else optimizer
+    if shared:
+        return result, 'HIT', 0, None
+    return result, 'MISS', 0, optimizer
+
+
+def overloaded(error):
+    """429 for a request turned away by the solve limiter or a full job queue"""
+    telemetry.observe_rejection('overloaded')
+    response = jsonify({'success': False, 'error': f'Server busy: {error}'})
+    response.headers['Retry-After'] = str(RETRY_AFTER_S)
+    return response, 429
+
+
+@app.before_request
+def limit_request_size():
+    """Refuse bodies over MAX_REQUEST_MB from their declared length, before reading them"""
+    limit = app.config['MAX_CONTENT_LENGTH']
+    if limit and request.content_length and request.content_length > limit:
+        telemetry.observe_rejection('too_large')
+        return jsonify({'success': False, 'error': f'Request body larger than {limit} bytes'}), 413
 
 
 @app.route('/api/health', methods=['GET'])
@@ -19,6 +155,89 @@ def health_check():
     return jsonify({'status': 'healthy', 'message': 'Ride-sharing optimizer API is running'})
 
 
+def parse_optimize_request(data):
+    """Riders, drivers and optimize() options of an optimize request, or an error message"""
+    if not data:
+        return None, None, None, 'No data provided'
+    
+    riders = data.get('riders', [])
+    drivers = data.get('drivers', [])
+    
+    if not riders:
+        return None, None, None, 'No riders provided'
+    
+    if not drivers:
+        return None, None, None, 'No drivers provided'
+    
+    options = {
+        'deadline_ms': data.get('deadline_ms'),
+        'pickup_radius_km': data.get('pickup_radius_km'),
+        'clustering': data.get('clustering', 'kmeans'),
+        'mode': data.get('mode', 'cluster'),
+        'max_detour_factor': data.get('max_detour_factor', MAX_DETOUR_FACTOR),
+        'profile': bool(data.get('profile', False)),
+        'tile_km': data.get('tile_km'),
+        'overlap_km': data.get('overlap_km', SHARD_OVERLAP_KM)
+    }
+    error = options_error(options)
+    if error:
+        return None, None, None, error
+    return riders, drivers, options, None
+
+
+def options_error(options):
+    """Why optimize() options taken from a request cannot be used, or None"""
+    if options['clustering'] not in CLUSTERING_METHODS:
+        return f"Unknown clustering method: {options['clustering']}"
+    if options['mode'] not in OPTIMIZE_MODES:
+        return f"Unknown optimization mode: {options['mode']}"
+    tile_km, overlap_km = options['tile_km'], options['overlap_km']
+    if tile_km is not None and not (is_number(tile_km) and tile_km > 0):
+        return f"tile_km must be a positive number of km: {tile_km}"
+    if not (is_number(overlap_km) and overlap_km >= 0):
+        return f"overlap_km must be a non-negative number of km: {overlap_km}"
+    return None
+
+
+def is_number(value):
+    """Whether a request value is a real number (JSON true and false are not)"""
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def parse_response_options(values):
+    """
+    Response shape and encoder from a JSON body, form or query string,
+    or an error message
+    """
+    polyline = values.get('polyline', False)
+    options = {
+        'response': values.get('response', 'full'),
+        'polyline': polyline.lower() in ('1', 'true') if isinstance(polyline, str) else bool(polyline),
+        'encoder': values.get('encoder', 'json')
+    }
+    if options['response'] not in RESPONSE_FORMATS:
+        return None, f"Unknown response format: {options['response']}"
+    if options['encoder'] not in ENCODERS:
+        return None, f"Unknown encoder: {options['encoder']}"
+    if options['encoder'] == 'orjson' and not has_orjson():
+        return None, "The orjson encoder is not available on this server (orjson is not installed)"
+    return options, None
+
+
+def send_result(result, options, optimizer=None):
+    """
+    A result as JSON in the requested shape; the encode time goes out as a
+    Server-Timing header and, with the payload size, into /api/metrics.
+    optimizer, the one that just produced result, builds compact responses
+    from its rider table and routes.
+    """
+    body, encode_ms = serialize_result(result, optimizer=optimizer, **options)
+    telemetry.observe_response(options['response'], options['encoder'], len(body), encode_ms / 1000)
+    response = Response(body, mimetype='application/json')
+    response.headers['Server-Timing'] = f'encode;dur={encode_ms:.1f}'
+    return response
+
+
 @app.route('/api/optimize', methods=['POST'])
 def optimize_rides():
     """
@@ -26,39 +245,223 @@ def optimize_rides():
     Expected JSON format:
     {
         "riders": [
-            {"id": 1, "pickup": [lat, lon], "dropoff": [lat, lon]},
+            {"id": 1, "pickup": [lat, lon], "dropoff": [lat, lon], "max_wait_time": 15},
             ...
         ],
         "drivers": [
             {"id": 1, "location": [lat, lon], "capacity": 4},
             ...
-        ]
+        ],
+        "deadline_ms": 2000,  (optional overall latency budget)
+        "pickup_radius_km": 5,  (optional limit on driver-to-pickup distance)
+        "clustering": "kmeans",  (optional: kmeans, minibatch, grid or warm)
+        "mode": "cluster",  (optional: cluster, joint or shareability)
+        "max_detour_factor": 1.5,  (optional longest ride as a multiple of the direct trip; null for none)
+        "profile": false,  (optional: add a cProfile summary to the metrics)
+        "tile_km": 5,  (optional: optimize in geographic tiles of this size, for metro-wide batches)
+        "overlap_km": 1,  (optional: how far drivers reach into neighbouring tiles when reconciling)
+        "response": "full",  (optional: compact lists every location once and routes by table row)
+        "polyline": false,  (optional, compact only: coordinates as encoded polylines)
+        "encoder": "json"  (optional: json or orjson, faster for large batches)
     }
+    Identical requests within RESULT_CACHE_TTL_S get the stored result; the
+    X-Cache header says HIT, MISS or BYPASS, and Cache-Control: no-cache
+    forces a fresh run. Answers 429 with Retry-After when every solve slot
+    and queue place of this worker is taken.
     """
     try:
-        data = request.json
+        riders, drivers, options, error = parse_optimize_request(request.json)
+        if error:
+            return jsonify({'success': False, 'error': error}), 400
         
-        if not data:
-            return jsonify({'success': False, 'error': 'No data provided'}), 400
+        response_options, error = parse_response_options(request.json)
+        if error:
+            return jsonify({'success': False, 'error': error}), 400
         
-        riders = data.get('riders', [])
-        drivers = data.get('drivers', [])
+        refresh = 'no-cache' in request.headers.get('Cache-Control', '')
+        result, cache_status, age, optimizer = cached_optimize(riders, drivers, options, refresh)
         
-        if not riders:
+        response = send_result(result, response_options, optimizer)
+        response.headers['X-Cache'] = cache_status
+        if cache_status == 'HIT':
+            response.headers['Age'] = str(int(age))
+        return response
+    
+    except Overloaded as e:
+        return overloaded(e)
+    
+    except Exception as e:
+        telemetry.observe_failure()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@app.route('/api/optimize/bulk', methods=['POST'])
+def optimize_bulk():
+    """
+    Optimize riders and drivers uploaded as bulk files
+    Expects multipart form data:
+        riders, drivers: files in NDJSON, CSV, Parquet or Arrow (picked by
+            extension, or by the 'format' field)
+        output: json (default) for the usual response, or a columnar format
+            for one row per rider (see ingest.MATCH_COLUMNS)
+        deadline_ms, pickup_radius_km, clustering, mode, max_detour_factor,
+            profile, tile_km, overlap_km: as for /api/optimize
+        response, polyline, encoder: as for /api/optimize, with output json
+    """
+    try:
+        if 'riders' not in request.files or 'drivers' not in request.files:
+            return jsonify({'success': False, 'error': 'Upload riders and drivers files'}), 400
+        
+        fmt = request.form.get('format')
+        output = request.form.get('output', 'json')
+        if output != 'json' and output not in FORMATS:
+            return jsonify({'success': False, 'error': f'Unknown output format: {output}'}), 400
+        
+        response_options, error = parse_response_options(request.form)
+        if error:
+            return jsonify({'success': False, 'error': error}), 400
+        
+        try:
+            rider_file, driver_file = request.files['riders'], request.files['drivers']
+            riders = read_riders(rider_file.stream, detect_format(rider_file.filename or '', fmt))
+            drivers = read_drivers(driver_file.stream, detect_format(driver_file.filename or '', fmt))
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        
+        if not len(riders):
             return jsonify({'success': False, 'error': 'No riders provided'}), 400
         
-        if not drivers:
+        if not len(drivers):
             return jsonify({'success': False, 'error': 'No drivers provided'}), 400
         
-        # Run optimization
-        result = optimizer.optimize(riders, drivers)
+        options = {
+            'deadline_ms': request.form.get('deadline_ms', type=float),
+            'pickup_radius_km': request.form.get('pickup_radius_km', type=float),
+            'clustering': request.form.get('clustering', 'kmeans'),
+            'mode': request.form.get('mode', 'cluster'),
+            'max_detour_factor': request.form.get('max_detour_factor', MAX_DETOUR_FACTOR, type=float),
+            'profile': request.form.get('profile', 'false').lower() in ('1', 'true'),
+            'tile_km': request.form.get('tile_km', type=float),
+            'overlap_km': request.form.get('overlap_km', SHARD_OVERLAP_KM, type=float)
+        }
+        error = options_error(options)
+        if error:
+            return jsonify({'success': False, 'error': error}), 400
         
-        return jsonify(result)
+        with solve_limiter.slot():
+            optimizer = new_optimizer()
+            result = optimizer.optimize(riders, drivers, **options)
+        record_result(optimizer, result)
+        
+        if output == 'json':
+            return send_result(result, response_options, optimizer)
+        
+        buffer = io.BytesIO()
+        write_matches(result, buffer, output)
+        return Response(buffer.getvalue(), mimetype=FORMAT_MIMETYPES[output])
+    
+    except Overloaded as e:
+        return overloaded(e)
     
     except Exception as e:
+        telemetry.observe_failure()
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+@app.route('/api/jobs', methods=['POST'])
+def submit_job():
+    """
+    Queue an optimization and return at once
+    Takes the same JSON as /api/optimize and answers 202 with the job's
+    status; poll /api/jobs/<job_id> and fetch /api/jobs/<job_id>/result.
+    Answers 429 while MAX_QUEUED_JOBS jobs are already waiting.
+    """
+    try:
+        riders, drivers, options, error = parse_optimize_request(request.json)
+        if error:
+            return jsonify({'success': False, 'error': error}), 400
+        
+        queued = jobs.counts()['queued']
+        if queued >= QUEUED_JOBS_LIMIT:
+            return overloaded(f'{queued} jobs queued')
+        
+        job = jobs.submit(riders, drivers, **options)
+        return jsonify({'success': True, **job.to_dict()}), 202
+    
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """Status, current stage and progress of a job"""
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Unknown job'}), 404
+    
+    return jsonify({'success': True, **job.to_dict()})
+
+
+@app.route('/api/jobs/<job_id>/result', methods=['GET'])
+def job_result(job_id):
+    """
+    The optimization result of a finished job; 202 while it is still queued
+    or running. Query parameters response, polyline and encoder work as for
+    /api/optimize.
+    """
+    response_options, error = parse_response_options(request.args)
+    if error:
+        return jsonify({'success': False, 'error': error}), 400
+    
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Unknown job'}), 404
+    
+    if not job.finished:
+        return jsonify({'success': False, **job.to_dict()}), 202
+    
+    if job.status != 'done':
+        return jsonify({'success': False, **job.to_dict()}), 409
+    
+    return send_result(job.result, response_options)
+
+
+@app.route('/api/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    """Cancel a queued or running job"""
+    job = jobs.cancel(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Unknown job'}), 404
+    
+    return jsonify({'success': True, **job.to_dict()})
+
+
+@app.route('/api/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Optimization timings, solver outcomes, jobs and caches in Prometheus format"""
+    gauges = {'jobs': ('Optimization jobs by status', {
+        (('status', status),): count for status, count in jobs.counts().items()
+    })}
+    cache = get_distance_cache()
+    if cache is not None:
+        stats = cache.stats()
+        gauges['distance_cache_entries'] = ('Node pairs in the distance cache', {(): stats['size']})
+        gauges['distance_cache_lookups'] = ('Distance cache lookups since start', {
+            (('result', 'hit'),): stats['hits'], (('result', 'miss'),): stats['misses']
+        })
+    solves = solve_limiter.stats()
+    gauges['solves'] = ('Solves of this worker by state', {
+        (('state', 'active'),): solves['active'], (('state', 'queued'),): solves['queued']
+    })
+    stats = result_cache.stats()
+    gauges['result_cache_entries'] = ('Optimization results in the result cache', {(): stats['size']})
+    gauges['result_cache_lookups'] = ('Result cache lookups since start', {
+        (('result', 'hit'),): stats['hits'], (('result', 'miss'),): stats['misses']
+    })
+    gauges['shared_solves'] = ('Requests that shared the running solve of an identical one', {(): in_flight.shared})
+    return Response(telemetry.render(gauges), mimetype='text/plain; version=0.0.4')
+
+
 @app.route('/api/generate-sample', methods=['GET'])
 def generate_sample_data():
     """Generate sample riders and drivers for testing"""
@@ -166,8 +569,13 @@ if __name__ == '__main__':
     print("\nAvailable endpoints:")
     print("  GET  /api/health           - Health check")
     print("  POST /api/optimize         - Optimize rides")
+    print("  POST /api/jobs             - Submit an optimization job")
+    print("  GET  /api/jobs/<id>        - Job status and progress")
+    print("  GET  /api/jobs/<id>/result - Job result")
+    print("  DELETE /api/jobs/<id>      - Cancel a job")
     print("  GET  /api/generate-sample  - Generate sample data")
     print("  POST /api/calculate-savings - Calculate savings")
+    print("\nDevelopment server; in production run: gunicorn -c gunicorn.conf.py wsgi:app")
     print("\n" + "="*60 + "\n")
     
     app.run(debug=True, host='0.0.0.0', port=5001)
@@ -0,0 +1,69 @@
+"""
+Benchmark of OR-Tools transit callbacks: Python closures vs native matrices
+Runs the optimizer's own route search (search_routing_model) with the same
+time limit on both kinds of model and compares how much of the search each
+gets through per second
+"""
+
+import numpy as np
+from typing import Dict
+
+from optimizer import build_pickup_delivery_model, haversine_matrix, search_routing_model
+
+
+def random_route(n_riders: int, seed: int = 0) -> np.ndarray:
+    """Driver start, pickups and dropoffs scattered over Manhattan"""
+    rng = np.random.default_rng(seed)
+    n = 1 + 2 * n_riders
+    return np.column_stack([rng.uniform(40.70, 40.80, n), rng.uniform(-74.02, -73.93, n)])
+
+
+def run_search(meter_matrix: np.ndarray, capacity: int, native_callbacks: bool,
+               time_limit_ms: int) -> Dict:
+    """
+    Search one model as route solves do, for up to time_limit_ms, and report
+    the solver counters per second of search
+    """
+    manager, routing = build_pickup_delivery_model(meter_matrix, capacity, native_callbacks)
+    
+    solution = search_routing_model(routing, time_limit_ms)
+    solver = routing.solver()
+    seconds = solver.WallTime() / 1000
+    
+    return {
+        'branches_per_s': solver.Branches() / seconds,
+        'neighbors_per_s': solver.AcceptedNeighbors() / seconds,
+        'solutions': solver.Solutions(),
+        'objective_m': solution.ObjectiveValue() if solution else None
+    }
+
+
+def benchmark_callbacks(sizes=(4, 8, 16), capacity: int = 4, time_limit_ms: int = 1000) -> Dict:
+    """Compare Python and native callbacks on routes with each number of riders"""
+    results = {}
+    for n_riders in sizes:
+        meter_matrix = haversine_matrix(random_route(n_riders), meters=True)
+        python = run_search(meter_matrix, capacity, False, time_limit_ms)
+        native = run_search(meter_matrix, capacity, True, time_limit_ms)
+        results[n_riders] = {
+            'python': python,
+            'native': native,
+            'speedup': native['neighbors_per_s'] / max(python['neighbors_per_s'], 1e-9)
+        }
+    return results
+
+
+if __name__ == "__main__":
+    print("\n" + "=" * 60)
+    print("OR-Tools Callback Benchmark (up to 1 s of route search per model)")
+    print("=" * 60)
+    
+    for n_riders, result in benchmark_callbacks().items():
+        print(f"\n{n_riders} riders:")
+        for name in ('python', 'native'):
+            run = result[name]
+            print(f"  {name:>6}: {run['neighbors_per_s']:8.0f} moves/s, "
+                  f"{run['branches_per_s']:8.0f} branches/s, best {run['objective_m']} m")
+        print(f"  speedup: {result['speedup']:.2f}x")
+    
+    print("\n" + "=" * 60 + "\n")
@@ -0,0 +1,61 @@
+"""
+Benchmark of the cluster-first, joint and shareability optimization modes
+Runs every mode on the same seeded random cities under the same deadline
+and compares matched riders, route kilometers and wall time
+"""
+
+import numpy as np
+from typing import Dict, List, Tuple
+
+from optimizer import RideSharingOptimizer, OPTIMIZE_MODES
+
+
+def random_city(n_riders: int, n_drivers: int, capacity: int = 4,
+                seed: int = 0) -> Tuple[List[Dict], List[Dict]]:
+    """Riders with trips of up to ~2 km and drivers scattered over Manhattan"""
+    rng = np.random.default_rng(seed)
+    pickups = np.column_stack([rng.uniform(40.70, 40.80, n_riders), rng.uniform(-74.02, -73.93, n_riders)])
+    dropoffs = pickups + rng.uniform(-0.02, 0.02, (n_riders, 2))
+    locations = np.column_stack([rng.uniform(40.70, 40.80, n_drivers), rng.uniform(-74.02, -73.93, n_drivers)])
+    
+    riders = [
+        {'id': i + 1, 'pickup': pickups[i].tolist(), 'dropoff': dropoffs[i].tolist()}
+        for i in range(n_riders)
+    ]
+    drivers = [
+        {'id': i + 1, 'location': locations[i].tolist(), 'capacity': capacity}
+        for i in range(n_drivers)
+    ]
+    return riders, drivers
+
+
+def benchmark_modes(sizes=((20, 5), (60, 15), (120, 30)), deadline_ms: float = 2000) -> Dict:
+    """Optimize each (riders, drivers) city with every mode under deadline_ms"""
+    results = {}
+    for n_riders, n_drivers in sizes:
+        riders, drivers = random_city(n_riders, n_drivers)
+        results[(n_riders, n_drivers)] = {}
+        for mode in OPTIMIZE_MODES:
+            metrics = RideSharingOptimizer().optimize(riders, drivers, deadline_ms=deadline_ms,
+                                                      mode=mode)['metrics']
+            results[(n_riders, n_drivers)][mode] = {
+                'riders_matched': metrics['riders_matched'],
+                'total_distance': metrics['total_distance'],
+                'km_per_rider': round(metrics['total_distance'] / max(metrics['riders_matched'], 1), 3),
+                'elapsed_ms': metrics['elapsed_ms']
+            }
+    return results
+
+
+if __name__ == "__main__":
+    print("\n" + "=" * 60)
+    print("Optimization Mode Benchmark (2 s deadline)")
+    print("=" * 60)
+    
+    for (n_riders, n_drivers), result in benchmark_modes().items():
+        print(f"\n{n_riders} riders, {n_drivers} drivers:")
+        for mode, run in result.items():
+            print(f"  {mode:>12}: {run['riders_matched']:4d} matched, {run['total_distance']:8.2f} km "
+                  f"({run['km_per_rider']:.3f} km/rider) in {run['elapsed_ms']:7.1f} ms")
+    
+    print("\n" + "=" * 60 + "\n")
@@ -0,0 +1,135 @@
+"""
+Startup benchmark of the API server's workers
+Times how long a cold worker (a fresh interpreter importing the app) and a
+warm one (forked from a master that preloaded and warmed up the app, as
+gunicorn does with preload_app) take to answer their first optimization,
+and what a request costs once either is running
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import numpy as np
+from typing import Dict, List
+
+from benchmark_modes import random_city
+
+# Runs in a fresh interpreter; times are from its first line
+COLD_WORKER = '''
+import json, sys, time
+start = time.perf_counter()
+from app import app
+imported = time.perf_counter()
+client = app.test_client()
+payload = json.loads(sys.stdin.read())
+status = client.post('/api/optimize', json=payload, headers={'Cache-Control': 'no-cache'}).status_code
+first = time.perf_counter()
+client.post('/api/optimize', json=payload, headers={'Cache-Control': 'no-cache'})
+print(json.dumps({'import_ms': (imported - start) * 1000, 'ready_ms': (first - start) * 1000,
+                  'first_request_ms': (first - imported) * 1000,
+                  'next_request_ms': (time.perf_counter() - first) * 1000, 'status': status}))
+'''
+
+
+def cold_worker(payload: Dict) -> Dict:
+    """A fresh interpreter imports the app and serves two requests"""
+    start = time.perf_counter()
+    run = subprocess.run([sys.executable, '-c', COLD_WORKER], input=json.dumps(payload),
+                         capture_output=True, text=True, check=True,
+                         cwd=os.path.dirname(os.path.abspath(__file__)))
+    times = json.loads(run.stdout.strip().splitlines()[-1])
+    times['process_ms'] = (time.perf_counter() - start) * 1000
+    return times
+
+
+def warm_worker(payload: Dict) -> Dict:
+    """
+    A child forked from this process, which has the app imported and warmed
+    up, serves two requests. Times count from just before the fork.
+    """
+    from app import app
+    
+    read_end, write_end = os.pipe()
+    start = time.perf_counter()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os.close(read_end)
+            forked = time.perf_counter()
+            client = app.test_client()
+            status = client.post('/api/optimize', json=payload, headers={'Cache-Control': 'no-cache'}).status_code
+            first = time.perf_counter()
+            client.post('/api/optimize', json=payload, headers={'Cache-Control': 'no-cache'})
+            times = {'fork_ms': (forked - start) * 1000, 'ready_ms': (first - start) * 1000,
+                     'first_request_ms': (first - forked) * 1000,
+                     'next_request_ms': (time.perf_counter() - first) * 1000, 'status': status}
+            with os.fdopen(write_end, 'w') as pipe:
+                pipe.write(json.dumps(times))
+        finally:
+            os._exit(0)
+    
+    os.close(write_end)
+    with os.fdopen(read_end) as pipe:
+        times = json.loads(pipe.read())
+    os.waitpid(pid, 0)
+    times['process_ms'] = (time.perf_counter() - start) * 1000
+    return times
+
+
+def median_times(runs: List[Dict]) -> Dict:
+    return {key: round(float(np.median([run[key] for run in runs])), 1)
+            for key in runs[0] if key != 'status'}
+
+
+def benchmark_startup(n_riders: int = 20, n_drivers: int = 5, repeats: int = 3) -> Dict:
+    """Median cold and warm worker times over repeats, on one random city"""
+    if not hasattr(os, 'fork'):
+        raise RuntimeError("Warm workers are forked, which this platform does not support")
+    
+    riders, drivers = random_city(n_riders, n_drivers)
+    payload = {'riders': riders, 'drivers': drivers}
+    
+    cold = [cold_worker(payload) for _ in range(repeats)]
+    
+    # A preloading master imports the app (as long as a cold worker does) and warms up once
+    from app import app  # noqa: F401
+    from serving import warm_up
+    start = time.perf_counter()
+    warm_up()
+    warm_up_ms = (time.perf_counter() - start) * 1000
+    warm = [warm_worker(payload) for _ in range(repeats)]
+    
+    if any(run['status'] != 200 for run in cold + warm):
+        raise RuntimeError("A worker failed its optimization request")
+    return {'riders': n_riders, 'drivers': n_drivers, 'repeats': repeats,
+            'warm_up_ms': round(warm_up_ms, 1), 'cold': median_times(cold), 'warm': median_times(warm)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare cold and preloaded worker startup")
+    parser.add_argument('--riders', type=int, default=20)
+    parser.add_argument('--drivers', type=int, default=5)
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args(argv)
+    
+    print("\n" + "=" * 60)
+    print("Worker Startup Benchmark")
+    print("=" * 60)
+    
+    result = benchmark_startup(args.riders, args.drivers, args.repeats)
+    cold, warm = result['cold'], result['warm']
+    print(f"\n{result['riders']} riders, {result['drivers']} drivers, median of {result['repeats']} runs")
+    print(f"\n  cold worker: ready in {cold['ready_ms']:7.1f} ms (import {cold['import_ms']:.1f} ms, "
+          f"first request {cold['first_request_ms']:.1f} ms), then {cold['next_request_ms']:.1f} ms per request")
+    print(f"  warm worker: ready in {warm['ready_ms']:7.1f} ms (fork {warm['fork_ms']:.1f} ms, "
+          f"first request {warm['first_request_ms']:.1f} ms), then {warm['next_request_ms']:.1f} ms per request")
+    print(f"\n  the master pays the import once, plus {result['warm_up_ms']:.1f} ms to warm up")
+    
+    print("\n" + "=" * 60 + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,278 @@
+"""
+Benchmark suite for the ride-sharing optimizer
+Optimizes seeded synthetic cities of 10 to 100k riders, times every pipeline
+stage, measures peak memory and solution quality, and stores the results as
+JSON so runs on different commits can be compared
+"""
+
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+import numpy as np
+from typing import Dict, List, Optional, Tuple
+
+from optimizer import (RideSharingOptimizer, CostProvider, HaversineCostProvider,
+                       RIDER_DTYPE, DRIVER_DTYPE, UNASSIGNED, get_distance_cache)
+
+DISTRIBUTIONS = ('uniform', 'hotspot', 'commute')
+DEFAULT_SIZES = (10, 100, 1000, 10000)  # pass --sizes ... 100000 for the largest city
+RIDERS_PER_DRIVER = 4
+STAGES = ('clustering', 'assignment', 'matrix', 'routing', 'serialization')
+
+# Sample area: Manhattan, NYC (roughly), the same box as /api/generate-sample
+LAT_RANGE = (40.70, 40.80)
+LON_RANGE = (-74.02, -73.93)
+MIDTOWN = (40.754, -73.984)  # commute-peak destination
+HOTSPOTS = 6
+HOTSPOT_SHARE = 0.7  # riders starting at a hotspot; the rest start anywhere
+
+# Quality and speed changes beyond these count as regressions
+MAX_SLOWDOWN = 1.25
+MIN_SLOWDOWN_MS = 50  # below this, timing differences are noise
+MAX_SAVINGS_DROP = 2.0  # percentage points
+MAX_MATCHED_DROP = 0.02
+
+
+def synthetic_city(n_riders: int, distribution: str = 'uniform', n_drivers: Optional[int] = None,
+                   capacity: int = 4, seed: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Seeded riders and drivers as RIDER_DTYPE and DRIVER_DTYPE arrays.
+    
+    uniform: pickups anywhere, trips of up to ~2 km
+    hotspot: most pickups around a few busy spots (stations, venues)
+    commute: pickups anywhere, dropoffs packed around Midtown
+    """
+    if distribution not in DISTRIBUTIONS:
+        raise ValueError(f"Unknown distribution: {distribution}. Use one of {DISTRIBUTIONS}")
+    
+    rng = np.random.default_rng(seed)
+    n_drivers = n_drivers or max(n_riders // RIDERS_PER_DRIVER, 1)
+    
+    def anywhere(n):
+        return np.column_stack([rng.uniform(*LAT_RANGE, n), rng.uniform(*LON_RANGE, n)])
+    
+    pickups = anywhere(n_riders)
+    if distribution == 'hotspot':
+        centers = anywhere(HOTSPOTS)
+        at_hotspot = rng.random(n_riders) < HOTSPOT_SHARE
+        spots = rng.integers(HOTSPOTS, size=at_hotspot.sum())
+        pickups[at_hotspot] = centers[spots] + rng.normal(0, 0.004, (len(spots), 2))
+    
+    if distribution == 'commute':
+        dropoffs = np.array(MIDTOWN) + rng.normal(0, 0.005, (n_riders, 2))
+    else:
+        dropoffs = pickups + rng.uniform(-0.02, 0.02, (n_riders, 2))
+    
+    riders = np.zeros(n_riders, dtype=RIDER_DTYPE)
+    riders['id'] = np.arange(1, n_riders + 1)
+    riders['pickup_lat'], riders['pickup_lon'] = pickups.T
+    riders['dropoff_lat'], riders['dropoff_lon'] = dropoffs.T
+    riders['max_wait_time'] = 15
+    riders['assigned_driver'] = UNASSIGNED
+    
+    drivers = np.zeros(n_drivers, dtype=DRIVER_DTYPE)
+    drivers['id'] = np.arange(1, n_drivers + 1)
+    drivers['lat'], drivers['lon'] = anywhere(n_drivers).T
+    drivers['capacity'] = capacity
+    return riders, drivers
+
+
+class TimedCostProvider(CostProvider):
+    """Wraps a cost provider and adds up the time spent building route matrices"""
+    
+    def __init__(self, provider: CostProvider):
+        self.provider = provider
+        self.matrix_seconds = 0.0
+    
+    def _timed(self, build, coords):
+        start = time.perf_counter()
+        try:
+            return build(coords)
+        finally:
+            self.matrix_seconds += time.perf_counter() - start
+    
+    def distance_matrix(self, coords: np.ndarray) -> np.ndarray:
+        return self._timed(self.provider.distance_matrix, coords)
+    
+    def duration_matrix(self, coords: np.ndarray) -> np.ndarray:
+        return self._timed(self.provider.duration_matrix, coords)
+    
+    def matrices(self, coords: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        return self._timed(self.provider.matrices, coords)
+    
+    def pairwise_distance(self, coords_a: np.ndarray, coords_b: np.ndarray) -> np.ndarray:
+        return self.provider.pairwise_distance(coords_a, coords_b)
+    
+    def reach_km(self, minutes) -> np.ndarray:
+        return self.provider.reach_km(minutes)
+
+
+def run_case(riders: np.ndarray, drivers: np.ndarray, deadline_ms: Optional[float] = None,
+             clustering: str = 'kmeans', mode: str = 'cluster', memory: bool = True) -> Dict:
+    """
+    Optimize one city on a single process and report stage times, peak
+    memory and solution quality.
+    
+    Stage boundaries come from optimize()'s progress reports; matrix time is
+    measured inside the cost provider and taken out of routing, so the stage
+    times add up to the whole run. Peak memory is traced in a second run,
+    since tracing slows everything it measures. Both runs start from an
+    empty distance cache.
+    """
+    clear_distance_cache()
+    provider = TimedCostProvider(HaversineCostProvider())
+    marks = {}
+    
+    def progress(stage: str, fraction: float):
+        marks.setdefault(stage, time.perf_counter())
+    
+    start = time.perf_counter()
+    result = RideSharingOptimizer(workers=1, cost_provider=provider).optimize(
+        riders, drivers, deadline_ms=deadline_ms, clustering=clustering, mode=mode, progress=progress
+    )
+    optimized = time.perf_counter()
+    payload = json.dumps(result)
+    finished = time.perf_counter()
+    
+    # Stages that never reported (e.g. no routing) take no time
+    clustering_end = marks.get('assignment', marks.get('routing', optimized))
+    routing_start = marks.get('routing', optimized)
+    stage_ms = {
+        'clustering': (clustering_end - marks.get('clustering', start)) * 1000,
+        'assignment': (routing_start - clustering_end) * 1000,
+        'matrix': provider.matrix_seconds * 1000,
+        'routing': ((optimized - routing_start) - provider.matrix_seconds) * 1000,
+        'serialization': (finished - optimized) * 1000
+    }
+    
+    peak_mb = None
+    if memory:
+        clear_distance_cache()
+        tracemalloc.start()
+        try:
+            RideSharingOptimizer(workers=1).optimize(riders, drivers, deadline_ms=deadline_ms,
+                                                     clustering=clustering, mode=mode)
+            peak_mb = tracemalloc.get_traced_memory()[1] / 2**20
+        finally:
+            tracemalloc.stop()
+    
+    metrics = result['metrics']
+    return {
+        'riders': len(riders),
+        'drivers': len(drivers),
+        'total_ms': round((finished - start) * 1000, 1),
+        'stage_ms': {stage: round(ms, 1) for stage, ms in stage_ms.items()},
+        'peak_memory_mb': None if peak_mb is None else round(peak_mb, 1),
+        'payload_bytes': len(payload),
+        'riders_matched': metrics['riders_matched'],
+        'matched_ratio': round(metrics['riders_matched'] / max(len(riders), 1), 4),
+        'savings_percent': metrics['savings_percent'],
+        'total_distance': metrics['total_distance']
+    }
+
+
+def clear_distance_cache():
+    cache = get_distance_cache()
+    if cache is not None:
+        cache.clear()
+
+
+def git_commit() -> Optional[str]:
+    """HEAD of the checkout the benchmark runs in, if it is a git repository"""
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(sizes=DEFAULT_SIZES, distributions=DISTRIBUTIONS, deadline_ms: Optional[float] = None,
+              clustering: str = 'kmeans', mode: str = 'cluster', seed: int = 0,
+              memory: bool = True) -> Dict:
+    """Run every distribution at every size and collect the results with run details"""
+    # Warm up imports and first-call setup so the first case isn't charged for them
+    RideSharingOptimizer(workers=1).optimize(*synthetic_city(10, seed=seed), clustering=clustering, mode=mode)
+    
+    cases = {}
+    for distribution in distributions:
+        for n_riders in sizes:
+            riders, drivers = synthetic_city(n_riders, distribution, seed=seed)
+            cases[f'{distribution}/{n_riders}'] = run_case(riders, drivers, deadline_ms,
+                                                           clustering, mode, memory)
+    return {
+        'commit': git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'settings': {'deadline_ms': deadline_ms, 'clustering': clustering, 'mode': mode, 'seed': seed},
+        'cases': cases
+    }
+
+
+def compare_results(baseline: Dict, current: Dict) -> List[str]:
+    """Regressions of current against baseline, one line per case and measure"""
+    regressions = []
+    for name, case in current['cases'].items():
+        before = baseline['cases'].get(name)
+        if before is None:
+            continue
+        if case['total_ms'] > max(before['total_ms'] * MAX_SLOWDOWN, before['total_ms'] + MIN_SLOWDOWN_MS):
+            regressions.append(f"{name}: {before['total_ms']:.0f} -> {case['total_ms']:.0f} ms")
+        if case['savings_percent'] < before['savings_percent'] - MAX_SAVINGS_DROP:
+            regressions.append(f"{name}: savings {before['savings_percent']}% -> {case['savings_percent']}%")
+        if case['matched_ratio'] < before['matched_ratio'] - MAX_MATCHED_DROP:
+            regressions.append(f"{name}: matched {before['matched_ratio']:.2%} -> {case['matched_ratio']:.2%}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the optimizer on synthetic cities")
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES))
+    parser.add_argument('--distributions', nargs='+', choices=DISTRIBUTIONS, default=list(DISTRIBUTIONS))
+    parser.add_argument('--deadline-ms', type=float)
+    parser.add_argument('--clustering', default='kmeans')
+    parser.add_argument('--mode', default='cluster')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-memory', action='store_true', help="skip the traced peak-memory run")
+    parser.add_argument('-o', '--output', help="write the results to this JSON file")
+    parser.add_argument('--compare', help="JSON results of an earlier run to check for regressions")
+    args = parser.parse_args(argv)
+    
+    print("\n" + "=" * 60)
+    print("Optimizer Benchmark Suite")
+    print("=" * 60)
+    
+    results = run_suite(args.sizes, args.distributions, args.deadline_ms, args.clustering,
+                        args.mode, args.seed, not args.no_memory)
+    
+    for name, case in results['cases'].items():
+        stages = ', '.join(f"{stage} {case['stage_ms'][stage]:.0f}" for stage in STAGES)
+        memory = '' if case['peak_memory_mb'] is None else f", peak {case['peak_memory_mb']:.1f} MB"
+        print(f"\n{name}: {case['total_ms']:.0f} ms ({stages}){memory}")
+        print(f"  matched {case['matched_ratio']:.1%}, savings {case['savings_percent']}%")
+    
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.output}")
+    
+    regressions = []
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare_results(json.load(f), results)
+        print(f"\n{len(regressions)} regression(s) against {args.compare}")
+        for regression in regressions:
+            print(f"  {regression}")
+    
+    print("\n" + "=" * 60 + "\n")
+    
+    # A failing exit status lets CI stop on a regression
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,355 @@
+"""
+Streaming Dispatcher for continuously arriving ride requests
+Keeps routes live between events and only re-solves the routes an event touches
+"""
+
+import time
+from typing import List, Dict, Tuple, Optional
+
+from optimizer import (RideSharingOptimizer, Rider, Driver, Location, CostProvider,
+                       HaversineCostProvider, COST_PER_KM, location_coords,
+                       route_method, solve_exact_dp, solve_route)
+
+REOPTIMIZE_TIME_LIMIT_MS = 200  # OR-Tools budget when an affected route is too big to solve exactly
+
+
+def cheapest_insertion(start: Location, stops: List[Location], onboard: int, capacity: int,
+                       pickup: Location, dropoff: Location,
+                       cost_provider: Optional[CostProvider] = None) -> Optional[Tuple[int, int, float]]:
+    """
+    Cheapest feasible place to insert a pickup/dropoff pair into a round trip.
+    
+    stops is the route after its start and onboard the load when leaving the
+    start. Returns (i, j, added km): the pickup goes after the first i stops
+    and the dropoff after the first j (j >= i) of the original stops. Returns
+    None when every insertion would exceed the vehicle capacity. Legs are
+    priced by cost_provider, straight-line distance by default.
+    """
+    n = len(stops)
+    coords = location_coords([start] + stops + [pickup, dropoff])
+    dist = (cost_provider or HaversineCostProvider()).distance_matrix(coords).tolist()
+    p, d = n + 1, n + 2
+    
+    # Node at each route position: start, the stops, then back to the start
+    seq = list(range(n + 1)) + [0]
+    
+    # loads[t] = passengers on board after the first t stops
+    loads = [onboard]
+    for stop in stops:
+        loads.append(loads[-1] + (1 if stop.type == 'pickup' else -1))
+    
+    best = None
+    for i in range(n + 1):
+        if loads[i] + 1 > capacity:
+            continue
+        
+        a, b = seq[i], seq[i + 1]
+        pickup_cost = dist[a][p] + dist[p][b] - dist[a][b]
+        peak = loads[i]
+        
+        for j in range(i, n + 1):
+            peak = max(peak, loads[j])
+            if peak + 1 > capacity:
+                break
+            
+            if j == i:
+                added = dist[a][p] + dist[p][d] + dist[d][b] - dist[a][b]
+            else:
+                c, e = seq[j], seq[j + 1]
+                added = pickup_cost + dist[c][d] + dist[d][e] - dist[c][e]
+            
+            if best is None or added < best[2]:
+                best = (i, j, added)
+    
+    return best
+
+
+class StreamingDispatcher:
+    """
+    Stateful dispatcher built on RideSharingOptimizer.
+    
+    A batch can be loaded with load(); after that riders, cancellations,
+    driver moves and completed stops arrive as events. New riders are placed
+    by cheapest insertion among the nearest drivers, and only the routes an
+    event changes are re-solved. Riders no vehicle can take wait in a pending
+    queue and are retried whenever capacity frees up or a driver moves.
+    """
+    
+    def __init__(self, optimizer: RideSharingOptimizer = None, pickup_radius_km: float = 5.0,
+                 candidate_drivers: int = 8):
+        self.optimizer = optimizer or RideSharingOptimizer()
+        self.pickup_radius_km = pickup_radius_km
+        self.candidate_drivers = candidate_drivers
+        self.drivers = {}  # driver id -> Driver
+        self.riders = {}  # rider id -> Rider, until dropped off or cancelled
+        self.onboard = {}  # driver id -> ids of riders already picked up
+        self.pending = []  # rider ids waiting for a vehicle, in arrival order
+        self.completed = 0
+    
+    def _stops(self, driver: Driver) -> List[Location]:
+        """The driver's remaining stops, without its start location"""
+        return list(driver.route[1:])
+    
+    def _set_route(self, driver: Driver, stops: List[Location]):
+        """Store a new stop order and refresh the driver's riders and distance"""
+        driver.route = [driver.location] + stops if stops else []
+        driver.assigned_riders = list(dict.fromkeys(stop.person_id for stop in stops))
+        
+        if stops:
+            coords = location_coords(driver.route + [driver.location])
+            legs = self.optimizer.cost_provider.pairwise_distance(coords[:-1], coords[1:])
+            driver.total_distance = float(legs.sum())
+        else:
+            driver.total_distance = 0
+    
+    def _reoptimize(self, driver: Driver) -> bool:
+        """
+        Re-solve one driver's remaining stops, keeping onboard riders onboard.
+        
+        Routes too big to solve exactly start OR-Tools from the current stop
+        order, which is the route solved at the last event plus whatever
+        changed since, so the search only has to improve on it. Returns
+        whether the route changed.
+        """
+        onboard_ids = self.onboard[driver.id]
+        # Onboard riders first: their pickups are behind the driver, so they sit at its location
+        riders = sorted((self.riders[rider_id] for rider_id in driver.assigned_riders),
+                        key=lambda r: r.id not in onboard_ids)
+        if not riders:
+            return False
+        
+        n_onboard = sum(r.id in onboard_ids for r in riders)
+        locations = [driver.location] + [r.pickup for r in riders] + [r.dropoff for r in riders]
+        coords = location_coords([driver.location] * (n_onboard + 1) + locations[n_onboard + 1:])
+        
+        provider = self.optimizer.cost_provider
+        
+        order = None
+        if route_method(len(riders), self.optimizer.exact_max_nodes) == 'exact':
+            solution = solve_exact_dp(coords, driver.capacity, (1 << n_onboard) - 1, provider.distance_matrix(coords))
+            if solution is not None:
+                order = solution[0][1:]
+        else:
+            # The current route as nodes, with the onboard pickups locked in right after the start
+            nodes = {(stop.type, stop.person_id): node for node, stop in enumerate(locations)}
+            current = [0] + list(range(1, n_onboard + 1)) + [nodes[(stop.type, stop.person_id)]
+                                                             for stop in self._stops(driver)]
+            result = solve_route(coords, driver.capacity, REOPTIMIZE_TIME_LIMIT_MS, 0, provider,
+                                 initial_order=current, locked_stops=n_onboard)
+            if result['order'] is not None:
+                order = result['order'][n_onboard + 1:]
+        
+        # Without a better order the insertion order stands
+        if order is None:
+            return False
+        stops = [locations[node] for node in order]
+        changed = stops != self._stops(driver)
+        self._set_route(driver, stops)
+        return changed
+    
+    def _insert(self, rider: Rider) -> Optional[int]:
+        """Insert a rider into the cheapest nearby route; returns the driver id or None"""
+        candidates = self.optimizer.driver_index.nearest(
+            rider.pickup.lat, rider.pickup.lon,
+            k=self.candidate_drivers, max_radius_km=self.pickup_radius_km
+        )
+        
+        best = None
+        for driver_id, _ in candidates:
+            driver = self.drivers[driver_id]
+            insertion = cheapest_insertion(
+                driver.location, self._stops(driver), len(self.onboard[driver_id]),
+                driver.capacity, rider.pickup, rider.dropoff, self.optimizer.cost_provider
+            )
+            if insertion is not None and (best is None or insertion[2] < best[1][2]):
+                best = (driver, insertion)
+        
+        if best is None:
+            return None
+        
+        driver, (i, j, _) = best
+        stops = self._stops(driver)
+        self._set_route(driver, stops[:i] + [rider.pickup] + stops[i:j] + [rider.dropoff] + stops[j:])
+        rider.assigned_driver = driver.id
+        self._reoptimize(driver)
+        return driver.id
+    
+    def _retry_pending(self) -> List[int]:
+        """Try to place waiting riders; returns the drivers whose routes changed"""
+        affected = []
+        for rider_id in list(self.pending):
+            driver_id = self._insert(self.riders[rider_id])
+            if driver_id is not None:
+                self.pending.remove(rider_id)
+                affected.append(driver_id)
+        return affected
+    
+    def _event(self, event: str, start: float, affected: List[int], **fields) -> Dict:
+        return {
+            'event': event,
+            **fields,
+            'affected_drivers': sorted(set(affected)),
+            'elapsed_ms': round((time.perf_counter() - start) * 1000, 3)
+        }
+    
+    def load(self, riders: List[Dict], drivers: List[Dict], **optimize_kwargs) -> Dict:
+        """Start from a full batch optimization, replacing any current state"""
+        result = self.optimizer.optimize(riders, drivers, **optimize_kwargs)
+        
+        self.drivers = {d.id: d for d in self.optimizer.drivers}
+        self.riders = {r.id: r for r in self.optimizer.riders}
+        self.onboard = {driver_id: set() for driver_id in self.drivers}
+        self.pending = list(result.get('unmatched_riders', []))
+        return result
+    
+    def add_driver(self, driver: Dict) -> Dict:
+        """A driver comes online"""
+        start = time.perf_counter()
+        new = Driver(driver['id'], tuple(driver['location']), driver.get('capacity', 4))
+        
+        self.drivers[new.id] = new
+        self.onboard[new.id] = set()
+        self.optimizer.driver_index.insert(new.id, new.location.lat, new.location.lon)
+        
+        return self._event('driver_added', start, self._retry_pending(), driver_id=new.id)
+    
+    def update_driver(self, driver_id: int, location: Tuple[float, float]) -> Dict:
+        """A driver reports a new position; its remaining route is re-solved from there"""
+        start = time.perf_counter()
+        driver = self.drivers[driver_id]
+        driver.location = Location(location[0], location[1], 'driver', driver_id)
+        self.optimizer.driver_index.insert(driver_id, location[0], location[1])
+        
+        self._set_route(driver, self._stops(driver))
+        self._reoptimize(driver)
+        
+        affected = [driver_id] + self._retry_pending()
+        return self._event('driver_moved', start, affected, driver_id=driver_id)
+    
+    def remove_driver(self, driver_id: int) -> Dict:
+        """A driver goes offline; riders not yet picked up are re-dispatched"""
+        start = time.perf_counter()
+        if self.onboard.get(driver_id):
+            raise ValueError(f'Driver {driver_id} still has riders on board')
+        
+        driver = self.drivers.pop(driver_id)
+        del self.onboard[driver_id]
+        self.optimizer.driver_index.remove(driver_id)
+        
+        affected = []
+        for rider_id in driver.assigned_riders:
+            rider = self.riders[rider_id]
+            rider.assigned_driver = self._insert(rider)
+            if rider.assigned_driver is None:
+                self.pending.append(rider_id)
+            else:
+                affected.append(rider.assigned_driver)
+        
+        return self._event('driver_removed', start, affected, driver_id=driver_id)
+    
+    def add_rider(self, rider: Dict) -> Dict:
+        """A ride request arrives and is inserted into the cheapest nearby route"""
+        start = time.perf_counter()
+        new = Rider(rider['id'], tuple(rider['pickup']), tuple(rider['dropoff']),
+                    rider.get('max_wait_time', 15))
+        self.riders[new.id] = new
+        
+        driver_id = self._insert(new)
+        if driver_id is None:
+            self.pending.append(new.id)
+        
+        affected = [] if driver_id is None else [driver_id]
+        return self._event('rider_added', start, affected, rider_id=new.id, driver_id=driver_id)
+    
+    def cancel_rider(self, rider_id: int) -> Dict:
+        """A rider cancels; their stops leave the route and freed seats are reused"""
+        start = time.perf_counter()
+        rider = self.riders.pop(rider_id)
+        
+        affected = []
+        if rider_id in self.pending:
+            self.pending.remove(rider_id)
+        elif rider.assigned_driver in self.drivers:
+            driver = self.drivers[rider.assigned_driver]
+            self.onboard[driver.id].discard(rider_id)
+            self._set_route(driver, [s for s in self._stops(driver) if s.person_id != rider_id])
+            self._reoptimize(driver)
+            affected = [driver.id] + self._retry_pending()
+        
+        return self._event('rider_cancelled', start, affected, rider_id=rider_id)
+    
+    def tick(self) -> Dict:
+        """
+        One step of rolling-horizon re-optimization: every route is re-solved
+        from where its driver is now, starting from the current route.
+        Insertions are greedy, so routes that took many riders one by one
+        often improve.
+        """
+        start = time.perf_counter()
+        before = sum(driver.total_distance for driver in self.drivers.values())
+        
+        affected = [driver_id for driver_id, driver in self.drivers.items() if self._reoptimize(driver)]
+        
+        after = sum(driver.total_distance for driver in self.drivers.values())
+        return self._event('reoptimized', start, affected, distance_saved=round(before - after, 3))
+    
+    def complete_stop(self, driver_id: int) -> Dict:
+        """The driver reached its next stop, picking up or dropping off a rider"""
+        start = time.perf_counter()
+        driver = self.drivers[driver_id]
+        stops = self._stops(driver)
+        if not stops:
+            raise ValueError(f'Driver {driver_id} has no remaining stops')
+        
+        stop = stops.pop(0)
+        driver.location = Location(stop.lat, stop.lon, 'driver', driver_id)
+        self.optimizer.driver_index.insert(driver_id, stop.lat, stop.lon)
+        
+        affected = [driver_id]
+        if stop.type == 'pickup':
+            self.onboard[driver_id].add(stop.person_id)
+            self._set_route(driver, stops)
+        else:
+            self.onboard[driver_id].discard(stop.person_id)
+            self.riders.pop(stop.person_id, None)
+            self.completed += 1
+            self._set_route(driver, stops)
+            affected += self._retry_pending()
+        
+        return self._event('stop_completed', start, affected, driver_id=driver_id,
+                           rider_id=stop.person_id, stop_type=stop.type)
+    
+    def snapshot(self) -> Dict:
+        """Current routes in the same shape as RideSharingOptimizer.optimize"""
+        matches = []
+        total_distance = 0
+        for driver_id in sorted(self.drivers):
+            driver = self.drivers[driver_id]
+            if not driver.assigned_riders:
+                continue
+            
+            total_distance += driver.total_distance
+            matches.append({
+                'driver_id': driver.id,
+                'driver_location': driver.location.to_dict(),
+                'riders': [self.riders[rider_id].to_dict() for rider_id in driver.assigned_riders],
+                'onboard': sorted(self.onboard[driver.id]),
+                'route': [loc.to_dict() for loc in driver.route],
+                'distance': round(driver.total_distance, 2),
+                'cost': round(driver.total_distance * COST_PER_KM, 2)
+            })
+        
+        return {
+            'success': True,
+            'matches': matches,
+            'unmatched_riders': list(self.pending),
+            'metrics': {
+                'active_riders': len(self.riders),
+                'total_drivers': len(self.drivers),
+                'riders_matched': len(self.riders) - len(self.pending),
+                'riders_pending': len(self.pending),
+                'riders_completed': self.completed,
+                'total_distance': round(total_distance, 2),
+                'total_cost': round(total_distance * COST_PER_KM, 2)
+            }
+        }
@@ -0,0 +1,38 @@
+"""
+Gunicorn settings for serving the API in production
+    gunicorn -c gunicorn.conf.py wsgi:app
+Workers, threads, port and timeouts can be set through the environment;
+solve concurrency and request size limits are the app's own (see serving.py).
+Jobs, the result cache and metrics live in each worker process, so more than
+one worker needs sticky sessions for job polling to find its job
+"""
+
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5001')}"
+workers = int(os.environ.get('WEB_WORKERS', 1))  # one process, so every request sees the same jobs and cache
+worker_class = 'gthread'
+threads = int(os.environ.get('WEB_THREADS', 16))  # cheap requests and polls keep flowing while solves run
+preload_app = True  # import and warm up the solver once in the master, then fork ready workers
+
+timeout = int(os.environ.get('WEB_TIMEOUT_S', 120))  # longest a worker may go silent before it is restarted
+graceful_timeout = 30
+keepalive = 5
+max_requests = int(os.environ.get('WEB_MAX_REQUESTS', 1000))  # recycle workers to bound memory growth
+max_requests_jitter = 100
+
+# Request line and header limits; body size is capped by MAX_REQUEST_MB in the app
+limit_request_line = 8190
+limit_request_fields = 100
+limit_request_field_size = 8190
+
+accesslog = '-'
+
+
+def worker_exit(server, worker):
+    """
+    Save this worker's distance cache when DISTANCE_CACHE_PATH is set; the
+    master never saves its own (see wsgi.py)
+    """
+    from app import save_distance_cache
+    save_distance_cache()
@@ -0,0 +1,276 @@
+"""
+Bulk ingestion for the ride-sharing optimizer
+Reads riders and drivers from NDJSON, CSV, Parquet or Arrow files straight
+into the optimizer's columnar tables and writes matches back out as one row
+per rider, in the same formats, for downstream billing jobs
+"""
+
+import argparse
+import io
+import json
+import os
+import sys
+import warnings
+import numpy as np
+from typing import BinaryIO, Dict, Optional, Union
+
+from optimizer import (RideSharingOptimizer, RIDER_DTYPE, DRIVER_DTYPE, UNASSIGNED,
+                       CLUSTERING_METHODS, OPTIMIZE_MODES, MAX_DETOUR_FACTOR)
+
+FORMATS = ('ndjson', 'csv', 'parquet', 'arrow')
+FORMAT_EXTENSIONS = {
+    '.ndjson': 'ndjson', '.jsonl': 'ndjson', '.csv': 'csv',
+    '.parquet': 'parquet', '.arrow': 'arrow', '.feather': 'arrow', '.ipc': 'arrow'
+}
+FORMAT_MIMETYPES = {
+    'ndjson': 'application/x-ndjson', 'csv': 'text/csv',
+    'parquet': 'application/vnd.apache.parquet', 'arrow': 'application/vnd.apache.arrow.file'
+}
+
+# Input columns: name -> (dtype, default; None when the column is required)
+RIDER_COLUMNS = {
+    'id': (np.int64, None),
+    'pickup_lat': (np.float64, None), 'pickup_lon': (np.float64, None),
+    'dropoff_lat': (np.float64, None), 'dropoff_lon': (np.float64, None),
+    'max_wait_time': (np.float64, 15)
+}
+DRIVER_COLUMNS = {
+    'id': (np.int64, None),
+    'lat': (np.float64, None), 'lon': (np.float64, None),
+    'capacity': (np.int32, 4)
+}
+
+# NDJSON rows may also use the API's nested [lat, lon] pairs
+RIDER_PAIRS = {'pickup': ('pickup_lat', 'pickup_lon'), 'dropoff': ('dropoff_lat', 'dropoff_lon')}
+DRIVER_PAIRS = {'location': ('lat', 'lon')}
+
+# Output: one row per rider, unmatched riders carry driver_id UNASSIGNED
+MATCH_COLUMNS = {
+    'rider_id': np.int64,
+    'driver_id': np.int64,
+    'pickup_eta_min': np.float64,
+    'dropoff_eta_min': np.float64,
+    'route_distance_km': np.float64,
+    'route_cost': np.float64,
+    'riders_sharing': np.int32
+}
+
+Source = Union[str, BinaryIO]
+
+
+def detect_format(source: Source, fmt: Optional[str] = None) -> str:
+    """The explicit format if given, otherwise the one named by the file extension"""
+    if fmt is None:
+        name = source if isinstance(source, str) else getattr(source, 'name', None)
+        fmt = FORMAT_EXTENSIONS.get(os.path.splitext(name if isinstance(name, str) else '')[1].lower())
+        if fmt is None:
+            raise ValueError(f"Can't tell the format of {name!r}; pass one of {FORMATS}")
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format {fmt!r}; use one of {FORMATS}")
+    return fmt
+
+
+def _pyarrow():
+    """Import pyarrow, which Parquet and Arrow files need but the optimizer does not"""
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("Parquet and Arrow files need pyarrow (pip install pyarrow)") from None
+    return pyarrow
+
+
+def _text(source: Source, mode: str):
+    """A text stream over a path or a binary file object"""
+    if isinstance(source, str):
+        return open(source, mode, encoding='utf-8', newline='')
+    return io.TextIOWrapper(source, encoding='utf-8', newline='')
+
+
+def _read_csv(source: Source, columns: Dict) -> Dict[str, np.ndarray]:
+    """Parse the wanted columns with NumPy's C tokenizer, never building row objects"""
+    stream = _text(source, 'r')
+    try:
+        header = [name.strip() for name in stream.readline().strip().split(',')]
+        present = [name for name in columns if name in header]
+        dtype = np.dtype([(name, columns[name][0]) for name in present])
+        usecols = [header.index(name) for name in present]
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', UserWarning)  # header-only files
+            table = np.loadtxt(stream, delimiter=',', dtype=dtype, usecols=usecols, ndmin=1)
+    finally:
+        if isinstance(source, str):
+            stream.close()
+        else:
+            stream.detach()
+    return {name: table[name] for name in present}
+
+
+def _read_ndjson(source: Source, columns: Dict, pairs: Dict) -> Dict[str, np.ndarray]:
+    """Stream one JSON object per line into per-column value lists"""
+    values = {name: [] for name in columns}
+    stream = _text(source, 'r')
+    try:
+        for line_number, line in enumerate(stream, 1):
+            if not line.strip():
+                continue
+            row = json.loads(line)
+            for key, (lat, lon) in pairs.items():
+                if key in row:
+                    row[lat], row[lon] = row[key]
+            for name, (_, default) in columns.items():
+                value = row.get(name, default)
+                if value is None:
+                    raise ValueError(f"Line {line_number} is missing {name!r}")
+                values[name].append(value)
+    finally:
+        if isinstance(source, str):
+            stream.close()
+        else:
+            stream.detach()
+    return {name: np.asarray(column, dtype=columns[name][0]) for name, column in values.items()}
+
+
+def _read_arrow(source: Source, columns: Dict, fmt: str) -> Dict[str, np.ndarray]:
+    """Read only the wanted columns and hand their buffers to NumPy"""
+    pa = _pyarrow()
+    if fmt == 'parquet':
+        parquet = pa.parquet.ParquetFile(source)
+        table = parquet.read(columns=[name for name in columns if name in parquet.schema_arrow.names])
+    else:
+        table = pa.ipc.open_file(source).read_all()
+    return {
+        name: table.column(name).to_numpy().astype(columns[name][0], copy=False)
+        for name in columns if name in table.column_names
+    }
+
+
+def read_columns(source: Source, columns: Dict, pairs: Dict, fmt: str) -> Dict[str, np.ndarray]:
+    """Every column of a file as a NumPy array, defaults filled in for missing optional ones"""
+    if fmt == 'csv':
+        table = _read_csv(source, columns)
+    elif fmt == 'ndjson':
+        table = _read_ndjson(source, columns, pairs)
+    else:
+        table = _read_arrow(source, columns, fmt)
+    
+    n = len(next(iter(table.values()))) if table else 0
+    for name, (dtype, default) in columns.items():
+        if name not in table:
+            if default is None:
+                raise ValueError(f"Missing required column {name!r}")
+            table[name] = np.full(n, default, dtype=dtype)
+    return table
+
+
+def read_riders(source: Source, fmt: Optional[str] = None) -> np.ndarray:
+    """Riders of a bulk file as a RIDER_DTYPE array, ready for RideSharingOptimizer.optimize"""
+    fmt = detect_format(source, fmt)
+    table = read_columns(source, RIDER_COLUMNS, RIDER_PAIRS, fmt)
+    riders = np.empty(len(table['id']), dtype=RIDER_DTYPE)
+    for name in RIDER_COLUMNS:
+        riders[name] = table[name]
+    riders['assigned_driver'] = UNASSIGNED
+    return riders
+
+
+def read_drivers(source: Source, fmt: Optional[str] = None) -> np.ndarray:
+    """Drivers of a bulk file as a DRIVER_DTYPE array, ready for RideSharingOptimizer.optimize"""
+    fmt = detect_format(source, fmt)
+    table = read_columns(source, DRIVER_COLUMNS, DRIVER_PAIRS, fmt)
+    drivers = np.empty(len(table['id']), dtype=DRIVER_DTYPE)
+    for name in DRIVER_COLUMNS:
+        drivers[name] = table[name]
+    return drivers
+
+
+def match_columns(result: Dict) -> Dict[str, np.ndarray]:
+    """Flatten an optimize() result into MATCH_COLUMNS, matched riders first"""
+    n = sum(len(match['etas']) for match in result['matches']) + len(result['unmatched_riders'])
+    table = {name: np.empty(n, dtype=dtype) for name, dtype in MATCH_COLUMNS.items()}
+    
+    row = 0
+    for match in result['matches']:
+        for eta in match['etas']:
+            table['rider_id'][row] = eta['rider_id']
+            table['driver_id'][row] = match['driver_id']
+            table['pickup_eta_min'][row] = eta.get('pickup_eta_min', np.nan)
+            table['dropoff_eta_min'][row] = eta.get('dropoff_eta_min', np.nan)
+            table['route_distance_km'][row] = match['distance']
+            table['route_cost'][row] = match['cost']
+            table['riders_sharing'][row] = len(match['etas'])
+            row += 1
+    
+    unmatched = slice(row, n)
+    table['rider_id'][unmatched] = result['unmatched_riders']
+    table['driver_id'][unmatched] = UNASSIGNED
+    for name in ('pickup_eta_min', 'dropoff_eta_min', 'route_distance_km', 'route_cost'):
+        table[name][unmatched] = np.nan
+    table['riders_sharing'][unmatched] = 0
+    return table
+
+
+def write_matches(result: Dict, target: Union[str, BinaryIO], fmt: Optional[str] = None):
+    """Write an optimize() result to a path or binary file as one row per rider"""
+    fmt = detect_format(target, fmt)
+    table = match_columns(result)
+    
+    if fmt in ('parquet', 'arrow'):
+        pa = _pyarrow()
+        arrow_table = pa.table(table)
+        if fmt == 'parquet':
+            pa.parquet.write_table(arrow_table, target)
+        else:
+            with pa.ipc.new_file(target, arrow_table.schema) as writer:
+                writer.write_table(arrow_table)
+        return
+    
+    stream = _text(target, 'w')
+    try:
+        if fmt == 'csv':
+            formats = ['%d' if np.issubdtype(dtype, np.integer) else '%.6g' for dtype in MATCH_COLUMNS.values()]
+            records = np.rec.fromarrays(list(table.values()), names=list(table))
+            np.savetxt(stream, records, fmt=formats, delimiter=',', header=','.join(MATCH_COLUMNS), comments='')
+        else:
+            names = list(MATCH_COLUMNS)
+            for values in zip(*(table[name].tolist() for name in names)):
+                row = {name: None if value != value else value for name, value in zip(names, values)}
+                stream.write(json.dumps(row) + '\n')
+    finally:
+        stream.flush()
+        if isinstance(target, str):
+            stream.close()
+        else:
+            stream.detach()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Optimize riders and drivers from bulk files")
+    parser.add_argument('riders', help="riders file (.ndjson, .csv, .parquet or .arrow)")
+    parser.add_argument('drivers', help="drivers file (.ndjson, .csv, .parquet or .arrow)")
+    parser.add_argument('-o', '--output', required=True, help="matches file; its extension picks the format")
+    parser.add_argument('--format', choices=FORMATS, help="input format when the extensions don't tell")
+    parser.add_argument('--deadline-ms', type=float)
+    parser.add_argument('--pickup-radius-km', type=float)
+    parser.add_argument('--clustering', choices=CLUSTERING_METHODS, default='kmeans')
+    parser.add_argument('--mode', choices=OPTIMIZE_MODES, default='cluster')
+    parser.add_argument('--max-detour-factor', type=float, default=MAX_DETOUR_FACTOR)
+    parser.add_argument('--workers', type=int, default=1)
+    args = parser.parse_args(argv)
+    
+    riders = read_riders(args.riders, args.format)
+    drivers = read_drivers(args.drivers, args.format)
+    with RideSharingOptimizer(workers=args.workers) as optimizer:
+        result = optimizer.optimize(
+            riders, drivers, deadline_ms=args.deadline_ms, pickup_radius_km=args.pickup_radius_km,
+            clustering=args.clustering, mode=args.mode, max_detour_factor=args.max_detour_factor
+        )
+    write_matches(result, args.output)
+    
+    json.dump(result['metrics'], sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
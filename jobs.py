@@ -0,0 +1,167 @@
+"""
+Asynchronous optimization jobs
+Runs optimizations on a local worker pool and keeps their status, progress
+and results in memory so clients can poll instead of holding a request open
+"""
+
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from typing import Callable, ContextManager, Dict, List, Optional
+
+from optimizer import RideSharingOptimizer
+
+JOB_WORKERS = 2  # optimizations running at once
+MAX_FINISHED_JOBS = 500  # finished jobs kept for polling before the oldest are forgotten
+FINISHED_STATES = ('done', 'failed', 'cancelled')
+
+
+class JobCancelled(Exception):
+    """Raised inside a running optimization once its job is cancelled"""
+
+
+class Job:
+    """One submitted optimization and everything a client can poll about it"""
+    
+    __slots__ = ('id', 'status', 'stage', 'progress', 'result', 'error',
+                 'submitted_at', 'started_at', 'finished_at', 'cancel_requested', 'future')
+    
+    def __init__(self):
+        self.id = uuid.uuid4().hex
+        self.status = 'queued'  # queued -> running -> done | failed | cancelled
+        self.stage = None
+        self.progress = 0.0  # fraction of the current stage completed
+        self.result = None
+        self.error = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.cancel_requested = threading.Event()
+        self.future = None
+    
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED_STATES
+    
+    def to_dict(self):
+        return {
+            'job_id': self.id,
+            'status': self.status,
+            'stage': self.stage,
+            'progress': round(self.progress, 3),
+            'error': self.error,
+            'submitted_at': self.submitted_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at
+        }
+
+
+class JobManager:
+    """
+    In-memory job store in front of a thread pool.
+    
+    Every job runs on a fresh optimizer from optimizer_factory, so concurrent
+    jobs never share rider or driver state; on_finished, if given, sees each
+    successful job's optimizer and result afterwards (e.g. to keep its
+    cluster centers for warm starts). Jobs run in threads, so route solving
+    only spreads over CPU cores when the factory's optimizers use a process
+    pool (workers != 1).
+    
+    solve_slot, if given, is entered around every solve (e.g. a
+    SolveLimiter's background slot), so jobs share the process's solve
+    limit with synchronous requests. A job stays queued until it gets one.
+    
+    Queued jobs are cancelled outright; running jobs stop at their next
+    progress report.
+    """
+    
+    def __init__(self, optimizer_factory: Callable[[], RideSharingOptimizer] = RideSharingOptimizer,
+                 workers: int = JOB_WORKERS, max_finished: int = MAX_FINISHED_JOBS,
+                 on_finished: Optional[Callable[[RideSharingOptimizer, Dict], None]] = None,
+                 solve_slot: Callable[[], ContextManager] = nullcontext):
+        self.optimizer_factory = optimizer_factory
+        self.solve_slot = solve_slot
+        self.max_finished = max_finished
+        self.on_finished = on_finished
+        self.jobs = OrderedDict()  # job id -> Job, in submission order
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='optimize-job')
+    
+    def submit(self, riders: List[Dict], drivers: List[Dict], **options) -> Job:
+        """Queue an optimization; options are passed on to RideSharingOptimizer.optimize"""
+        job = Job()
+        with self._lock:
+            self.jobs[job.id] = job
+            self._evict()
+        job.future = self._executor.submit(self._run, job, riders, drivers, options)
+        return job
+    
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self.jobs.get(job_id)
+    
+    def cancel(self, job_id: str) -> Optional[Job]:
+        """Cancel a job; finished jobs are left as they are"""
+        job = self.get(job_id)
+        if job is None or job.finished:
+            return job
+        
+        job.cancel_requested.set()
+        if job.future.cancel():
+            self._finish(job, 'cancelled')
+        return job
+    
+    def counts(self) -> Dict[str, int]:
+        """Number of known jobs in each status"""
+        with self._lock:
+            statuses = [job.status for job in self.jobs.values()]
+        return {status: statuses.count(status) for status in ('queued', 'running') + FINISHED_STATES}
+    
+    def shutdown(self, wait: bool = True):
+        """Cancel everything still queued and stop the workers"""
+        for job_id in list(self.jobs):
+            job = self.get(job_id)
+            if job is not None and job.status == 'queued':
+                self.cancel(job_id)
+        self._executor.shutdown(wait=wait)
+    
+    def _run(self, job: Job, riders: List[Dict], drivers: List[Dict], options: Dict):
+        def progress(stage: str, fraction: float):
+            if job.cancel_requested.is_set():
+                raise JobCancelled(job.id)
+            job.stage, job.progress = stage, fraction
+        
+        try:
+            with self.solve_slot():
+                if job.cancel_requested.is_set():
+                    raise JobCancelled(job.id)
+                job.status = 'running'
+                job.started_at = time.time()
+                
+                optimizer = self.optimizer_factory()
+                job.result = optimizer.optimize(riders, drivers, progress=progress, **options)
+        except JobCancelled:
+            self._finish(job, 'cancelled')
+        except Exception as e:
+            job.error = str(e)
+            self._finish(job, 'failed')
+        else:
+            job.stage, job.progress = 'done', 1.0
+            self._finish(job, 'done')
+            if self.on_finished is not None:
+                self.on_finished(optimizer, job.result)
+    
+    def _finish(self, job: Job, status: str):
+        with self._lock:
+            if not job.finished:
+                job.status = status
+                job.finished_at = time.time()
+    
+    def _evict(self):
+        """Forget the oldest finished jobs beyond max_finished (caller holds the lock)"""
+        finished = [job_id for job_id, job in self.jobs.items() if job.finished]
+        for job_id in finished[:max(len(finished) - self.max_finished, 0)]:
+            del self.jobs[job_id]
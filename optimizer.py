@@ -4,22 +4,1359 @@ Uses OR-Tools for constraint programming and route optimization
 """
 
 import numpy as np
-from sklearn.cluster import KMeans
+from sklearn.cluster import KMeans, MiniBatchKMeans
+from scipy.spatial import cKDTree
 from scipy.spatial.distance import cdist
+from scipy.optimize import linear_sum_assignment, milp, Bounds, LinearConstraint
+from scipy.sparse import csr_matrix
 from ortools.constraint_solver import routing_enums_pb2
 from ortools.constraint_solver import pywrapcp
+from ortools.graph.python import min_cost_flow
+from concurrent.futures import ProcessPoolExecutor
+from collections import OrderedDict, deque
+from functools import lru_cache, partial
+from abc import ABC, abstractmethod
+import cProfile
+import itertools
 import math
-from typing import List, Dict, Tuple, Optional
+import os
+import pstats
+import threading
+import time
+from typing import Callable, List, Dict, Tuple, Optional
+
+EARTH_RADIUS_KM = 6371  # Earth's radius in kilometers
+COST_PER_KM = 2.5  # fare in dollars per route kilometer
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180  # length of one degree of latitude
+AVERAGE_SPEED_KMH = 30  # travel speed where no road-network times are available
+MAX_ROAD_SPEED_KMH = 100  # fastest average speed assumed when pruning with road-network times
+
+DEFAULT_ROUTE_TIME_LIMIT_MS = 5000  # per-driver limit when no deadline is given
+MIN_ROUTE_TIME_LIMIT_MS = 10  # smaller budgets (and searches past the deadline) only build a first solution
+IMPROVEMENT_RATE_COEFFICIENT = 0.05  # a search stops once improving this much slower than at its best...
+IMPROVEMENT_RATE_SOLUTIONS = 50  # ...measured over this many improving solutions
+SEARCH_MAX_SOLUTIONS = 200  # solutions a search goes through at most, so small routes stop early
+FALLBACK_ROUTE_TIME_LIMIT_MS = 100  # floor for exact routes that cannot serve every rider in time (they have no budget)
+CLUSTERING_METHODS = ('kmeans', 'minibatch', 'grid', 'warm')
+CAPACITY_REFINE_ITERATIONS = 5  # capacitated re-clustering passes in optimize()
+UNREACHABLE_COST = 1e9  # assignment cost of a pairing outside the pickup radius
+EXACT_ASSIGNMENT_MAX_CELLS = 4_000_000  # largest rider x seat matrix solved with the Hungarian method
+ASSIGNMENT_CANDIDATE_CLUSTERS = 20  # nearest clusters a rider may be seated in above that size
+EXACT_MAX_NODES = 9  # routes up to this many nodes are solved exactly (capacity 4 by default)
+OPTIMIZE_MODES = ('cluster', 'joint', 'shareability')
+JOINT_REGION_MAX_VEHICLES = 25  # vehicles per multi-vehicle model in joint mode
+RIDER_DROP_PENALTY_KM = 100  # route km a solver would rather drive than leave a rider unserved
+MAX_DETOUR_FACTOR = 1.5  # a ride may take this many times the direct trip...
+DETOUR_ALLOWANCE_MIN = 5  # ...plus this many minutes
+DISTANCE_CACHE_MAX_ENTRIES = 200_000  # node pairs kept by the process-wide distance cache
+DISTANCE_CACHE_PRECISION = 5  # decimal places of lat/lon in cache keys (about 1 m)
+DISTANCE_CACHE_MAX_PRECISION = 7  # finest keys that still pack a point into one int64
+PROFILE_TOP_FUNCTIONS = 25  # functions listed in a profiled run's metrics
+SHARE_MAX_TRIP = 3  # riders per pooled trip in shareability mode: singles, pairs and triples
+SHARE_MAX_PARTNERS = 20  # shareable partners kept per rider, best first; bounds the triples
+SHARE_PRICING_CHUNK = 20_000  # trips priced at once by evaluate_trips, which bounds its memory
+SHARE_GRAPH_DEADLINE_SHARE = 0.5  # share of deadline_ms the graph may use; later pairs and triples are skipped
+SHARE_CANDIDATE_DRIVERS = 8  # nearest drivers offered each trip
+SHARE_ILP_MAX_VARIABLES = 5000  # larger trip selections are only made greedily
+SHARE_ILP_TIME_LIMIT_S = 2  # selection ILP limit when no deadline is given
+
+
+def location_coords(locations: List['Location']) -> np.ndarray:
+    """Stack locations into an (n, 2) array of [lat, lon] degrees"""
+    return np.array([[loc.lat, loc.lon] for loc in locations], dtype=np.float64).reshape(-1, 2)
+
+
+def haversine_matrix(coords_a: np.ndarray, coords_b: np.ndarray = None,
+                     dtype=np.float64, meters: bool = False) -> np.ndarray:
+    """
+    Vectorized Haversine distances between two sets of [lat, lon] coordinates.
+    
+    Returns an (n, m) matrix in kilometers, or the full (n, n) matrix when
+    coords_b is omitted. With meters=True the result is truncated to integer
+    meters, which is the unit the OR-Tools solver works in.
+    """
+    a = np.radians(np.asarray(coords_a, dtype=np.float64).reshape(-1, 2))
+    b = a if coords_b is None else np.radians(np.asarray(coords_b, dtype=np.float64).reshape(-1, 2))
+    
+    lat1, lon1 = a[:, 0:1], a[:, 1:2]
+    lat2, lon2 = b[:, 0][np.newaxis, :], b[:, 1][np.newaxis, :]
+    
+    h = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    km = 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(h, 0.0, 1.0)))
+    
+    if meters:
+        return (km * 1000).astype(np.int64)
+    return km.astype(dtype, copy=False)
+
+
+def haversine_pairwise(coords_a: np.ndarray, coords_b: np.ndarray, dtype=np.float64) -> np.ndarray:
+    """Element-wise Haversine distance (km) between row i of coords_a and row i of coords_b"""
+    a = np.radians(np.asarray(coords_a, dtype=np.float64).reshape(-1, 2))
+    b = np.radians(np.asarray(coords_b, dtype=np.float64).reshape(-1, 2))
+    
+    dlat = b[:, 0] - a[:, 0]
+    dlon = b[:, 1] - a[:, 1]
+    
+    h = np.sin(dlat / 2) ** 2 + np.cos(a[:, 0]) * np.cos(b[:, 0]) * np.sin(dlon / 2) ** 2
+    return (2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(h, 0.0, 1.0)))).astype(dtype, copy=False)
+
+
+class DistanceCache:
+    """
+    Process-wide, bounded LRU cache of pairwise distances.
+    
+    Points are keyed on their [lat, lon] rounded to precision decimal places
+    (5 is about a meter, at most DISTANCE_CACHE_MAX_PRECISION), and distances
+    are computed from the rounded points so a cached value never depends on
+    which request stored it first. At most max_entries pairs are kept; the
+    least recently used are evicted first.
+    
+    With a path the cache is loaded from that file when it exists, and save()
+    writes it back so a restarted process does not start cold.
+    """
+    
+    def __init__(self, max_entries: int = DISTANCE_CACHE_MAX_ENTRIES,
+                 precision: int = DISTANCE_CACHE_PRECISION, path: Optional[str] = None):
+        if precision > DISTANCE_CACHE_MAX_PRECISION:
+            raise ValueError(f'precision must be at most {DISTANCE_CACHE_MAX_PRECISION} decimal places')
+        self.max_entries = max_entries
+        self.precision = precision
+        self.path = path
+        self.entries = OrderedDict()  # (point key, point key) in ascending order -> km
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._thread = threading.local()  # the calling thread's own hits and misses
+        
+        # A point key packs the quantized [lat, lon] into one int64
+        self._lat_offset = 90 * 10 ** precision
+        self._lon_offset = 180 * 10 ** precision
+        self._lon_span = 2 * self._lon_offset + 1
+        
+        if path and os.path.exists(path):
+            self.load(path)
+    
+    def __len__(self):
+        return len(self.entries)
+    
+    def quantize(self, coords: np.ndarray) -> np.ndarray:
+        """Integer [lat, lon] keys at the cache precision"""
+        scaled = np.asarray(coords, dtype=np.float64).reshape(-1, 2) * 10 ** self.precision
+        return np.round(scaled).astype(np.int64)
+    
+    def _pack(self, quantized: np.ndarray) -> np.ndarray:
+        return (quantized[:, 0] + self._lat_offset) * self._lon_span + quantized[:, 1] + self._lon_offset
+    
+    def _unpack(self, packed: np.ndarray) -> np.ndarray:
+        lat, lon = np.divmod(packed, self._lon_span)
+        return np.column_stack([lat - self._lat_offset, lon - self._lon_offset])
+    
+    def matrix(self, coords: np.ndarray) -> np.ndarray:
+        """Full (n, n) km matrix for coords, computing only the pairs not cached yet"""
+        quantized = self.quantize(coords)
+        n = len(quantized)
+        rows, cols = np.triu_indices(n, 1)
+        points = self._pack(quantized)
+        keys = list(zip(np.minimum(points[rows], points[cols]).tolist(),
+                        np.maximum(points[rows], points[cols]).tolist()))
+        
+        # All pairs are looked up at once; the lock is held for the lookups only
+        with self._lock:
+            values = np.fromiter(map(self.entries.get, keys, itertools.repeat(np.nan)),
+                                 dtype=np.float64, count=len(keys))
+            cached = ~np.isnan(values)
+            deque(map(self.entries.move_to_end, itertools.compress(keys, cached.tolist())), maxlen=0)
+            hits = int(cached.sum())
+            self.hits += hits
+            self.misses += len(keys) - hits
+        self._thread.hits = getattr(self._thread, 'hits', 0) + hits
+        self._thread.misses = getattr(self._thread, 'misses', 0) + len(keys) - hits
+        
+        missing = np.flatnonzero(~cached)
+        if len(missing):
+            exact = quantized / 10 ** self.precision
+            values[missing] = haversine_pairwise(exact[rows[missing]], exact[cols[missing]])
+            
+            with self._lock:
+                self.entries.update(zip(itertools.compress(keys, (~cached).tolist()), values[missing].tolist()))
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+        
+        km = np.zeros((n, n))
+        km[rows, cols] = km[cols, rows] = values
+        return km
+    
+    def thread_counts(self) -> Tuple[int, int]:
+        """
+        Hits and misses of the calling thread's lookups so far; the difference
+        across a solve is that solve's own, whatever other threads look up
+        """
+        return getattr(self._thread, 'hits', 0), getattr(self._thread, 'misses', 0)
+    
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            'size': len(self.entries),
+            'max_entries': self.max_entries
+        }
+    
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+            self.hits = self.misses = 0
+    
+    def save(self, path: Optional[str] = None):
+        """Write the cached pairs, least recently used first, to an .npz file"""
+        path = path or self.path
+        with self._lock:
+            pairs = np.array(list(self.entries), dtype=np.int64).reshape(-1, 2)
+            values = np.fromiter(self.entries.values(), dtype=np.float64, count=len(self.entries))
+        keys = np.hstack([self._unpack(pairs[:, 0]), self._unpack(pairs[:, 1])])
+        
+        # Write to a temporary file of this process first, so a crash never leaves a
+        # truncated cache and processes saving at once never write the same file
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, keys=keys, values=values, precision=self.precision)
+        os.replace(tmp_path, path)
+    
+    def load(self, path: str):
+        """Add the pairs saved by save(); files written at another precision are ignored"""
+        with np.load(path) as saved:
+            if int(saved['precision']) != self.precision:
+                return
+            keys, values = saved['keys'].reshape(-1, 4), saved['values'].tolist()
+        pairs = zip(self._pack(keys[:, :2]).tolist(), self._pack(keys[:, 2:]).tolist())
+        
+        with self._lock:
+            self.entries.update(zip(pairs, values))
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+
+_distance_cache = DistanceCache()
+
+
+def configure_distance_cache(max_entries: int = DISTANCE_CACHE_MAX_ENTRIES,
+                             precision: int = DISTANCE_CACHE_PRECISION,
+                             path: Optional[str] = None, enabled: bool = True) -> Optional[DistanceCache]:
+    """Replace the process-wide distance cache; enabled=False turns caching off"""
+    global _distance_cache
+    _distance_cache = DistanceCache(max_entries, precision, path) if enabled else None
+    return _distance_cache
+
+
+def get_distance_cache() -> Optional[DistanceCache]:
+    return _distance_cache
+
+
+def route_distance_matrix(coords: np.ndarray) -> np.ndarray:
+    """Pairwise km between a route's nodes, through the distance cache when it is enabled"""
+    if _distance_cache is None:
+        return haversine_matrix(coords)
+    return _distance_cache.matrix(coords)
+
+
+class CostProvider(ABC):
+    """
+    Source of travel costs between [lat, lon] points.
+    
+    Route solvers only need distance_matrix; pairwise_distance prices
+    point-to-point trips such as the solo rides in the savings metrics.
+    Providers are pickled into route-solving worker processes, so they
+    should be cheap to send.
+    """
+    
+    @abstractmethod
+    def distance_matrix(self, coords: np.ndarray) -> np.ndarray:
+        """(n, n) km from every row of coords to every other row"""
+    
+    @abstractmethod
+    def duration_matrix(self, coords: np.ndarray) -> np.ndarray:
+        """(n, n) travel minutes from every row of coords to every other row"""
+    
+    def matrices(self, coords: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """distance_matrix and duration_matrix together"""
+        return self.distance_matrix(coords), self.duration_matrix(coords)
+    
+    @abstractmethod
+    def pairwise_distance(self, coords_a: np.ndarray, coords_b: np.ndarray) -> np.ndarray:
+        """km from row i of coords_a to row i of coords_b"""
+    
+    @abstractmethod
+    def reach_km(self, minutes) -> np.ndarray:
+        """
+        Straight-line km no trip taking at most minutes can exceed, used to
+        rule out pairings before any route is solved
+        """
+
+
+class HaversineCostProvider(CostProvider):
+    """Straight-line distances (through the distance cache) at a constant speed"""
+    
+    def __init__(self, speed_kmh: float = AVERAGE_SPEED_KMH):
+        self.speed_kmh = speed_kmh
+    
+    def distance_matrix(self, coords: np.ndarray) -> np.ndarray:
+        return route_distance_matrix(coords)
+    
+    def duration_matrix(self, coords: np.ndarray) -> np.ndarray:
+        return route_distance_matrix(coords) * (60 / self.speed_kmh)
+    
+    def matrices(self, coords: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        km = route_distance_matrix(coords)
+        return km, km * (60 / self.speed_kmh)
+    
+    def pairwise_distance(self, coords_a: np.ndarray, coords_b: np.ndarray) -> np.ndarray:
+        return haversine_pairwise(coords_a, coords_b)
+    
+    def reach_km(self, minutes) -> np.ndarray:
+        return np.asarray(minutes, dtype=np.float64) * (self.speed_kmh / 60)
+
+
+def write_cost_matrix(path: str, nodes: np.ndarray, distance_km: np.ndarray,
+                      duration_min: Optional[np.ndarray] = None):
+    """
+    Store a precomputed road-network matrix for MatrixCostProvider.
+    
+    path is a directory that receives nodes.npy ([lat, lon] per network
+    node), distance_km.npy and optionally duration_min.npy, both (n, n) with
+    row = origin node. Matrices are stored as float32 to halve their size.
+    """
+    nodes = np.asarray(nodes, dtype=np.float64).reshape(-1, 2)
+    shape = (len(nodes), len(nodes))
+    os.makedirs(path, exist_ok=True)
+    np.save(os.path.join(path, 'nodes.npy'), nodes)
+    
+    for name, matrix in (('distance_km', distance_km), ('duration_min', duration_min)):
+        if matrix is None:
+            continue
+        if np.shape(matrix) != shape:
+            raise ValueError(f'{name} must be {shape}, got {np.shape(matrix)}')
+        np.save(os.path.join(path, f'{name}.npy'), np.asarray(matrix, dtype=np.float32))
+
+
+_cost_matrices = {}  # (path, speed_kmh) -> MatrixCostProvider opened in this process
+
+
+def open_cost_matrix(path: str, speed_kmh: float = AVERAGE_SPEED_KMH) -> 'MatrixCostProvider':
+    """MatrixCostProvider for path at speed_kmh, opened once per process"""
+    key = (os.path.abspath(path), speed_kmh)
+    if key not in _cost_matrices:
+        _cost_matrices[key] = MatrixCostProvider(*key)
+    return _cost_matrices[key]
+
+
+class MatrixCostProvider(CostProvider):
+    """
+    Travel costs looked up in a precomputed node-to-node road matrix.
+    
+    The files written by write_cost_matrix are memory-mapped, so opening even
+    a city-sized matrix reads nothing up front and processes share the page
+    cache; a lookup only touches the rows of the nodes it needs. Points are
+    snapped to their nearest network node with a k-d tree, and the straight
+    legs between a point and its node are added at speed_kmh.
+    
+    Workers receive only the path and speed and reopen the matrix through
+    open_cost_matrix.
+    """
+    
+    def __init__(self, path: str, speed_kmh: float = AVERAGE_SPEED_KMH):
+        self.path = os.path.abspath(path)
+        self.speed_kmh = speed_kmh
+        self.nodes = np.load(os.path.join(self.path, 'nodes.npy'), mmap_mode='r')
+        self.distance_km = np.load(os.path.join(self.path, 'distance_km.npy'), mmap_mode='r')
+        
+        duration_path = os.path.join(self.path, 'duration_min.npy')
+        self.duration_min = np.load(duration_path, mmap_mode='r') if os.path.exists(duration_path) else None
+        
+        # Equirectangular km around the network's mean latitude for nearest-node queries
+        self._lon_scale = math.cos(math.radians(float(np.mean(self.nodes[:, 0]))))
+        self._tree = cKDTree(self._project(self.nodes))
+    
+    def __reduce__(self):
+        return open_cost_matrix, (self.path, self.speed_kmh)
+    
+    def __len__(self):
+        return len(self.nodes)
+    
+    def _project(self, coords: np.ndarray) -> np.ndarray:
+        coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+        return np.column_stack([coords[:, 0], coords[:, 1] * self._lon_scale]) * KM_PER_DEGREE
+    
+    def snap(self, coords: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Nearest network node of every row of coords and the km to reach it"""
+        offsets, nodes = self._tree.query(self._project(coords))
+        return nodes, offsets
+    
+    def _lookup(self, matrix: np.ndarray, coords: np.ndarray, scale: float) -> np.ndarray:
+        nodes, offsets = self.snap(coords)
+        costs = np.asarray(matrix[np.ix_(nodes, nodes)], dtype=np.float64)
+        costs += (offsets[:, np.newaxis] + offsets[np.newaxis, :]) * scale
+        
+        # Points sharing a node are closer to each other than to the network
+        same = nodes[:, np.newaxis] == nodes[np.newaxis, :]
+        costs[same] = haversine_matrix(coords)[same] * scale
+        return costs
+    
+    def distance_matrix(self, coords: np.ndarray) -> np.ndarray:
+        return self._lookup(self.distance_km, coords, 1.0)
+    
+    def duration_matrix(self, coords: np.ndarray) -> np.ndarray:
+        if self.duration_min is None:
+            return self.distance_matrix(coords) * (60 / self.speed_kmh)
+        return self._lookup(self.duration_min, coords, 60 / self.speed_kmh)
+    
+    def pairwise_distance(self, coords_a: np.ndarray, coords_b: np.ndarray) -> np.ndarray:
+        nodes_a, offsets_a = self.snap(coords_a)
+        nodes_b, offsets_b = self.snap(coords_b)
+        costs = np.asarray(self.distance_km[nodes_a, nodes_b], dtype=np.float64)
+        return np.where(nodes_a == nodes_b, haversine_pairwise(coords_a, coords_b),
+                        costs + offsets_a + offsets_b)
+    
+    def reach_km(self, minutes) -> np.ndarray:
+        return np.asarray(minutes, dtype=np.float64) * (MAX_ROAD_SPEED_KMH / 60)
+
+
+def build_pickup_delivery_model(meter_matrix: np.ndarray, capacities,
+                                native_callbacks: bool = True,
+                                drop_penalty: Optional[int] = None,
+                                second_matrix: Optional[np.ndarray] = None,
+                                pickup_deadlines: Optional[List[int]] = None,
+                                ride_limits: Optional[List[int]] = None) -> Tuple:
+    """
+    Pickup-and-delivery routing model over an integer meter matrix.
+    
+    capacities is one vehicle capacity or a list with one per vehicle. Nodes
+    are laid out as one start per vehicle, then k pickups, then the k
+    matching dropoffs; every vehicle makes a round trip from its own start.
+    With drop_penalty a rider may be left unserved at that cost in meters,
+    otherwise every rider must be routed.
+    
+    second_matrix adds a 'Time' dimension of integer travel seconds, counted
+    from the vehicle start. pickup_deadlines then caps each rider's pickup
+    time and ride_limits the seconds between their pickup and dropoff.
+    
+    With native_callbacks the arc costs and demands are registered as a
+    transit matrix and a unary vector, so the search evaluates them in C++
+    without calling back into Python; otherwise they are Python closures,
+    which is kept for benchmarks. Returns (manager, routing).
+    """
+    capacities = [capacities] if np.isscalar(capacities) else list(capacities)
+    n = len(meter_matrix)
+    n_vehicles = len(capacities)
+    n_riders = (n - n_vehicles) // 2
+    demands = [0] * n_vehicles + [1] * n_riders + [-1] * n_riders
+    
+    # Create routing model
+    starts = list(range(n_vehicles))
+    manager = pywrapcp.RoutingIndexManager(n, n_vehicles, starts, starts)
+    routing = pywrapcp.RoutingModel(manager)
+    
+    if native_callbacks:
+        transit_callback_index = routing.RegisterTransitMatrix(meter_matrix.tolist())
+        demand_callback_index = routing.RegisterUnaryTransitVector(demands)
+        if second_matrix is not None:
+            time_callback_index = routing.RegisterTransitMatrix(second_matrix.tolist())
+    else:
+        distance_matrix = meter_matrix.tolist()
+        
+        def distance_callback(from_index, to_index):
+            from_node = manager.IndexToNode(from_index)
+            to_node = manager.IndexToNode(to_index)
+            return distance_matrix[from_node][to_node]
+        
+        def demand_callback(from_index):
+            return demands[manager.IndexToNode(from_index)]
+        
+        transit_callback_index = routing.RegisterTransitCallback(distance_callback)
+        demand_callback_index = routing.RegisterUnaryTransitCallback(demand_callback)
+        
+        if second_matrix is not None:
+            seconds = second_matrix.tolist()
+            
+            def time_callback(from_index, to_index):
+                return seconds[manager.IndexToNode(from_index)][manager.IndexToNode(to_index)]
+            
+            time_callback_index = routing.RegisterTransitCallback(time_callback)
+    
+    routing.SetArcCostEvaluatorOfAllVehicles(transit_callback_index)
+    
+    # Distance dimension used to order pickups before dropoffs
+    routing.AddDimension(
+        transit_callback_index,
+        0,  # no slack
+        int(meter_matrix.max()) * n + 1,  # upper bound on route length
+        True,  # start cumul to zero
+        'Distance'
+    )
+    distance_dimension = routing.GetDimensionOrDie('Distance')
+    
+    # Time dimension for pickup deadlines and ride limits; vehicles never wait
+    time_dimension = None
+    if second_matrix is not None:
+        routing.AddDimension(
+            time_callback_index,
+            0,  # no waiting
+            int(second_matrix.max()) * n + 1,  # upper bound on route duration
+            True,  # start cumul to zero
+            'Time'
+        )
+        time_dimension = routing.GetDimensionOrDie('Time')
+    
+    # Add pickup-dropoff constraints
+    for rider in range(n_riders):
+        pickup_idx = manager.NodeToIndex(n_vehicles + rider)
+        dropoff_idx = manager.NodeToIndex(n_vehicles + n_riders + rider)
+        
+        routing.AddPickupAndDelivery(pickup_idx, dropoff_idx)
+        routing.solver().Add(
+            routing.VehicleVar(pickup_idx) == routing.VehicleVar(dropoff_idx)
+        )
+        routing.solver().Add(
+            distance_dimension.CumulVar(pickup_idx) <= 
+            distance_dimension.CumulVar(dropoff_idx)
+        )
+        
+        if time_dimension is not None and pickup_deadlines is not None:
+            time_dimension.CumulVar(pickup_idx).SetMax(int(pickup_deadlines[rider]))
+        if time_dimension is not None and ride_limits is not None:
+            routing.solver().Add(
+                time_dimension.CumulVar(dropoff_idx) - time_dimension.CumulVar(pickup_idx) <=
+                int(ride_limits[rider])
+            )
+        
+        # Skipping the pickup skips the paired dropoff, so only it carries the penalty
+        if drop_penalty is not None:
+            routing.AddDisjunction([pickup_idx], int(drop_penalty))
+            routing.AddDisjunction([dropoff_idx], 0)
+    
+    # Add capacity constraint
+    routing.AddDimensionWithVehicleCapacity(
+        demand_callback_index,
+        0,  # null capacity slack
+        capacities,  # vehicle maximum capacities
+        True,  # start cumul to zero
+        'Capacity'
+    )
+    
+    return manager, routing
+
+
+def search_routing_model(routing: pywrapcp.RoutingModel,
+                         time_limit_ms: float = DEFAULT_ROUTE_TIME_LIMIT_MS,
+                         solution_limit: Optional[int] = None,
+                         first_solution_strategy: int = routing_enums_pb2.FirstSolutionStrategy.PATH_CHEAPEST_ARC,
+                         initial_assignment=None):
+    """
+    Run guided local search on a routing model and return its best assignment
+    (None if none was found).
+    
+    The search stops at time_limit_ms, after solution_limit solutions
+    (SEARCH_MAX_SOLUTIONS by default), or once OR-Tools' improvement limit
+    finds the objective improving much more slowly than it did (see
+    IMPROVEMENT_RATE_COEFFICIENT); all of these are checked natively,
+    without calling back into Python during the search. Below
+    MIN_ROUTE_TIME_LIMIT_MS there is no time for local search: only a first
+    solution is built, within at most that floor. An initial_assignment (see
+    warm_start_routes) starts the search from that solution instead of
+    building a first one.
+    """
+    search_parameters = pywrapcp.DefaultRoutingSearchParameters()
+    search_parameters.first_solution_strategy = first_solution_strategy
+    if first_solution_only(time_limit_ms):
+        search_parameters.solution_limit = 1
+        search_parameters.time_limit.FromMilliseconds(MIN_ROUTE_TIME_LIMIT_MS)
+    else:
+        search_parameters.local_search_metaheuristic = (
+            routing_enums_pb2.LocalSearchMetaheuristic.GUIDED_LOCAL_SEARCH
+        )
+        search_parameters.time_limit.FromMilliseconds(int(time_limit_ms))
+        search_parameters.improvement_limit_parameters.improvement_rate_coefficient = IMPROVEMENT_RATE_COEFFICIENT
+        search_parameters.improvement_limit_parameters.improvement_rate_solutions_distance = IMPROVEMENT_RATE_SOLUTIONS
+        search_parameters.solution_limit = SEARCH_MAX_SOLUTIONS if solution_limit is None else solution_limit
+    
+    if initial_assignment is not None:
+        return routing.SolveFromAssignmentWithParameters(initial_assignment, search_parameters)
+    return routing.SolveWithParameters(search_parameters)
+
+
+def first_solution_only(time_limit_ms: float) -> bool:
+    """Whether search_routing_model only builds a first solution within time_limit_ms"""
+    return time_limit_ms < MIN_ROUTE_TIME_LIMIT_MS
+
+
+def ms_until(deadline: Optional[float]) -> float:
+    """
+    Milliseconds until deadline, a time.time() shared by every process of a
+    call; 0 once it has passed
+    """
+    return math.inf if deadline is None else max((deadline - time.time()) * 1000, 0.0)
+
+
+def warm_start_routes(manager: pywrapcp.RoutingIndexManager, routing: pywrapcp.RoutingModel,
+                      routes: List[List[int]], locked_stops: Optional[List[int]] = None):
+    """
+    Seed a search with known routes, one node order per vehicle with its
+    start first, e.g. the routes solved for the same vehicles a moment ago.
+    
+    The first locked_stops[v] stops after vehicle v's start are pinned in
+    place (stops already visited); this must happen before the model is
+    closed, which reading the routes does. Returns the initial assignment,
+    or None if the routes break the model's constraints, in which case the
+    search has to start from scratch (the locks still hold).
+    """
+    for vehicle, route in enumerate(routes):
+        locked = route[:(locked_stops[vehicle] if locked_stops else 0) + 1]
+        for a, b in zip(locked, locked[1:]):
+            routing.NextVar(manager.NodeToIndex(a)).SetValue(manager.NodeToIndex(b))
+    return routing.ReadAssignmentFromRoutes(
+        [[manager.NodeToIndex(node) for node in route[1:]] for route in routes], True
+    )
+
+
+def routing_search_stats(routing: pywrapcp.RoutingModel, solution) -> Dict:
+    """
+    How a search on routing ended: its 'status' (e.g. 'success', 'fail_timeout')
+    and the 'objective' of its solution, route meters plus drop penalties
+    """
+    status = routing_enums_pb2.RoutingSearchStatus.Value.Name(routing.status())
+    return {
+        'status': status.replace('ROUTING_', '', 1).lower(),
+        'objective': solution.ObjectiveValue() if solution else None
+    }
+
+
+def read_vehicle_route(manager: pywrapcp.RoutingIndexManager, routing: pywrapcp.RoutingModel,
+                       solution, vehicle: int, km_matrix: np.ndarray) -> Tuple[List[int], float]:
+    """Node order of one vehicle in a solution (start first) and its round-trip km"""
+    order = []
+    index = routing.Start(vehicle)
+    total_distance = 0.0
+    
+    while not routing.IsEnd(index):
+        node = manager.IndexToNode(index)
+        order.append(node)
+        
+        next_index = solution.Value(routing.NextVar(index))
+        next_node = manager.IndexToNode(next_index)
+        total_distance += float(km_matrix[node, next_node])
+        
+        index = next_index
+    
+    return order, total_distance
+
+
+def rider_time_limits(minutes: np.ndarray, n_vehicles: int, wait_limits=None,
+                      max_detour_factor: Optional[float] = None) -> Tuple:
+    """
+    Per-rider time limits in minutes for a route laid out as n_vehicles
+    starts, k pickups and k dropoffs: the latest pickup (wait_limits, counted
+    from the vehicle start) and the longest ride, max_detour_factor times the
+    direct trip plus DETOUR_ALLOWANCE_MIN. Either is None when not given.
+    """
+    n_riders = (len(minutes) - n_vehicles) // 2
+    pickups = np.arange(n_riders) + n_vehicles
+    
+    wait = None if wait_limits is None else np.asarray(wait_limits, dtype=np.float64)
+    ride = None
+    if max_detour_factor is not None:
+        ride = minutes[pickups, pickups + n_riders] * max_detour_factor + DETOUR_ALLOWANCE_MIN
+    return wait, ride
+
+
+def route_arrivals(order: List[int], minutes: np.ndarray) -> List[float]:
+    """Minutes from the vehicle start until each node of order is reached"""
+    arrivals = [0.0]
+    for a, b in zip(order, order[1:]):
+        arrivals.append(arrivals[-1] + float(minutes[a, b]))
+    return arrivals
+
+
+def within_time_limits(order: List[int], minutes: np.ndarray, n_vehicles: int,
+                       wait_limits: Optional[np.ndarray], ride_limits: Optional[np.ndarray]) -> bool:
+    """Whether every rider on a route order meets their rider_time_limits"""
+    n_riders = (len(minutes) - n_vehicles) // 2
+    arrival = dict(zip(order, route_arrivals(order, minutes)))
+    
+    for rider in range(n_riders):
+        pickup, dropoff = n_vehicles + rider, n_vehicles + n_riders + rider
+        if pickup not in arrival:
+            continue
+        if wait_limits is not None and arrival[pickup] > wait_limits[rider] + 1e-9:
+            return False
+        if ride_limits is not None and arrival[dropoff] - arrival[pickup] > ride_limits[rider] + 1e-9:
+            return False
+    return True
+
+
+def time_window_inputs(minutes: np.ndarray, wait_limits: Optional[np.ndarray],
+                       ride_limits: Optional[np.ndarray]) -> Dict:
+    """build_pickup_delivery_model arguments for time windows, in whole seconds"""
+    return {
+        'second_matrix': np.round(minutes * 60).astype(np.int64),
+        'pickup_deadlines': None if wait_limits is None else np.floor(wait_limits * 60).astype(np.int64).tolist(),
+        'ride_limits': None if ride_limits is None else np.floor(ride_limits * 60).astype(np.int64).tolist()
+    }
+
+
+def solve_pickup_delivery(coords: np.ndarray, capacity: int,
+                          time_limit_ms: int = DEFAULT_ROUTE_TIME_LIMIT_MS,
+                          solution_limit: Optional[int] = None,
+                          distances: Optional[np.ndarray] = None,
+                          durations: Optional[np.ndarray] = None,
+                          wait_limits: Optional[np.ndarray] = None,
+                          ride_limits: Optional[np.ndarray] = None,
+                          stats: Optional[Dict] = None,
+                          initial_order: Optional[List[int]] = None,
+                          locked_stops: int = 0) -> Optional[Tuple[List[int], float]]:
+    """
+    Solve a single-vehicle pickup-and-delivery route with OR-Tools.
+    
+    coords holds [lat, lon] rows ordered as the vehicle start, k pickups and
+    then the k matching dropoffs. Returns the visiting order of node indices
+    (starting at the vehicle) with the round-trip length in kilometers, or
+    None if the solver finds no solution. Only plain arrays go in and out so
+    the function can run in a worker process.
+    
+    The search stops at time_limit_ms, after solution_limit solutions, or
+    once it stops improving (see search_routing_model).
+    
+    distances is the (n, n) km matrix between the nodes, straight-line
+    distances from route_distance_matrix when omitted.
+    
+    durations, an (n, n) matrix of travel minutes, adds time windows from the
+    per-rider wait_limits and ride_limits (see rider_time_limits). Riders who
+    cannot make them are left out of the returned order.
+    
+    initial_order, a previous visiting order of the same nodes, seeds the
+    search (see warm_start_routes), and its first locked_stops stops after
+    the start stay where they are.
+    
+    stats, if given, is updated with the routing_search_stats of the search,
+    whether it was 'warm_started' and whether it was 'first_solution_only'.
+    """
+    # Calculate distance matrix (km for reporting, integer meters for the solver)
+    km_matrix = route_distance_matrix(coords) if distances is None else np.asarray(distances)
+    meter_matrix = (km_matrix * 1000).astype(np.int64)
+    
+    windows = {}
+    if durations is not None:
+        windows = time_window_inputs(np.asarray(durations), wait_limits, ride_limits)
+        windows['drop_penalty'] = int(RIDER_DROP_PENALTY_KM * 1000)
+    manager, routing = build_pickup_delivery_model(meter_matrix, capacity, **windows)
+    
+    initial = None
+    if initial_order is not None:
+        initial = warm_start_routes(manager, routing, [initial_order], [locked_stops])
+    
+    solution = search_routing_model(routing, time_limit_ms, solution_limit, initial_assignment=initial)
+    if stats is not None:
+        stats.update(routing_search_stats(routing, solution), warm_started=initial is not None,
+                     first_solution_only=first_solution_only(time_limit_ms))
+    if not solution:
+        return None
+    
+    return read_vehicle_route(manager, routing, solution, 0, km_matrix)
+
+
+def solve_exact_dp(coords: np.ndarray, capacity: int, onboard: int = 0,
+                   distances: Optional[np.ndarray] = None, minutes: Optional[np.ndarray] = None,
+                   wait_limits: Optional[np.ndarray] = None,
+                   ride_limits: Optional[np.ndarray] = None) -> Optional[Tuple[List[int], float]]:
+    """
+    Solve a small pickup-and-delivery route to optimality with a bitmask DP.
+    
+    Same inputs and outputs as solve_pickup_delivery. A state is the set of
+    riders picked up, the set dropped off and the current node; every state
+    keeps its cheapest way in, so the round trip found is provably shortest.
+    The state count grows as 3^k * (2k + 1), which is why this is only used
+    for small vehicles.
+    
+    minutes, the (n, n) travel times between the nodes, adds the per-rider
+    wait_limits and ride_limits of rider_time_limits: moves that break them
+    are never taken, and a state keeps every way in that no other beats on
+    distance, clock and the pickup times of the riders on board. None if
+    no route serves every rider in time.
+    
+    onboard is a bitmask of riders already in the vehicle: their pickup
+    nodes are skipped and left out of the returned order, and their rides
+    count from the vehicle start.
+    """
+    n = len(coords)
+    n_riders = (n - 1) // 2
+    km = (route_distance_matrix(coords) if distances is None else np.asarray(distances)).tolist()
+    travel = None if minutes is None else np.asarray(minutes).tolist()
+    
+    # labels[(picked, dropped, node)] = [(km so far, minutes so far, pickup minute per rider, node, previous label)]
+    labels = {(onboard, 0, 0): [(0.0, 0.0, (0.0,) * n_riders, 0, None)]}
+    frontier = [(onboard, 0, 0)]
+    
+    # Every step either picks up or drops off one rider
+    for _ in range(2 * n_riders - bin(onboard).count('1')):
+        layer = {}
+        for state in frontier:
+            picked, dropped, node = state
+            riding = picked & ~dropped
+            has_room = bin(riding).count('1') < capacity
+            
+            for label in labels[state]:
+                cost, clock, pickup_times = label[:3]
+                for rider in range(n_riders):
+                    bit = 1 << rider
+                    if not picked & bit:
+                        if not has_room:
+                            continue
+                        nxt = (picked | bit, dropped, 1 + rider)
+                    elif riding & bit:
+                        nxt = (picked, dropped | bit, 1 + n_riders + rider)
+                    else:
+                        continue
+                    
+                    arrival = clock + travel[node][nxt[2]] if travel is not None else 0.0
+                    times = list(pickup_times)
+                    if nxt[0] != picked:
+                        if wait_limits is not None and arrival > wait_limits[rider] + 1e-9:
+                            continue
+                        times[rider] = arrival
+                    else:
+                        if ride_limits is not None and arrival - pickup_times[rider] > ride_limits[rider] + 1e-9:
+                            continue
+                        times[rider] = 0.0
+                    
+                    keep_label(layer.setdefault(nxt, []),
+                               (cost + km[node][nxt[2]], arrival, tuple(times), nxt[2], label))
+        
+        labels = layer
+        frontier = list(layer)
+    
+    if not frontier:
+        return None
+    
+    # Close the round trip back to the vehicle start
+    end = min((label for state in frontier for label in labels[state]), key=lambda label: label[0] + km[label[3]][0])
+    total_distance = end[0] + km[end[3]][0]
+    
+    order = []
+    while end is not None:
+        order.append(end[3])
+        end = end[4]
+    
+    return order[::-1], total_distance
+
+
+def keep_label(labels: List[Tuple], label: Tuple):
+    """
+    Add a solve_exact_dp label to the labels of its state unless one of them
+    is as short, as early and picked its riders up as late; labels it beats
+    that way are dropped. Without time windows this keeps only the shortest.
+    """
+    def beats(a, b):
+        return a[0] <= b[0] and a[1] <= b[1] and all(x >= y for x, y in zip(a[2], b[2]))
+    
+    if any(beats(other, label) for other in labels):
+        return
+    labels[:] = [other for other in labels if not beats(label, other)] + [label]
+
+
+def carry_over_order(previous: List['Location'], locations: List['Location']) -> Optional[List[int]]:
+    """
+    A warm-start node order for locations (a start, then stops) from a route
+    solved earlier: stops still there keep their old order, new stops follow
+    in node order, every pickup before its dropoff. None without a previous
+    route.
+    """
+    if len(previous) < 2:
+        return None
+    nodes = {(stop.type, stop.person_id): node for node, stop in enumerate(locations[1:], 1)}
+    order = [nodes.pop((stop.type, stop.person_id)) for stop in previous[1:] if (stop.type, stop.person_id) in nodes]
+    return [0] + order + sorted(nodes.values())
+
+
+def route_method(n_riders: int, exact_max_nodes: int = EXACT_MAX_NODES) -> str:
+    """Which solver solve_route uses for a route with n_riders riders"""
+    return 'exact' if 2 * n_riders + 1 <= exact_max_nodes else 'ortools'
+
+
+def solve_route(coords: np.ndarray, capacity: int,
+                time_limit_ms: int = DEFAULT_ROUTE_TIME_LIMIT_MS,
+                exact_max_nodes: int = EXACT_MAX_NODES,
+                cost_provider: Optional[CostProvider] = None,
+                wait_limits: Optional[List[float]] = None,
+                max_detour_factor: Optional[float] = None,
+                initial_order: Optional[List[int]] = None,
+                locked_stops: int = 0,
+                deadline: Optional[float] = None) -> Dict:
+    """
+    Solve one driver's route with the cheapest adequate method: the exact DP
+    up to exact_max_nodes nodes, OR-Tools above that. Arc costs come from
+    cost_provider, straight-line distances by default.
+    
+    initial_order and locked_stops warm-start an OR-Tools search from the
+    driver's previous route, see solve_pickup_delivery; routes with locked
+    stops always go to OR-Tools.
+    
+    wait_limits (minutes until each rider's pickup) and max_detour_factor add
+    time windows, see rider_time_limits. The exact DP keeps to them; when no
+    route can serve every rider in time, OR-Tools re-solves the route and
+    may leave riders unserved.
+    
+    deadline, a time.time() at which the whole batch is due, caps the
+    search at the time left; a search starting later only builds a first
+    solution (see search_routing_model).
+    
+    Returns a dict with the node 'order' (None if unsolved), route 'distance'
+    in km, the 'method' used, the 'dropped' rider indices left off the route,
+    the 'arrivals' in minutes at each node of the order (of the unsolved
+    node layout if there is none), the wall and CPU time it took in
+    'elapsed_ms' and 'cpu_ms', the search 'status' and 'objective' (see
+    routing_search_stats; exact routes are 'optimal' with their length in
+    meters), whether the search was 'warm_started' or 'first_solution_only',
+    and the distance cache 'cache_hits' and 'cache_misses' of this solve
+    (counted in whichever process ran it).
+    """
+    start, cpu_start = time.perf_counter(), time.thread_time()
+    cache = _distance_cache
+    hits, misses = cache.thread_counts() if cache is not None else (0, 0)
+    n_riders = (len(coords) - 1) // 2
+    method = 'ortools' if locked_stops else route_method(n_riders, exact_max_nodes)
+    distances, minutes = (cost_provider or HaversineCostProvider()).matrices(coords)
+    
+    timed = wait_limits is not None or max_detour_factor is not None
+    wait, ride = rider_time_limits(minutes, 1, wait_limits, max_detour_factor)
+    
+    if method == 'exact':
+        solution = solve_exact_dp(coords, capacity, distances=distances, minutes=minutes if timed else None,
+                                  wait_limits=wait, ride_limits=ride)
+        stats = {'status': 'infeasible', 'objective': None, 'warm_started': False, 'first_solution_only': False}
+        if solution is not None:
+            stats = {'status': 'optimal', 'objective': int(round(solution[1] * 1000)), 'warm_started': False,
+                     'first_solution_only': False}
+        elif timed:
+            # No route serves every rider in time; OR-Tools can leave some out
+            method = 'ortools'
+    
+    if method == 'ortools':
+        if route_method(n_riders, exact_max_nodes) == 'exact':
+            time_limit_ms = max(time_limit_ms, FALLBACK_ROUTE_TIME_LIMIT_MS)
+        time_limit_ms = min(time_limit_ms, ms_until(deadline))
+        stats = {}
+        solution = solve_pickup_delivery(coords, capacity, time_limit_ms, distances=distances,
+                                         durations=minutes if timed else None,
+                                         wait_limits=wait, ride_limits=ride, stats=stats,
+                                         initial_order=initial_order, locked_stops=locked_stops)
+    
+    order, distance = solution if solution is not None else (None, 0.0)
+    visited = set(order or range(len(coords)))
+    return {
+        'order': order,
+        'distance': distance,
+        'method': method,
+        'dropped': [rider for rider in range(n_riders) if 1 + rider not in visited],
+        'arrivals': route_arrivals(order or list(range(len(coords))), minutes),
+        'elapsed_ms': (time.perf_counter() - start) * 1000,
+        'cpu_ms': (time.thread_time() - cpu_start) * 1000,
+        **stats,
+        'cache_hits': cache.thread_counts()[0] - hits if cache is not None else 0,
+        'cache_misses': cache.thread_counts()[1] - misses if cache is not None else 0
+    }
+
+
+def solve_fleet_route(coords: np.ndarray, capacities: List[int],
+                      time_limit_ms: int = DEFAULT_ROUTE_TIME_LIMIT_MS,
+                      allowed_vehicles: Optional[List[List[int]]] = None,
+                      drop_penalty_km: float = RIDER_DROP_PENALTY_KM,
+                      cost_provider: Optional[CostProvider] = None,
+                      wait_limits: Optional[List[float]] = None,
+                      max_detour_factor: Optional[float] = None,
+                      deadline: Optional[float] = None) -> Dict:
+    """
+    Route several vehicles jointly in one OR-Tools pickup-and-delivery model.
+    
+    coords holds one start per vehicle (in capacities order), then k pickups
+    and the k matching dropoffs. allowed_vehicles optionally lists, for each
+    rider, the vehicles that may serve them; a rider with an empty list is
+    never served. A rider is left unserved when no vehicle can take them in
+    their time windows (wait_limits and max_detour_factor as in solve_route)
+    or serving them would cost more than drop_penalty_km. deadline caps the
+    search as in solve_route.
+    
+    Returns a dict with the node 'orders' per vehicle (start first, None if
+    unsolved), their round-trip 'distances' in km, the 'arrivals' in minutes
+    at each node of every order, the 'dropped' rider indices, 'method',
+    'elapsed_ms', 'cpu_ms', search 'status', 'objective',
+    'first_solution_only' and 'warm_started' (never) and the distance cache
+    counters like solve_route.
+    """
+    start, cpu_start = time.perf_counter(), time.thread_time()
+    cache = _distance_cache
+    hits, misses = cache.thread_counts() if cache is not None else (0, 0)
+    n_vehicles = len(capacities)
+    n_riders = (len(coords) - n_vehicles) // 2
+    
+    km_matrix, minutes = (cost_provider or HaversineCostProvider()).matrices(coords)
+    meter_matrix = (km_matrix * 1000).astype(np.int64)
+    
+    windows = {}
+    if wait_limits is not None or max_detour_factor is not None:
+        windows = time_window_inputs(minutes, *rider_time_limits(minutes, n_vehicles, wait_limits,
+                                                                 max_detour_factor))
+    manager, routing = build_pickup_delivery_model(meter_matrix, capacities,
+                                                   drop_penalty=int(drop_penalty_km * 1000), **windows)
+    
+    if allowed_vehicles is not None:
+        for rider, vehicles in enumerate(allowed_vehicles):
+            pickup_idx = manager.NodeToIndex(n_vehicles + rider)
+            dropoff_idx = manager.NodeToIndex(n_vehicles + n_riders + rider)
+            
+            # -1 is the vehicle of an unserved node
+            domain = [-1] + [int(v) for v in vehicles]
+            routing.VehicleVar(pickup_idx).SetValues(domain)
+            routing.VehicleVar(dropoff_idx).SetValues(domain)
+    
+    # Path-building first solutions leave every rider unserved once ride limits
+    # apply to several vehicles; inserting pickup-dropoff pairs does not
+    time_limit_ms = min(time_limit_ms, ms_until(deadline))
+    solution = search_routing_model(
+        routing, time_limit_ms,
+        first_solution_strategy=routing_enums_pb2.FirstSolutionStrategy.PARALLEL_CHEAPEST_INSERTION
+    )
+    
+    orders, distances, dropped = [None] * n_vehicles, [0.0] * n_vehicles, list(range(n_riders))
+    arrivals = [None] * n_vehicles
+    if solution:
+        routes = [read_vehicle_route(manager, routing, solution, v, km_matrix) for v in range(n_vehicles)]
+        orders = [order for order, _ in routes]
+        distances = [distance for _, distance in routes]
+        arrivals = [route_arrivals(order, minutes) for order in orders]
+        served = {node - n_vehicles for order in orders for node in order[1:] if node < n_vehicles + n_riders}
+        dropped = [rider for rider in range(n_riders) if rider not in served]
+    
+    return {
+        'orders': orders,
+        'distances': distances,
+        'arrivals': arrivals,
+        'dropped': dropped,
+        'method': 'joint',
+        'elapsed_ms': (time.perf_counter() - start) * 1000,
+        'cpu_ms': (time.thread_time() - cpu_start) * 1000,
+        **routing_search_stats(routing, solution),
+        'first_solution_only': first_solution_only(time_limit_ms),
+        'warm_started': False,
+        'cache_hits': cache.thread_counts()[0] - hits if cache is not None else 0,
+        'cache_misses': cache.thread_counts()[1] - misses if cache is not None else 0
+    }
+
+
+def run_solves(solve: Callable, args: List[List], executor: Optional[ProcessPoolExecutor] = None,
+               progress: Optional[Callable[[str, float], None]] = None) -> List[Dict]:
+    """
+    Call solve on each position of the argument lists, on executor (a
+    process pool kept by the caller) when given, and return the results in
+    order. progress, if given, hears ('routing', fraction done) after every
+    result; an exception it raises cancels the solves not started yet.
+    """
+    if executor is None:
+        results = []
+        for result in map(solve, *args):
+            results.append(result)
+            if progress is not None:
+                progress('routing', len(results) / len(args[0]))
+        return results
+    
+    futures = [executor.submit(solve, *call) for call in zip(*args)]
+    try:
+        results = []
+        for future in futures:
+            results.append(future.result())
+            if progress is not None:
+                progress('routing', len(results) / len(futures))
+        return results
+    finally:
+        for future in futures:
+            future.cancel()
+
+
+def deadline_overrun_ms(start_time: float, deadline_ms: Optional[float]) -> Optional[float]:
+    """
+    How far past deadline_ms a run that began at perf_counter() start_time
+    is, or None without a deadline
+    """
+    if deadline_ms is None:
+        return None
+    return round(max((time.perf_counter() - start_time) * 1000 - deadline_ms, 0.0), 1)
+
+
+def solve_metrics(result: Dict) -> Dict:
+    """Timings and search outcome of a solve_route or solve_fleet_route result"""
+    return {
+        'elapsed_ms': round(result['elapsed_ms'], 1),
+        'cpu_ms': round(result['cpu_ms'], 1),
+        'status': result['status'],
+        'objective': result['objective'],
+        'first_solution_only': result['first_solution_only'],
+        'warm_started': result['warm_started']
+    }
+
+
+@lru_cache(maxsize=None)
+def shared_stop_orders(k: int) -> np.ndarray:
+    """
+    Every order of k riders' stops (0..k-1 their pickups, k..2k-1 their
+    dropoffs) in which each rider is picked up before being dropped off and
+    the vehicle never runs empty before the last dropoff, one row each
+    """
+    orders = []
+    for order in itertools.permutations(range(2 * k)):
+        position = np.argsort(order)
+        load = np.cumsum([1 if stop < k else -1 for stop in order])
+        if (position[:k] < position[k:]).all() and (load[:-1] > 0).all():
+            orders.append(order)
+    return np.array(orders, dtype=np.int64)
+
+
+def evaluate_trips(members: np.ndarray, pickups: np.ndarray, dropoffs: np.ndarray,
+                   ride_limit_km: np.ndarray, cost_provider: 'CostProvider',
+                   chunk: int = SHARE_PRICING_CHUNK,
+                   deadline: Optional[float] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Shortest shared route of each trip, chunk trips at a time.
+    
+    members is a (trips, k) array of rider rows. Every stop order from
+    shared_stop_orders is priced for a chunk of trips together; an order
+    counts only if each rider's ride stays within ride_limit_km. Returns
+    the route km from the first pickup to the last dropoff (inf where no
+    order is feasible) and the km from the first pickup to each member's
+    pickup on that route, which the trip's driver still has to cover
+    within the riders' waits. Chunks starting after deadline, a
+    time.time(), are left unpriced (inf).
+    """
+    n_trips, k = members.shape
+    best = np.full(n_trips, np.inf)
+    offsets = np.zeros((n_trips, k))
+    orders = shared_stop_orders(k)
+    
+    for lo in range(0, n_trips, chunk):
+        if ms_until(deadline) <= 0:
+            break
+        part = members[lo:lo + chunk]
+        stops = np.concatenate([pickups[part], dropoffs[part]], axis=1)
+        pairs = np.broadcast_arrays(stops[:, :, np.newaxis], stops[:, np.newaxis])
+        legs_km = cost_provider.pairwise_distance(pairs[0].reshape(-1, 2), pairs[1].reshape(-1, 2))
+        legs_km = legs_km.reshape(len(part), 2 * k, 2 * k)
+        limits = ride_limit_km[part]
+        
+        part_best, part_offsets = best[lo:lo + chunk], offsets[lo:lo + chunk]
+        for order in orders:
+            reached = np.zeros((len(part), 2 * k))
+            reached[:, 1:] = np.cumsum(legs_km[:, order[:-1], order[1:]], axis=1)
+            at_stop = reached[:, np.argsort(order)]
+            feasible = (at_stop[:, k:] - at_stop[:, :k] <= limits).all(axis=1)
+            better = feasible & (reached[:, -1] < part_best)
+            part_best[better] = reached[better, -1]
+            part_offsets[better] = at_stop[better, :k]
+    return best, offsets
+
+
+def pair_within_limits(pairs: np.ndarray, pickups: np.ndarray, dropoffs: np.ndarray,
+                       ride_limit_km: np.ndarray) -> np.ndarray:
+    """
+    Whether each pair of riders might share a trip, from straight-line lower
+    bounds on their rides: whoever is picked up first also rides past the
+    other's pickup, and whoever is dropped off last past the other's
+    dropoff. Cost providers never price a trip below the straight line (see
+    reach_km), so a pair failing either bound fails evaluate_trips too.
+    """
+    a, b = pairs[:, 0], pairs[:, 1]
+    pickup_gap = haversine_pairwise(pickups[a], pickups[b])
+    dropoff_gap = haversine_pairwise(dropoffs[a], dropoffs[b])
+    b_to_a = haversine_pairwise(pickups[b], dropoffs[a])  # b's pickup to a's dropoff
+    a_to_b = haversine_pairwise(pickups[a], dropoffs[b])
+    limit_a, limit_b = ride_limit_km[a] + 1e-6, ride_limit_km[b] + 1e-6
+    
+    first = (pickup_gap + b_to_a <= limit_a) | (pickup_gap + a_to_b <= limit_b)
+    last = (b_to_a + dropoff_gap <= limit_b) | (a_to_b + dropoff_gap <= limit_a)
+    return first & last
+
+
+def shareability_graph(pickups: np.ndarray, dropoffs: np.ndarray, wait_minutes: np.ndarray,
+                       max_detour_factor: Optional[float], cost_provider: 'CostProvider',
+                       max_trip: int = SHARE_MAX_TRIP, max_partners: int = SHARE_MAX_PARTNERS,
+                       deadline: Optional[float] = None) -> List[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    """
+    Trips of up to max_trip riders who can share one vehicle.
+    
+    Candidate pairs are each rider's max_partners nearest pickups, as long
+    as one vehicle can reach both within the longest wait (a KD-tree
+    query). Pairs that pair_within_limits rules out are dropped before the
+    rest are priced exactly with evaluate_trips, which also drops pairs
+    heading apart since one of them would exceed the detour limit. Each
+    rider keeps its max_partners pairs with the most kilometers saved.
+    Triples are the triangles of that pair graph, priced the same way.
+    max_detour_factor None prices trips with MAX_DETOUR_FACTOR, so the
+    graph stays sparse. Past deadline, a time.time(), pairs left unpriced
+    are treated as unshareable and no triples are built. Returns (members,
+    route km, pickup offsets km) per trip size, singles first.
+    """
+    n = len(pickups)
+    direct_km = cost_provider.pairwise_distance(pickups, dropoffs)
+    factor = MAX_DETOUR_FACTOR if max_detour_factor is None else max_detour_factor
+    ride_limit_km = direct_km * factor + cost_provider.reach_km(DETOUR_ALLOWANCE_MIN)
+    
+    singles = np.arange(n)[:, np.newaxis]
+    trips = [(singles, direct_km, np.zeros((n, 1)))]
+    if n < 2 or max_trip < 2:
+        return trips
+    
+    # Nearest pickups on a local km grid; both pickups must be within reach of the longest wait
+    scale = np.array([KM_PER_DEGREE, KM_PER_DEGREE * math.cos(math.radians(float(pickups[:, 0].mean())))])
+    tree = cKDTree(pickups * scale)
+    radius = float(cost_provider.reach_km(wait_minutes.max()))
+    _, nearest = tree.query(pickups * scale, k=list(range(2, min(max_partners, n - 1) + 2)),
+                            distance_upper_bound=radius)
+    rider, slot = np.nonzero(nearest < n)
+    pairs = np.sort(np.column_stack([rider, nearest[rider, slot]]), axis=1)
+    pairs = np.unique(pairs[pairs[:, 0] != pairs[:, 1]], axis=0)
+    pairs = pairs[pair_within_limits(pairs, pickups, dropoffs, ride_limit_km)]
+    if len(pairs) == 0:
+        return trips
+    
+    pair_km, offsets = evaluate_trips(pairs, pickups, dropoffs, ride_limit_km, cost_provider, deadline=deadline)
+    saved = direct_km[pairs].sum(axis=1) - pair_km
+    keep = np.isfinite(pair_km)
+    
+    # Each rider's best partners, so dense spots do not blow up the triples
+    ranked = np.argsort(-saved)
+    ranked = ranked[keep[ranked]]
+    partners = np.zeros(n, dtype=np.int64)
+    kept = []
+    for p in ranked.tolist():
+        a, b = pairs[p]
+        if partners[a] < max_partners and partners[b] < max_partners:
+            partners[a] += 1
+            partners[b] += 1
+            kept.append(p)
+    kept = np.sort(np.array(kept, dtype=np.int64))
+    trips.append((pairs[kept], pair_km[kept], offsets[kept]))
+    
+    if max_trip < 3 or len(kept) == 0 or ms_until(deadline) <= 0:
+        return trips
+    neighbours = [set() for _ in range(n)]
+    for a, b in pairs[kept].tolist():
+        neighbours[a].add(b)
+        neighbours[b].add(a)
+    triangles = [
+        (a, b, c) for a, b in pairs[kept].tolist() if a < b
+        for c in neighbours[a] & neighbours[b] if c > b
+    ]
+    if triangles:
+        triangles = np.array(triangles, dtype=np.int64)
+        triple_km, offsets = evaluate_trips(triangles, pickups, dropoffs, ride_limit_km, cost_provider,
+                                            deadline=deadline)
+        feasible = np.isfinite(triple_km)
+        trips.append((triangles[feasible], triple_km[feasible], offsets[feasible]))
+    return trips
+
+
+def select_trips(costs: np.ndarray, trip_riders: List[np.ndarray], trip_drivers: np.ndarray,
+                 n_riders: int, n_drivers: int, time_limit_s: float) -> Tuple[np.ndarray, str]:
+    """
+    Pick (trip, driver) candidates so no rider or driver is used twice, at
+    the lowest total cost, where costs already reward every rider served.
+    
+    The greedy pick takes the most rewarding candidates first. With at most
+    SHARE_ILP_MAX_VARIABLES candidates an ILP (HiGHS) then gets up to
+    time_limit_s to improve on it, and wins if it does. Returns the chosen
+    candidate indices and the method that chose them.
+    """
+    n = len(costs)
+    rider_used = np.zeros(n_riders, dtype=bool)
+    driver_used = np.zeros(n_drivers, dtype=bool)
+    chosen = []
+    for i in np.argsort(costs, kind='stable').tolist():
+        if costs[i] >= 0:
+            break
+        if driver_used[trip_drivers[i]] or rider_used[trip_riders[i]].any():
+            continue
+        driver_used[trip_drivers[i]] = True
+        rider_used[trip_riders[i]] = True
+        chosen.append(i)
+    chosen = np.array(chosen, dtype=np.int64)
+    
+    if n == 0 or n > SHARE_ILP_MAX_VARIABLES or time_limit_s <= 0:
+        return chosen, 'greedy'
+    
+    sizes = np.array([len(riders) for riders in trip_riders])
+    rows = np.concatenate(trip_riders + [n_riders + trip_drivers])
+    cols = np.concatenate([np.repeat(np.arange(n), sizes), np.arange(n)])
+    matrix = csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(n_riders + n_drivers, n))
+    result = milp(costs, integrality=np.ones(n), bounds=Bounds(0, 1),
+                  constraints=LinearConstraint(matrix, -np.inf, 1),
+                  options={'time_limit': time_limit_s})
+    if result.x is not None and result.fun < costs[chosen].sum() - 1e-6:
+        return np.flatnonzero(result.x > 0.5), 'ilp'
+    return chosen, 'greedy'
+
+
+class StageTimer:
+    """
+    Wall and CPU time of the consecutive stages of a run.
+    
+    Starting a stage ends the one before. CPU time is the calling thread's,
+    so route solves in worker processes only count in their own results.
+    """
+    __slots__ = ('stages', 'current', '_wall', '_cpu')
+    
+    def __init__(self):
+        self.stages = {}
+        self.current = None
+        self._wall = self._cpu = 0.0
+    
+    def start(self, stage: Optional[str]):
+        wall, cpu = time.perf_counter(), time.thread_time()
+        if self.current is not None:
+            timing = self.stages.setdefault(self.current, {'wall_ms': 0.0, 'cpu_ms': 0.0})
+            timing['wall_ms'] += (wall - self._wall) * 1000
+            timing['cpu_ms'] += (cpu - self._cpu) * 1000
+        self.current, self._wall, self._cpu = stage, wall, cpu
+    
+    def stop(self):
+        self.start(None)
+    
+    def to_dict(self) -> Dict:
+        return {
+            stage: {name: round(ms, 1) for name, ms in timing.items()}
+            for stage, timing in self.stages.items()
+        }
+
+
+def profile_summary(profiler: cProfile.Profile, limit: int = PROFILE_TOP_FUNCTIONS) -> List[Dict]:
+    """The functions a profiled run spent most cumulative time in"""
+    rows = sorted(pstats.Stats(profiler).stats.items(), key=lambda row: row[1][3], reverse=True)
+    return [
+        {
+            'function': f'{os.path.basename(filename)}:{line}({name})',
+            'calls': calls,
+            'total_ms': round(total * 1000, 2),
+            'cumulative_ms': round(cumulative * 1000, 2)
+        }
+        for (filename, line, name), (_, calls, total, cumulative, _) in rows[:limit]
+    ]
 
 
 class Location:
     """Represents a geographical location"""
+    __slots__ = ('lat', 'lon', 'type', 'person_id')
+    
     def __init__(self, lat: float, lon: float, location_type: str, person_id: int = None):
         self.lat = lat
         self.lon = lon
         self.type = location_type  # 'pickup' or 'dropoff'
         self.person_id = person_id
-
+    
     def to_dict(self):
         return {
             'lat': self.lat,
@@ -31,14 +1368,16 @@ class Location:
 
 class Rider:
     """Represents a rider with pickup and dropoff locations"""
+    __slots__ = ('id', 'pickup', 'dropoff', 'max_wait_time', 'assigned_driver')
+    
     def __init__(self, rider_id: int, pickup: Tuple[float, float], 
-                 dropoff: Tuple[float, float], max_wait_time: int = 15):
+                 dropoff: Tuple[float, float], max_wait_time: float = 15):
         self.id = rider_id
         self.pickup = Location(pickup[0], pickup[1], 'pickup', rider_id)
         self.dropoff = Location(dropoff[0], dropoff[1], 'dropoff', rider_id)
         self.max_wait_time = max_wait_time
         self.assigned_driver = None
-
+    
     def to_dict(self):
         return {
             'id': self.id,
@@ -50,6 +1389,8 @@ class Rider:
 
 class Driver:
     """Represents a driver with location and capacity"""
+    __slots__ = ('id', 'location', 'capacity', 'assigned_riders', 'route', 'total_distance')
+    
     def __init__(self, driver_id: int, location: Tuple[float, float], 
                  capacity: int = 4):
         self.id = driver_id
@@ -58,7 +1399,7 @@ class Driver:
         self.assigned_riders = []
         self.route = []
         self.total_distance = 0
-
+    
     def to_dict(self):
         return {
             'id': self.id,
@@ -70,17 +1411,318 @@ class Driver:
         }
 
 
+RIDER_DTYPE = np.dtype([
+    ('id', np.int64),
+    ('pickup_lat', np.float64), ('pickup_lon', np.float64),
+    ('dropoff_lat', np.float64), ('dropoff_lon', np.float64),
+    ('max_wait_time', np.float64),
+    ('assigned_driver', np.int64),  # UNASSIGNED until matched
+])
+
+DRIVER_DTYPE = np.dtype([
+    ('id', np.int64),
+    ('lat', np.float64), ('lon', np.float64),
+    ('capacity', np.int32),
+])
+
+UNASSIGNED = -1
+
+
+def group_rows(labels: np.ndarray) -> Dict[int, np.ndarray]:
+    """Map each label to the (ascending) row indices carrying it"""
+    order = np.argsort(labels, kind='stable')
+    values, starts = np.unique(labels[order], return_index=True)
+    return {int(value): rows for value, rows in zip(values, np.split(order, starts[1:]))}
+
+
+def riders_to_array(riders: List[Dict]) -> np.ndarray:
+    """Pack rider request dicts into a RIDER_DTYPE structured array"""
+    return np.array([
+        (r['id'], r['pickup'][0], r['pickup'][1], r['dropoff'][0], r['dropoff'][1],
+         r.get('max_wait_time', 15), UNASSIGNED)
+        for r in riders
+    ], dtype=RIDER_DTYPE)
+
+
+def drivers_to_array(drivers: List[Dict]) -> np.ndarray:
+    """Pack driver dicts into a DRIVER_DTYPE structured array"""
+    return np.array([
+        (d['id'], d['location'][0], d['location'][1], d.get('capacity', 4))
+        for d in drivers
+    ], dtype=DRIVER_DTYPE)
+
+
+class RiderStore:
+    """
+    Columnar rider table (a RIDER_DTYPE structured array).
+    
+    The optimizer stages work on row indices and coordinate columns; Rider
+    objects are only built, once per row, when a caller indexes or iterates
+    the store, so a batch never allocates objects for riders it doesn't return.
+    """
+    __slots__ = ('data', '_views')
+    
+    def __init__(self, data: np.ndarray = None):
+        self.data = np.zeros(0, dtype=RIDER_DTYPE) if data is None else data
+        self._views = {}
+    
+    @classmethod
+    def from_dicts(cls, riders: List[Dict]) -> 'RiderStore':
+        return cls(riders_to_array(riders))
+    
+    def __len__(self):
+        return len(self.data)
+    
+    def __bool__(self):
+        return len(self.data) > 0
+    
+    def __getitem__(self, row: int) -> Rider:
+        if row < 0:
+            row += len(self.data)
+        view = self._views.get(row)
+        if view is None:
+            rec = self.data[row]
+            view = Rider(int(rec['id']), (float(rec['pickup_lat']), float(rec['pickup_lon'])),
+                         (float(rec['dropoff_lat']), float(rec['dropoff_lon'])), float(rec['max_wait_time']))
+            if rec['assigned_driver'] != UNASSIGNED:
+                view.assigned_driver = int(rec['assigned_driver'])
+            self._views[row] = view
+        return view
+    
+    def __iter__(self):
+        return (self[row] for row in range(len(self.data)))
+    
+    @property
+    def ids(self) -> np.ndarray:
+        return self.data['id']
+    
+    def pickup_coords(self, rows: np.ndarray = None) -> np.ndarray:
+        """(n, 2) pickup [lat, lon] of all riders, or of the given rows"""
+        data = self.data if rows is None else self.data[rows]
+        return np.column_stack([data['pickup_lat'], data['pickup_lon']])
+    
+    def dropoff_coords(self, rows: np.ndarray = None) -> np.ndarray:
+        """(n, 2) dropoff [lat, lon] of all riders, or of the given rows"""
+        data = self.data if rows is None else self.data[rows]
+        return np.column_stack([data['dropoff_lat'], data['dropoff_lon']])
+    
+    def assign(self, rows: np.ndarray, driver_id: int):
+        """Record a driver assignment in the table and on any built views"""
+        self.data['assigned_driver'][rows] = driver_id
+        for row in np.atleast_1d(rows):
+            if int(row) in self._views:
+                self._views[int(row)].assigned_driver = driver_id
+
+
+class GridIndex:
+    """
+    Spatial index bucketing points into fixed-size lat/lon grid cells.
+    
+    Supports incremental insert/move/remove as drivers report positions, and
+    exact radius and k-nearest queries: only the cells overlapping the search
+    area are scanned, then candidates are filtered with vectorized Haversine.
+    """
+    def __init__(self, cell_km: float = 1.0):
+        self.cell_km = cell_km
+        self.cell_deg = cell_km / KM_PER_DEGREE
+        self.cells = {}  # (row, col) -> set of point ids
+        self.positions = {}  # point id -> (lat, lon, cell)
+    
+    def __len__(self):
+        return len(self.positions)
+    
+    def __contains__(self, point_id):
+        return point_id in self.positions
+    
+    def _cell(self, lat: float, lon: float) -> Tuple[int, int]:
+        return int(math.floor(lat / self.cell_deg)), int(math.floor(lon / self.cell_deg))
+    
+    def insert(self, point_id, lat: float, lon: float):
+        """Add a point, or move it if it is already indexed"""
+        cell = self._cell(lat, lon)
+        if point_id in self.positions:
+            old_cell = self.positions[point_id][2]
+            if old_cell != cell:
+                self._discard(point_id, old_cell)
+                self.cells.setdefault(cell, set()).add(point_id)
+        else:
+            self.cells.setdefault(cell, set()).add(point_id)
+        self.positions[point_id] = (lat, lon, cell)
+    
+    move = insert
+    
+    def remove(self, point_id):
+        """Drop a point from the index; unknown ids are ignored"""
+        if point_id in self.positions:
+            _, _, cell = self.positions.pop(point_id)
+            self._discard(point_id, cell)
+    
+    def _discard(self, point_id, cell):
+        members = self.cells[cell]
+        members.discard(point_id)
+        if not members:
+            del self.cells[cell]
+    
+    def _candidates(self, lat: float, lon: float, radius_km: float) -> List:
+        """Ids in every cell overlapping the bounding box of the search circle"""
+        dlat = radius_km / KM_PER_DEGREE
+        cos_lat = max(math.cos(math.radians(min(abs(lat) + dlat, 90.0))), 1e-6)
+        dlon = radius_km / (KM_PER_DEGREE * cos_lat)
+        
+        row_lo, col_lo = self._cell(lat - dlat, lon - dlon)
+        row_hi, col_hi = self._cell(lat + dlat, lon + dlon)
+        wraps = lon - dlon < -180 or lon + dlon > 180
+        
+        # Scan the populated cells instead when the box covers more cells than exist
+        if wraps or (row_hi - row_lo + 1) * (col_hi - col_lo + 1) > len(self.cells):
+            return [
+                point_id for (row, col), members in self.cells.items()
+                if row_lo <= row <= row_hi and (wraps or col_lo <= col <= col_hi)
+                for point_id in members
+            ]
+        
+        ids = []
+        for row in range(row_lo, row_hi + 1):
+            for col in range(col_lo, col_hi + 1):
+                ids.extend(self.cells.get((row, col), ()))
+        return ids
+    
+    def query_radius(self, lat: float, lon: float, radius_km: float) -> List[Tuple[object, float]]:
+        """(id, distance km) of every point within radius_km, nearest first"""
+        ids = self._candidates(lat, lon, radius_km)
+        if not ids:
+            return []
+        
+        coords = np.array([self.positions[i][:2] for i in ids])
+        distances = haversine_matrix([lat, lon], coords)[0]
+        keep = np.flatnonzero(distances <= radius_km)
+        keep = keep[np.argsort(distances[keep], kind='stable')]
+        return [(ids[i], float(distances[i])) for i in keep]
+    
+    def nearest(self, lat: float, lon: float, k: int = 1,
+                max_radius_km: float = None) -> List[Tuple[object, float]]:
+        """(id, distance km) of the k nearest points, optionally within max_radius_km"""
+        if k <= 0 or not self.positions:
+            return []
+        
+        # Grow the search circle until it holds k points; results inside it are exact
+        radius = self.cell_km
+        limit = math.pi * EARTH_RADIUS_KM if max_radius_km is None else max_radius_km
+        while True:
+            radius = min(radius, limit)
+            found = self.query_radius(lat, lon, radius)
+            if len(found) >= k or radius >= limit or len(found) == len(self.positions):
+                return found[:k]
+            radius *= 2
+
+
 class RideSharingOptimizer:
     """Main optimizer class for ride-sharing algorithm"""
     
-    def __init__(self):
-        self.riders = []
+    def __init__(self, workers: int = 1, exact_max_nodes: int = EXACT_MAX_NODES,
+                 index_cell_km: float = 1.0, cost_provider: Optional[CostProvider] = None):
+        """
+        workers controls per-driver route solving: 1 solves sequentially in
+        this process, a larger number fans routes out to a process pool, and
+        0 uses one worker per CPU core. The pool is started on first use and
+        kept for later calls until shutdown().
+        
+        Routes with at most exact_max_nodes nodes (driver start plus a pickup
+        and dropoff per rider) are solved exactly instead of with OR-Tools;
+        0 always uses OR-Tools.
+        
+        Driver positions are kept in a GridIndex with index_cell_km cells,
+        which later calls update rather than rebuild (see index_drivers).
+        Each driver's route is kept too, and the next call's OR-Tools search
+        for that driver starts from it (see carry_over_order).
+        
+        cost_provider prices route legs and solo trips; the default is
+        straight-line distance. Clustering and driver assignment stay
+        straight-line either way.
+        """
+        self.riders = RiderStore()
         self.drivers = []
+        self.driver_table = np.zeros(0, dtype=DRIVER_DTYPE)
         self.distance_matrix = None
+        self.workers = workers
+        self.exact_max_nodes = exact_max_nodes
+        self.driver_index = GridIndex(index_cell_km)
+        self.cluster_centers = None  # centroids of the last clustering, used for warm starts
+        self.previous_routes = {}  # driver id -> route of the last optimize(), used for warm starts
+        self.cost_provider = cost_provider or HaversineCostProvider()
+        self._pool = None
+        self._pool_workers = None
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.shutdown()
+    
+    def process_pool(self, workers: int) -> ProcessPoolExecutor:
+        """The optimizer's process pool with workers processes (0 for one per core), started once"""
+        if self._pool is not None and self._pool_workers != workers:
+            self.shutdown()
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=workers or None)
+            self._pool_workers = workers
+        return self._pool
+    
+    def shutdown(self, wait: bool = True):
+        """Stop the process pool, if one was started; a later parallel call starts a new one"""
+        if self._pool is not None:
+            self._pool.shutdown(wait=wait, cancel_futures=True)
+            self._pool = self._pool_workers = None
+    
+    def index_drivers(self) -> int:
+        """
+        Bring the driver spatial index in line with self.driver_table. The
+        index is kept across calls: only drivers that are new, have moved or
+        are gone are touched, so positions already reported through
+        update_driver_location cost nothing here. Returns how many changed.
+        """
+        ids = self.driver_table['id'].tolist()
+        positions = self.driver_index.positions
+        gone = positions.keys() - set(ids)
+        for driver_id in gone:
+            self.driver_index.remove(driver_id)
         
+        changed = len(gone)
+        for driver_id, lat, lon in zip(ids, self.driver_table['lat'].tolist(), self.driver_table['lon'].tolist()):
+            known = positions.get(driver_id)
+            if known is None or known[0] != lat or known[1] != lon:
+                self.driver_index.insert(driver_id, lat, lon)
+                changed += 1
+        return changed
+    
+    def update_driver_location(self, driver_id: int, lat: float, lon: float):
+        """Record a driver's new position in the index and on its Driver object"""
+        for driver in self.drivers:
+            if driver.id == driver_id:
+                driver.location = Location(lat, lon, 'driver', driver_id)
+        row = self.driver_table['id'] == driver_id
+        self.driver_table['lat'][row] = lat
+        self.driver_table['lon'][row] = lon
+        self.driver_index.insert(driver_id, lat, lon)
+    
+    def remove_driver(self, driver_id: int):
+        """Take a driver out of the index and the current fleet"""
+        self.drivers = [d for d in self.drivers if d.id != driver_id]
+        self.driver_table = self.driver_table[self.driver_table['id'] != driver_id]
+        self.driver_index.remove(driver_id)
+    
+    def nearest_drivers(self, lat: float, lon: float, k: int = 1,
+                        max_radius_km: float = None) -> List[Tuple[int, float]]:
+        """(driver id, distance km) of the k drivers nearest to a point"""
+        return self.driver_index.nearest(lat, lon, k, max_radius_km)
+    
+    def drivers_within(self, lat: float, lon: float, radius_km: float) -> List[Tuple[int, float]]:
+        """(driver id, distance km) of every driver within radius_km of a point"""
+        return self.driver_index.query_radius(lat, lon, radius_km)
+    
     def haversine_distance(self, loc1: Location, loc2: Location) -> float:
         """Calculate distance between two locations using Haversine formula"""
-        R = 6371  # Earth's radius in kilometers
+        R = EARTH_RADIUS_KM
         
         lat1, lon1 = math.radians(loc1.lat), math.radians(loc1.lon)
         lat2, lon2 = math.radians(loc2.lat), math.radians(loc2.lon)
@@ -93,20 +1735,23 @@ class RideSharingOptimizer:
         
         return R * c
     
-    def calculate_distance_matrix(self, locations: List[Location]) -> np.ndarray:
+    def calculate_distance_matrix(self, locations: List[Location], dtype=np.float64,
+                                  meters: bool = False) -> np.ndarray:
         """Create distance matrix for all locations"""
-        n = len(locations)
-        matrix = np.zeros((n, n))
+        return haversine_matrix(location_coords(locations), dtype=dtype, meters=meters)
+    
+    def cluster_riders(self, n_clusters: int = None, method: str = 'kmeans') -> Dict[int, np.ndarray]:
+        """
+        Cluster riders based on pickup locations
         
-        for i in range(n):
-            for j in range(n):
-                if i != j:
-                    matrix[i][j] = self.haversine_distance(locations[i], locations[j])
+        Returns cluster label -> array of row indices into self.riders.
         
-        return matrix
-    
-    def cluster_riders(self, n_clusters: int = None) -> Dict[int, List[Rider]]:
-        """Cluster riders based on pickup locations using K-means"""
+        method selects the backend:
+          'kmeans'    - full K-means with 10 restarts
+          'minibatch' - MiniBatchKMeans, for large batches
+          'grid'      - bucket pickups into roughly n_clusters grid cells
+          'warm'      - single K-means run seeded with the previous centroids
+        """
         if not self.riders:
             return {}
         
@@ -114,249 +1759,742 @@ class RideSharingOptimizer:
             n_clusters = min(len(self.drivers), len(self.riders))
         
         # Extract pickup coordinates
-        pickup_coords = np.array([[r.pickup.lat, r.pickup.lon] for r in self.riders])
+        pickup_coords = self.riders.pickup_coords()
         
-        # Perform K-means clustering
-        kmeans = KMeans(n_clusters=n_clusters, random_state=42, n_init=10)
-        labels = kmeans.fit_predict(pickup_coords)
+        if method == 'kmeans':
+            kmeans = KMeans(n_clusters=n_clusters, random_state=42, n_init=10)
+            labels = kmeans.fit_predict(pickup_coords)
+        elif method == 'minibatch':
+            kmeans = MiniBatchKMeans(n_clusters=n_clusters, random_state=42, n_init=3,
+                                     batch_size=min(len(self.riders), 1024))
+            labels = kmeans.fit_predict(pickup_coords)
+        elif method == 'grid':
+            labels = self._grid_labels(pickup_coords, n_clusters)
+        elif method == 'warm':
+            init = self._warm_start_centers(pickup_coords, n_clusters)
+            kmeans = KMeans(n_clusters=n_clusters, init=init, n_init=1, random_state=42)
+            labels = kmeans.fit_predict(pickup_coords)
+        else:
+            raise ValueError(f"Unknown clustering method '{method}', expected one of {CLUSTERING_METHODS}")
         
-        # Group riders by cluster
-        clusters = {}
-        for idx, label in enumerate(labels):
-            if label not in clusters:
-                clusters[label] = []
-            clusters[label].append(self.riders[idx])
+        self.cluster_centers = np.array([
+            pickup_coords[labels == label].mean(axis=0) for label in np.unique(labels)
+        ])
         
-        return clusters
+        return group_rows(labels)
     
-    def assign_drivers_to_clusters(self, clusters: Dict[int, List[Rider]]) -> Dict[int, int]:
-        """Assign drivers to rider clusters based on proximity"""
+    def _grid_labels(self, coords: np.ndarray, n_clusters: int) -> np.ndarray:
+        """Label points by the square grid cell they fall in, sized for about n_clusters cells"""
+        lo = coords.min(axis=0)
+        extent = np.maximum(coords.max(axis=0) - lo, 1e-9)
+        cell = max(math.sqrt(extent[0] * extent[1] / n_clusters), extent.max() / n_clusters)
+        
+        cells = np.floor((coords - lo) / cell).astype(np.int64)
+        _, labels = np.unique(cells, axis=0, return_inverse=True)
+        return labels.reshape(-1)
+    
+    def _warm_start_centers(self, coords: np.ndarray, n_clusters: int) -> np.ndarray:
+        """
+        Initial centroids for a warm-started K-means: the previous batch's
+        centroids, topped up with the pickups farthest from them if the new
+        batch needs more clusters
+        """
+        if self.cluster_centers is None or not len(self.cluster_centers):
+            centers = coords[:1]
+        else:
+            centers = self.cluster_centers[:n_clusters]
+        
+        while len(centers) < n_clusters:
+            gaps = haversine_matrix(coords, centers).min(axis=1)
+            centers = np.vstack([centers, coords[int(np.argmax(gaps))]])
+        
+        return centers
+    
+    def assign_drivers_to_clusters(self, clusters: Dict[int, np.ndarray],
+                                   pickup_radius_km: float = None) -> Dict[int, int]:
+        """
+        Assign drivers to rider clusters based on proximity
+        
+        With pickup_radius_km only drivers the spatial index finds within that
+        radius of a cluster centroid are considered for it.
+        """
         if not self.drivers or not clusters:
             return {}
         
         # Calculate cluster centroids
-        cluster_centroids = {}
-        for cluster_id, riders in clusters.items():
-            avg_lat = np.mean([r.pickup.lat for r in riders])
-            avg_lon = np.mean([r.pickup.lon for r in riders])
-            cluster_centroids[cluster_id] = Location(avg_lat, avg_lon, 'centroid')
-        
-        # Calculate distances from drivers to centroids
-        driver_assignments = {}
-        assigned_clusters = set()
-        
-        # Sort drivers and clusters for greedy assignment
-        for driver in sorted(self.drivers, key=lambda d: d.id):
-            best_cluster = None
-            best_distance = float('inf')
-            
-            for cluster_id, centroid in cluster_centroids.items():
-                if cluster_id in assigned_clusters:
-                    continue
-                    
-                distance = self.haversine_distance(driver.location, centroid)
-                if distance < best_distance:
-                    best_distance = distance
-                    best_cluster = cluster_id
-            
-            if best_cluster is not None:
-                driver_assignments[driver.id] = best_cluster
-                assigned_clusters.add(best_cluster)
+        cluster_ids = list(clusters.keys())
+        pickups = self.riders.pickup_coords()
+        centroids = np.array([pickups[clusters[cluster_id]].mean(axis=0) for cluster_id in cluster_ids])
+        
+        # Candidate drivers: everyone, or only those near some centroid
+        drivers = np.sort(self.driver_table, order='id', kind='stable')
+        if pickup_radius_km is not None:
+            nearby = [
+                driver_id
+                for lat, lon in centroids
+                for driver_id, _ in self.driver_index.query_radius(lat, lon, pickup_radius_km)
+            ]
+            drivers = drivers[np.isin(drivers['id'], nearby)]
+            if not len(drivers):
+                return {}
+        
+        # Calculate distances from drivers to centroids in one pass
+        distances = haversine_matrix(np.column_stack([drivers['lat'], drivers['lon']]), centroids)
+        if pickup_radius_km is not None:
+            distances[distances > pickup_radius_km] = UNREACHABLE_COST
+        
+        # Minimum total driver-to-centroid distance (Hungarian method)
+        rows, cols = linear_sum_assignment(distances)
+        
+        return {
+            int(drivers['id'][row]): cluster_ids[col]
+            for row, col in zip(rows, cols)
+            if distances[row, col] < UNREACHABLE_COST
+        }
+    
+    def balance_clusters(self, clusters: Dict[int, np.ndarray], driver_assignments: Dict[int, int],
+                         pickup_radius_km: float = None) -> Tuple[Dict[int, np.ndarray], np.ndarray]:
+        """
+        Reassign riders so no cluster exceeds the capacity of its driver.
+        
+        Every rider is matched to a seat in one of the drivers' clusters at
+        minimum total pickup-to-centroid distance, never to a cluster whose
+        driver is farther than pickup_radius_km from the pickup or too far
+        to arrive within the rider's max_wait_time. Riders left without a
+        seat are returned as unmatched. Beyond EXACT_ASSIGNMENT_MAX_CELLS
+        rider-seat pairs, riders only compete for seats in their nearest
+        clusters (see _match_seats).
+        
+        Clusters and the unmatched riders are arrays of rows into self.riders.
+        """
+        n_riders = len(self.riders)
+        cluster_ids = [cid for cid in clusters if cid in driver_assignments.values()]
+        if not cluster_ids or not n_riders:
+            return {}, np.arange(n_riders)
+        
+        # Each cluster's driver row in the driver table
+        driver_rows = {int(driver_id): row for row, driver_id in enumerate(self.driver_table['id'])}
+        cluster_driver = {cluster_id: driver_rows[driver_id] for driver_id, cluster_id in driver_assignments.items()}
+        assigned = self.driver_table[[cluster_driver[cid] for cid in cluster_ids]]
+        
+        pickups = self.riders.pickup_coords()
+        centroids = np.array([pickups[clusters[cid]].mean(axis=0) for cid in cluster_ids])
+        driver_coords = np.column_stack([assigned['lat'], assigned['lon']])
+        
+        # Prune pairings no route could serve in time before any route is solved
+        reach = self.cost_provider.reach_km(self.riders.data['max_wait_time'])
+        if pickup_radius_km is not None:
+            reach = np.minimum(reach, pickup_radius_km)
+        
+        # One column per seat, so each cluster takes at most its capacity
+        seat_cluster = np.repeat(np.arange(len(cluster_ids)), assigned['capacity'])
+        labels = np.full(n_riders, -1)
         
-        return driver_assignments
+        if n_riders * len(seat_cluster) <= EXACT_ASSIGNMENT_MAX_CELLS:
+            distances = haversine_matrix(pickups, centroids)
+            distances[haversine_matrix(pickups, driver_coords) > reach[:, np.newaxis]] = UNREACHABLE_COST
+            seat_costs = distances[:, seat_cluster]
+            rows, seats = linear_sum_assignment(seat_costs)
+            reachable = seat_costs[rows, seats] < UNREACHABLE_COST
+            labels[rows[reachable]] = seat_cluster[seats[reachable]]
+        else:
+            labels = self._match_seats(pickups, centroids, driver_coords, reach, assigned['capacity'])
+        
+        balanced = {cluster_ids[label]: rows for label, rows in group_rows(labels).items() if label != -1}
+        return balanced, np.flatnonzero(labels == -1)
+    
+    def _match_seats(self, pickups: np.ndarray, centroids: np.ndarray, driver_coords: np.ndarray,
+                     reach: np.ndarray, capacities: np.ndarray) -> np.ndarray:
+        """
+        balance_clusters for batches too large for the dense Hungarian method.
+        
+        Each rider may only take a seat in one of its
+        ASSIGNMENT_CANDIDATE_CLUSTERS nearest clusters whose driver is within
+        reach, which keeps the graph sparse, and the graph is solved exactly
+        as a min-cost flow: as many riders as possible get a seat, at minimum
+        total pickup-to-centroid meters. Returns each rider's cluster
+        position, -1 if unmatched.
+        """
+        n_riders, n_clusters = len(pickups), len(centroids)
+        scale = np.array([KM_PER_DEGREE, KM_PER_DEGREE * math.cos(math.radians(float(pickups[:, 0].mean())))])
+        k = min(ASSIGNMENT_CANDIDATE_CLUSTERS, n_clusters)
+        _, nearest = cKDTree(centroids * scale).query(pickups * scale, k=k)
+        rows = np.repeat(np.arange(n_riders), k)
+        cols = nearest.reshape(-1)
+        
+        in_reach = haversine_pairwise(pickups[rows], driver_coords[cols]) <= reach[rows]
+        rows, cols = rows[in_reach], cols[in_reach]
+        meters = np.round(haversine_pairwise(pickups[rows], centroids[cols]) * 1000).astype(np.int64)
+        
+        # source -> every rider (one seat each) -> candidate clusters -> sink (their capacity)
+        source, sink = n_riders + n_clusters, n_riders + n_clusters + 1
+        flow = min_cost_flow.SimpleMinCostFlow()
+        arcs = flow.add_arcs_with_capacity_and_unit_cost(
+            np.concatenate([np.full(n_riders, source), rows, n_riders + np.arange(n_clusters)]),
+            np.concatenate([np.arange(n_riders), n_riders + cols, np.full(n_clusters, sink)]),
+            np.concatenate([np.ones(n_riders + len(rows), dtype=np.int64), capacities.astype(np.int64)]),
+            np.concatenate([np.zeros(n_riders, dtype=np.int64), meters, np.zeros(n_clusters, dtype=np.int64)])
+        )
+        flow.set_node_supply(source, n_riders)
+        flow.set_node_supply(sink, -n_riders)
+        
+        labels = np.full(n_riders, -1)
+        if flow.solve_max_flow_with_min_cost() == flow.OPTIMAL:
+            seated = flow.flows(arcs[n_riders:n_riders + len(rows)]) > 0
+            labels[rows[seated]] = cols[seated]
+        return labels
     
-    def optimize_route_for_driver(self, driver: Driver, riders: List[Rider]) -> List[Location]:
-        """Optimize route for a single driver using OR-Tools TSP solver"""
+    def _route_locations(self, driver: Driver, riders: List[Rider]) -> List[Location]:
+        """Solver node order: driver start, then every pickup, then every dropoff"""
+        return [driver.location] + [r.pickup for r in riders] + [r.dropoff for r in riders]
+    
+    def _apply_route_solution(self, driver: Driver, locations: List[Location],
+                              result: Dict) -> List[Location]:
+        """Map a solve_route result back onto the driver's locations"""
+        if result['order'] is None:
+            # Fallback: simple route if optimization fails
+            return list(locations)
+        
+        driver.total_distance = result['distance']
+        return [locations[node] for node in result['order']]
+    
+    def optimize_route_for_driver(self, driver: Driver, riders: List[Rider],
+                                  time_limit_ms: int = DEFAULT_ROUTE_TIME_LIMIT_MS,
+                                  max_detour_factor: Optional[float] = MAX_DETOUR_FACTOR) -> List[Location]:
+        """
+        Optimize route for a single driver using OR-Tools TSP solver
+        
+        Riders are picked up within their max_wait_time and kept on board for
+        at most max_detour_factor times their direct trip (see
+        rider_time_limits); riders who cannot be are left off the route.
+        
+        The route is kept on the driver, and the next call for the same
+        driver starts its search from it (see carry_over_order), so
+        re-optimizing a route that changed a little is quick.
+        """
         if not riders:
             return []
         
         # Filter riders that fit in driver's capacity
         riders = riders[:driver.capacity]
         
-        # Create list of locations (driver start, pickups, dropoffs)
-        locations = [driver.location]
-        location_map = {0: ('driver', driver.id)}
+        locations = self._route_locations(driver, riders)
+        result = solve_route(location_coords(locations), driver.capacity, time_limit_ms,
+                             self.exact_max_nodes, self.cost_provider,
+                             [r.max_wait_time for r in riders], max_detour_factor,
+                             initial_order=carry_over_order(driver.route, locations))
+        driver.route = self._apply_route_solution(driver, locations, result)
+        return driver.route
+    
+    def _route_budgets(self, jobs: List[Tuple[Driver, List[Rider]]], remaining_ms: Optional[float],
+                       workers: int) -> List[float]:
+        """
+        Split the remaining latency budget across route searches by size.
         
-        idx = 1
-        for rider in riders:
-            locations.append(rider.pickup)
-            location_map[idx] = ('pickup', rider.id)
-            idx += 1
+        Exactly solved routes need no budget. Searches get a share proportional to
+        their node count, scaled by how many of them can run at once; a share
+        below MIN_ROUTE_TIME_LIMIT_MS only buys a first solution.
+        """
+        sizes = [min(len(riders), driver.capacity) for driver, riders in jobs]
+        if remaining_ms is None:
+            return [0.0 if route_method(k, self.exact_max_nodes) == 'exact'
+                    else float(DEFAULT_ROUTE_TIME_LIMIT_MS) for k in sizes]
         
-        for rider in riders:
-            locations.append(rider.dropoff)
-            location_map[idx] = ('dropoff', rider.id)
-            idx += 1
+        weights = [0 if route_method(k, self.exact_max_nodes) == 'exact' else 2 * k + 1 for k in sizes]
+        total_weight = sum(weights)
+        if total_weight == 0:
+            return [0.0] * len(jobs)
         
-        # Calculate distance matrix
-        n = len(locations)
-        distance_matrix = [[0] * n for _ in range(n)]
+        searches = sum(1 for w in weights if w)
+        concurrency = min(searches, 1 if workers == 1 else (workers or os.cpu_count() or 1))
+        return [
+            min(remaining_ms, remaining_ms * concurrency * w / total_weight) if w else 0.0
+            for w in weights
+        ]
+    
+    def _solve_routes(self, jobs: List[Tuple[Driver, List[Rider]]], budgets: List[float], workers: int,
+                      max_detour_factor: Optional[float] = MAX_DETOUR_FACTOR,
+                      progress: Optional[Callable[[str, float], None]] = None,
+                      deadline: Optional[float] = None) -> List[Tuple[List[Location], Dict]]:
+        """
+        Solve per-driver routes, in a process pool when more than one worker
+        is allowed, returning (route, solve_route result) pairs in job order.
+        Every rider's max_wait_time and the detour limit are enforced, and no
+        search runs past deadline (see solve_route). Searches start from the
+        driver's route of the previous optimize() call, if it had one.
+        """
+        problems = [
+            self._route_locations(driver, riders[:driver.capacity])
+            for driver, riders in jobs
+        ]
+        initial_orders = [
+            carry_over_order(self.previous_routes.get(driver.id, []), locations)
+            for (driver, _), locations in zip(jobs, problems)
+        ]
         
-        for i in range(n):
-            for j in range(n):
-                if i != j:
-                    distance_matrix[i][j] = int(self.haversine_distance(locations[i], locations[j]) * 1000)
+        # Solvers only receive the coordinate array and capacity of each subproblem
+        payloads = [location_coords(locations) for locations in problems]
+        capacities = [driver.capacity for driver, _ in jobs]
+        thresholds = [self.exact_max_nodes] * len(jobs)
+        providers = [self.cost_provider] * len(jobs)
+        wait_limits = [[r.max_wait_time for r in riders[:driver.capacity]] for driver, riders in jobs]
+        detours = [max_detour_factor] * len(jobs)
+        searches = sum(
+            1 for locations in problems
+            if route_method(len(locations) // 2, self.exact_max_nodes) == 'ortools'
+        )
         
-        # Create routing model
-        manager = pywrapcp.RoutingIndexManager(n, 1, 0)
-        routing = pywrapcp.RoutingModel(manager)
+        args = [payloads, capacities, budgets, thresholds, providers, wait_limits, detours, initial_orders]
+        executor = self.process_pool(workers) if workers != 1 and searches > 1 else None
+        results = run_solves(partial(solve_route, deadline=deadline), args, executor, progress)
         
-        def distance_callback(from_index, to_index):
-            from_node = manager.IndexToNode(from_index)
-            to_node = manager.IndexToNode(to_index)
-            return distance_matrix[from_node][to_node]
+        return [
+            (self._apply_route_solution(driver, locations, result), result)
+            for (driver, _), locations, result in zip(jobs, problems, results)
+        ]
+    
+    def _cache_metrics(self, results: List[Dict]) -> Dict:
+        """Distance cache lookups of this call's route solves, wherever they ran"""
+        hits = sum(result['cache_hits'] for result in results)
+        misses = sum(result['cache_misses'] for result in results)
+        cache = get_distance_cache()
+        return {
+            'enabled': cache is not None,
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': round(hits / (hits + misses), 4) if hits + misses else 0.0,
+            'size': len(cache) if cache is not None else 0
+        }
+    
+    def _solver_metrics(self, results: List[Dict]) -> Dict:
+        """Totals over this call's route solves, wherever they ran"""
+        statuses = {}
+        for result in results:
+            statuses[result['status']] = statuses.get(result['status'], 0) + 1
+        return {
+            'solves': len(results),
+            'wall_ms': round(sum(result['elapsed_ms'] for result in results), 1),
+            'cpu_ms': round(sum(result['cpu_ms'] for result in results), 1),
+            'slowest_ms': round(max((result['elapsed_ms'] for result in results), default=0.0), 1),
+            'first_solution_only': sum(1 for result in results if result['first_solution_only']),
+            'warm_started': sum(1 for result in results if result['warm_started']),
+            'statuses': statuses
+        }
+    
+    def _match(self, driver: Driver, riders: List[Rider], route: List[Location], solver: Dict,
+               arrivals: List[float]) -> Dict:
+        """
+        Record a driver's riders and route and describe them for the response.
+        arrivals holds the minutes from the start to each stop of route.
+        """
+        driver.route = route
+        driver.assigned_riders = [r.id for r in riders]
         
-        transit_callback_index = routing.RegisterTransitCallback(distance_callback)
-        routing.SetArcCostEvaluatorOfAllVehicles(transit_callback_index)
+        etas = {r.id: {'rider_id': r.id} for r in riders}
+        for stop, minutes in zip(route[1:], arrivals[1:]):
+            etas[stop.person_id][f'{stop.type}_eta_min'] = round(minutes, 1)
+        
+        return {
+            'driver_id': driver.id,
+            'driver_location': driver.location.to_dict(),
+            'riders': [r.to_dict() for r in riders],
+            'route': [loc.to_dict() for loc in route],
+            'distance': round(driver.total_distance, 2),
+            'cost': round(driver.total_distance * COST_PER_KM, 2),
+            'etas': list(etas.values()),
+            'solver': solver
+        }
+    
+    def _optimize_clustered(self, start_time: float, workers: int, deadline_ms: Optional[float],
+                            pickup_radius_km: Optional[float], clustering: str,
+                            max_detour_factor: Optional[float],
+                            progress: Optional[Callable[[str, float], None]]) -> Tuple:
+        """
+        Cluster-first pipeline: cluster riders, match clusters to drivers and
+        solve every driver's route on its own.
+        
+        Returns (matches, unmatched rider rows, solve_route results, clustering ms).
+        """
+        # Step 1: Cluster riders
+        n_clusters = min(len(self.drivers), len(self.riders))
+        clustering_start = time.perf_counter()
+        clusters = self.cluster_riders(n_clusters, clustering)
+        clustering_ms = (time.perf_counter() - clustering_start) * 1000
+        if progress is not None:
+            progress('assignment', 0.0)
+        
+        # Step 2: Assign drivers to clusters, then fit clusters to vehicle capacities
+        for _ in range(CAPACITY_REFINE_ITERATIONS):
+            driver_assignments = self.assign_drivers_to_clusters(clusters, pickup_radius_km)
+            balanced, unmatched = self.balance_clusters(clusters, driver_assignments, pickup_radius_km)
+            converged = balanced.keys() == clusters.keys() and all(
+                np.array_equal(balanced[cid], clusters[cid]) for cid in balanced
+            )
+            clusters = balanced
+            if converged:
+                break
+        driver_assignments = {
+            driver_id: cluster_id for driver_id, cluster_id in driver_assignments.items()
+            if cluster_id in clusters
+        }
+        
+        # Step 3: Optimize routes for each driver
+        jobs = [
+            (driver, [self.riders[row] for row in clusters[driver_assignments[driver.id]]])
+            for driver in self.drivers
+            if driver.id in driver_assignments
+        ]
         
-        # Add pickup-dropoff constraints
-        for rider in riders:
-            pickup_idx = None
-            dropoff_idx = None
+        remaining_ms = deadline = None
+        if deadline_ms is not None:
+            remaining_ms = max(deadline_ms - (time.perf_counter() - start_time) * 1000, 0.0)
+            deadline = time.time() + remaining_ms / 1000
+        budgets = self._route_budgets(jobs, remaining_ms, workers)
+        if progress is not None:
+            progress('routing', 0.0)
+        solved = self._solve_routes(jobs, budgets, workers, max_detour_factor, progress, deadline)
+        
+        job_rows = [clusters[driver_assignments[driver.id]] for driver, _ in jobs]
+        matches, dropped = self._record_routes(jobs, job_rows, budgets, solved)
+        unmatched = np.sort(np.concatenate([unmatched] + dropped)).astype(np.int64)
+        return matches, unmatched, [result for _, result in solved], clustering_ms
+    
+    def _record_routes(self, jobs: List[Tuple[Driver, List[Rider]]], job_rows: List[np.ndarray],
+                       budgets: List[float], solved: List[Tuple]) -> Tuple[List[Dict], List[np.ndarray]]:
+        """
+        Assign the riders of solved per-driver routes and describe them.
+        Returns the matches and, per route, the rider rows it could not serve
+        in time, which go back to the unmatched pool.
+        """
+        matches, dropped = [], []
+        for (driver, assigned_riders), rows, budget, (route, result) in zip(jobs, job_rows, budgets, solved):
+            served = np.setdiff1d(np.arange(len(rows)), result['dropped'])
+            dropped.append(rows[result['dropped']])
             
-            for idx, (loc_type, loc_id) in location_map.items():
-                if loc_type == 'pickup' and loc_id == rider.id:
-                    pickup_idx = manager.NodeToIndex(idx)
-                elif loc_type == 'dropoff' and loc_id == rider.id:
-                    dropoff_idx = manager.NodeToIndex(idx)
+            # Update rider assignments
+            self.riders.assign(rows[served], driver.id)
             
-            if pickup_idx is not None and dropoff_idx is not None:
-                routing.AddPickupAndDelivery(pickup_idx, dropoff_idx)
-                routing.solver().Add(
-                    routing.VehicleVar(pickup_idx) == routing.VehicleVar(dropoff_idx)
-                )
-                routing.solver().Add(
-                    routing.CumulVar(pickup_idx, 'time') <= 
-                    routing.CumulVar(dropoff_idx, 'time')
-                )
-        
-        # Add capacity constraint
-        def demand_callback(from_index):
-            from_node = manager.IndexToNode(from_index)
-            if from_node in location_map:
-                loc_type, _ = location_map[from_node]
-                if loc_type == 'pickup':
-                    return 1
-                elif loc_type == 'dropoff':
-                    return -1
-            return 0
+            matches.append(self._match(driver, [assigned_riders[i] for i in served], route, {
+                'method': result['method'],
+                'budget_ms': round(budget, 1),
+                **solve_metrics(result)
+            }, result['arrivals']))
+        return matches, dropped
+    
+    def _optimize_shareability(self, start_time: float, workers: int, deadline_ms: Optional[float],
+                               pickup_radius_km: Optional[float], max_detour_factor: Optional[float],
+                               progress: Optional[Callable[[str, float], None]], stats: Dict) -> Tuple:
+        """
+        Shareability pipeline: find the pairs and triples of riders who can
+        ride together (shareability_graph), offer every trip to the nearest
+        drivers who can reach its riders in time, select trips and drivers
+        jointly (select_trips) and solve each chosen trip's route.
         
-        demand_callback_index = routing.RegisterUnaryTransitCallback(demand_callback)
-        routing.AddDimensionWithVehicleCapacity(
-            demand_callback_index,
-            0,  # null capacity slack
-            [driver.capacity],  # vehicle maximum capacities
-            True,  # start cumul to zero
-            'Capacity'
-        )
+        Unlike clustering, riders are only grouped when their trips fit
+        together, at the price of at most SHARE_MAX_TRIP riders per vehicle.
+        Returns the same tuple as _optimize_clustered, with the graph build
+        as the clustering time; stats receives the graph and selection sizes.
+        """
+        graph_start = time.perf_counter()
+        pickups, dropoffs = self.riders.pickup_coords(), self.riders.dropoff_coords()
+        waits = self.riders.data['max_wait_time'].astype(np.float64)
+        max_trip = min(SHARE_MAX_TRIP, int(self.driver_table['capacity'].max()))
+        graph_deadline = None
+        if deadline_ms is not None:
+            graph_ms = deadline_ms * SHARE_GRAPH_DEADLINE_SHARE - (graph_start - start_time) * 1000
+            graph_deadline = time.time() + max(graph_ms, 0.0) / 1000
+        trips = shareability_graph(pickups, dropoffs, waits, max_detour_factor, self.cost_provider, max_trip,
+                                   deadline=graph_deadline)
+        clustering_ms = (time.perf_counter() - graph_start) * 1000
+        if progress is not None:
+            progress('assignment', 0.0)
         
-        # Set search parameters
-        search_parameters = pywrapcp.DefaultRoutingSearchParameters()
-        search_parameters.first_solution_strategy = (
-            routing_enums_pb2.FirstSolutionStrategy.PATH_CHEAPEST_ARC
-        )
-        search_parameters.local_search_metaheuristic = (
-            routing_enums_pb2.LocalSearchMetaheuristic.GUIDED_LOCAL_SEARCH
-        )
-        search_parameters.time_limit.seconds = 5
+        # Offer each trip to the nearest drivers that reach every pickup within the riders' waits
+        driver_coords = np.column_stack([self.driver_table['lat'], self.driver_table['lon']])
+        scale = np.array([KM_PER_DEGREE, KM_PER_DEGREE * math.cos(math.radians(float(pickups[:, 0].mean())))])
+        tree = cKDTree(driver_coords * scale)
+        n_candidates = min(SHARE_CANDIDATE_DRIVERS, len(self.drivers))
+        reach = self.cost_provider.reach_km(waits)
+        if pickup_radius_km is not None:
+            reach = np.minimum(reach, pickup_radius_km)
         
-        # Solve
-        solution = routing.SolveWithParameters(search_parameters)
+        costs, trip_riders, trip_drivers = [], [], []
+        for members, route_km, offsets in trips:
+            if len(members) == 0:
+                continue
+            first = members[np.arange(len(members)), offsets.argmin(axis=1)]
+            _, nearest = tree.query(pickups[first] * scale, k=list(range(1, n_candidates + 1)),
+                                    distance_upper_bound=float(reach.max()))
+            trip, slot = np.nonzero(nearest < len(self.drivers))
+            drivers = nearest[trip, slot]
+            approach_km = self.cost_provider.pairwise_distance(driver_coords[drivers], pickups[first[trip]])
+            
+            in_time = (approach_km[:, np.newaxis] + offsets[trip] <= reach[members[trip]]).all(axis=1)
+            fits = self.driver_table['capacity'][drivers] >= members.shape[1]
+            ok = in_time & fits
+            costs.append(approach_km[ok] + route_km[trip[ok]] - RIDER_DROP_PENALTY_KM * members.shape[1])
+            trip_riders += list(members[trip[ok]])
+            trip_drivers.append(drivers[ok])
+        costs, trip_drivers = np.concatenate(costs), np.concatenate(trip_drivers)
+        
+        time_limit_s = SHARE_ILP_TIME_LIMIT_S
+        if deadline_ms is not None:
+            remaining_ms = max(deadline_ms - (time.perf_counter() - start_time) * 1000, 0.0)
+            time_limit_s = min(time_limit_s, remaining_ms / 2000)  # half of what is left, the rest routes
+        selection_start = time.perf_counter()
+        chosen, selection = select_trips(costs, trip_riders, trip_drivers, len(self.riders),
+                                         len(self.drivers), time_limit_s)
+        stats.update({
+            'trips': {str(members.shape[1]): len(members) for members, _, _ in trips},
+            'candidates': len(costs),
+            'selection': selection,
+            'selection_ms': round((time.perf_counter() - selection_start) * 1000, 1)
+        })
+        
+        jobs = [(self.drivers[trip_drivers[i]], [self.riders[row] for row in trip_riders[i]]) for i in chosen]
+        job_rows = [trip_riders[i] for i in chosen]
+        
+        remaining_ms = deadline = None
+        if deadline_ms is not None:
+            remaining_ms = max(deadline_ms - (time.perf_counter() - start_time) * 1000, 0.0)
+            deadline = time.time() + remaining_ms / 1000
+        budgets = self._route_budgets(jobs, remaining_ms, workers)
+        if progress is not None:
+            progress('routing', 0.0)
+        solved = self._solve_routes(jobs, budgets, workers, max_detour_factor, progress, deadline)
+        matches, dropped = self._record_routes(jobs, job_rows, budgets, solved)
+        
+        served = np.zeros(len(self.riders), dtype=bool)
+        for rows in job_rows:
+            served[rows] = True
+        unmatched = np.sort(np.concatenate([np.flatnonzero(~served)] + dropped)).astype(np.int64)
+        return matches, unmatched, [result for _, result in solved], clustering_ms
+    
+    def _optimize_joint(self, start_time: float, workers: int, deadline_ms: Optional[float],
+                        pickup_radius_km: Optional[float], max_detour_factor: Optional[float],
+                        progress: Optional[Callable[[str, float], None]]) -> Tuple:
+        """
+        Joint pipeline: split the city into regions of at most
+        JOINT_REGION_MAX_VEHICLES drivers and route each region's drivers
+        together in one multi-vehicle model, so riders are not tied to a
+        cluster and may ride with whichever vehicle serves them best.
+        
+        Returns the same tuple as _optimize_clustered; the region split is
+        reported as the clustering time.
+        """
+        # Regions: K-means over driver positions, riders join the region nearest their pickup
+        region_start = time.perf_counter()
+        driver_coords = np.column_stack([self.driver_table['lat'], self.driver_table['lon']])
+        pickup_coords = self.riders.pickup_coords()
+        n_regions = math.ceil(len(self.drivers) / JOINT_REGION_MAX_VEHICLES)
+        if n_regions > 1:
+            kmeans = KMeans(n_clusters=n_regions, random_state=42, n_init=10).fit(driver_coords)
+            driver_labels = kmeans.labels_
+            rider_labels = cdist(pickup_coords, kmeans.cluster_centers_).argmin(axis=1)
+        else:
+            driver_labels = np.zeros(len(self.drivers), dtype=np.int64)
+            rider_labels = np.zeros(len(self.riders), dtype=np.int64)
+        driver_groups, rider_groups = group_rows(driver_labels), group_rows(rider_labels)
+        clustering_ms = (time.perf_counter() - region_start) * 1000
         
-        if solution:
-            route = []
-            index = routing.Start(0)
-            total_distance = 0
+        regions = []
+        for label, rider_rows in rider_groups.items():
+            vehicle_rows = driver_groups.get(label, np.zeros(0, dtype=np.int64))
+            if len(vehicle_rows) == 0:
+                continue
+            
+            # Vehicles that could reach each pickup in time (and within the radius)
+            reach = self.cost_provider.reach_km(self.riders.data['max_wait_time'][rider_rows])
+            if pickup_radius_km is not None:
+                reach = np.minimum(reach, pickup_radius_km)
+            in_reach = haversine_matrix(pickup_coords[rider_rows], driver_coords[vehicle_rows]) <= reach[:, np.newaxis]
+            allowed = [np.flatnonzero(row).tolist() for row in in_reach]
+            
+            coords = np.vstack([driver_coords[vehicle_rows], pickup_coords[rider_rows],
+                                self.riders.dropoff_coords(rider_rows)])
+            regions.append((vehicle_rows, rider_rows, coords, allowed))
+        
+        # Regions share the remaining deadline by node count, like per-driver searches
+        weights = [len(coords) for _, _, coords, _ in regions]
+        deadline = None
+        if deadline_ms is None or not regions:
+            budgets = [float(DEFAULT_ROUTE_TIME_LIMIT_MS)] * len(regions)
+        else:
+            remaining_ms = max(deadline_ms - (time.perf_counter() - start_time) * 1000, 0.0)
+            deadline = time.time() + remaining_ms / 1000
+            concurrency = min(len(regions), 1 if workers == 1 else (workers or os.cpu_count() or 1))
+            budgets = [min(remaining_ms, remaining_ms * concurrency * w / sum(weights)) for w in weights]
+        
+        capacities = [self.driver_table['capacity'][vehicle_rows].tolist() for vehicle_rows, _, _, _ in regions]
+        payloads = [coords for _, _, coords, _ in regions]
+        allowed = [allowed for _, _, _, allowed in regions]
+        penalties = [RIDER_DROP_PENALTY_KM] * len(regions)
+        providers = [self.cost_provider] * len(regions)
+        wait_limits = [self.riders.data['max_wait_time'][rider_rows].tolist() for _, rider_rows, _, _ in regions]
+        detours = [max_detour_factor] * len(regions)
+        
+        if progress is not None:
+            progress('routing', 0.0)
+        args = [payloads, capacities, budgets, allowed, penalties, providers, wait_limits, detours]
+        executor = self.process_pool(workers) if workers != 1 and len(regions) > 1 else None
+        results = run_solves(partial(solve_fleet_route, deadline=deadline), args, executor, progress)
+        
+        matches = []
+        unmatched = [rider_rows for label, rider_rows in rider_groups.items() if label not in driver_groups]
+        for (vehicle_rows, rider_rows, _, _), budget, result in zip(regions, budgets, results):
+            n_vehicles, n_riders = len(vehicle_rows), len(rider_rows)
+            unmatched.append(rider_rows[result['dropped']])
             
-            while not routing.IsEnd(index):
-                node = manager.IndexToNode(index)
-                route.append(locations[node])
+            for vehicle, row in enumerate(vehicle_rows):
+                order = result['orders'][vehicle]
+                if order is None or len(order) < 2:
+                    continue
                 
-                next_index = solution.Value(routing.NextVar(index))
-                next_node = manager.IndexToNode(next_index)
-                total_distance += self.haversine_distance(locations[node], locations[next_node])
+                driver = self.drivers[row]
+                served = [node - n_vehicles for node in order[1:] if node < n_vehicles + n_riders]
+                self.riders.assign(rider_rows[served], driver.id)
                 
-                index = next_index
-            
-            driver.total_distance = total_distance
-            return route
-        
-        # Fallback: simple route if optimization fails
-        route = [driver.location]
-        for rider in riders:
-            route.append(rider.pickup)
-        for rider in riders:
-            route.append(rider.dropoff)
-        return route
-    
-    def optimize(self, riders: List[Dict], drivers: List[Dict]) -> Dict:
-        """Main optimization function"""
-        # Convert input to objects
-        self.riders = [
-            Rider(r['id'], tuple(r['pickup']), tuple(r['dropoff']))
-            for r in riders
-        ]
+                route = [driver.location]
+                for node in order[1:]:
+                    rider = self.riders[rider_rows[(node - n_vehicles) % n_riders]]
+                    route.append(rider.pickup if node < n_vehicles + n_riders else rider.dropoff)
+                driver.total_distance = result['distances'][vehicle]
+                
+                matches.append(self._match(driver, [self.riders[rider_rows[i]] for i in served], route, {
+                    'method': result['method'],
+                    'budget_ms': round(budget, 1),
+                    **solve_metrics(result)
+                }, result['arrivals'][vehicle]))
+        
+        unmatched = np.sort(np.concatenate(unmatched)) if unmatched else np.zeros(0, dtype=np.int64)
+        return matches, unmatched, results, clustering_ms
+    
+    def optimize(self, riders: List[Dict], drivers: List[Dict],
+                 workers: Optional[int] = None, deadline_ms: Optional[float] = None,
+                 pickup_radius_km: Optional[float] = None, clustering: str = 'kmeans',
+                 mode: str = 'cluster', max_detour_factor: Optional[float] = MAX_DETOUR_FACTOR,
+                 progress: Optional[Callable[[str, float], None]] = None, profile: bool = False) -> Dict:
+        """
+        Main optimization function
+        
+        riders and drivers are lists of request dicts, or RIDER_DTYPE and
+        DRIVER_DTYPE arrays such as the ingest module reads from bulk files.
+        workers overrides the instance setting for this call; see __init__.
+        deadline_ms is an overall latency budget; route searches share what is
+        left of it after clustering and assignment. Without it every search
+        may run for up to DEFAULT_ROUTE_TIME_LIMIT_MS.
+        pickup_radius_km limits matching to drivers within that distance of
+        a cluster and its riders' pickups.
+        clustering picks the cluster_riders backend.
+        mode 'cluster' clusters riders first and routes every driver alone;
+        'joint' routes all drivers of a region in one multi-vehicle model,
+        where a vehicle may serve more riders than its seats one after
+        another; 'shareability' pools only riders whose trips fit together,
+        in pairs and triples, for dense demand (metrics['shareability']
+        sums up the trips found and how they were selected). clustering only
+        applies to 'cluster'.
+        Riders are picked up within their max_wait_time minutes of dispatch
+        and ride at most max_detour_factor times their direct trip plus
+        DETOUR_ALLOWANCE_MIN (None lifts the detour limit). Riders no route
+        can serve that way are returned unmatched, and every match carries
+        the predicted pickup and dropoff ETAs of its riders.
+        progress is called with (stage, fraction of the stage done) as the
+        run moves through 'clustering', 'assignment' and 'routing'; raising
+        from it aborts the run.
+        The metrics report the wall and CPU 'timings' of every stage and a
+        'solver' summary; every match's 'solver' has its own route solve's
+        times, search status and objective. profile runs the call under
+        cProfile and adds its slowest functions as metrics['profile'] (route
+        solves in worker processes are not profiled).
+        """
+        if mode not in OPTIMIZE_MODES:
+            raise ValueError(f"Unknown optimization mode '{mode}', expected one of {OPTIMIZE_MODES}")
+        
+        profiler = cProfile.Profile() if profile else None
+        if profiler is not None:
+            profiler.enable()
+        try:
+            result = self._optimize(riders, drivers, workers, deadline_ms, pickup_radius_km,
+                                    clustering, mode, max_detour_factor, progress)
+        finally:
+            if profiler is not None:
+                profiler.disable()
+        
+        if profiler is not None and 'metrics' in result:
+            result['metrics']['profile'] = profile_summary(profiler)
+        return result
+    
+    def _optimize(self, riders, drivers, workers: Optional[int], deadline_ms: Optional[float],
+                  pickup_radius_km: Optional[float], clustering: str, mode: str,
+                  max_detour_factor: Optional[float],
+                  progress: Optional[Callable[[str, float], None]]) -> Dict:
+        """optimize() without profiling; stage times come from the progress reports"""
+        start_time = time.perf_counter()
+        if workers is None:
+            workers = self.workers
+        
+        timer = StageTimer()
+        timer.start('load')
+        user_progress = progress
+        
+        def progress(stage: str, fraction: float):
+            if stage != timer.current:
+                timer.start(stage)
+            if user_progress is not None:
+                user_progress(stage, fraction)
+        
+        # Routes of the last call warm-start this one's searches for the same drivers
+        self.previous_routes = {driver.id: driver.route for driver in self.drivers if len(driver.route) > 1}
+        
+        # Load input into columnar tables; Rider objects are only built for output
+        self.riders = RiderStore(riders.copy()) if isinstance(riders, np.ndarray) else RiderStore.from_dicts(riders)
+        self.driver_table = drivers if isinstance(drivers, np.ndarray) else drivers_to_array(drivers)
         self.drivers = [
-            Driver(d['id'], tuple(d['location']), d.get('capacity', 4))
-            for d in drivers
+            Driver(int(d['id']), (float(d['lat']), float(d['lon'])), int(d['capacity']))
+            for d in self.driver_table
         ]
+        self.index_drivers()
         
         if not self.riders or not self.drivers:
             return {
                 'success': False,
                 'message': 'Need at least one rider and one driver',
-                'matches': []
+                'matches': [],
+                'unmatched_riders': self.riders.ids.tolist()
             }
         
-        # Step 1: Cluster riders
-        n_clusters = min(len(self.drivers), len(self.riders))
-        clusters = self.cluster_riders(n_clusters)
+        progress('clustering', 0.0)
         
-        # Step 2: Assign drivers to clusters
-        driver_assignments = self.assign_drivers_to_clusters(clusters)
+        shareability = {}
+        if mode == 'joint':
+            matches, unmatched, results, clustering_ms = self._optimize_joint(
+                start_time, workers, deadline_ms, pickup_radius_km, max_detour_factor, progress
+            )
+        elif mode == 'shareability':
+            matches, unmatched, results, clustering_ms = self._optimize_shareability(
+                start_time, workers, deadline_ms, pickup_radius_km, max_detour_factor, progress, shareability
+            )
+        else:
+            matches, unmatched, results, clustering_ms = self._optimize_clustered(
+                start_time, workers, deadline_ms, pickup_radius_km, clustering, max_detour_factor, progress
+            )
         
-        # Step 3: Optimize routes for each driver
-        matches = []
-        total_distance = 0
-        total_riders_matched = 0
-        
-        for driver in self.drivers:
-            if driver.id in driver_assignments:
-                cluster_id = driver_assignments[driver.id]
-                assigned_riders = clusters[cluster_id]
-                
-                # Optimize route
-                route = self.optimize_route_for_driver(driver, assigned_riders)
-                driver.route = route
-                driver.assigned_riders = [r.id for r in assigned_riders[:driver.capacity]]
-                
-                # Update rider assignments
-                for rider in assigned_riders[:driver.capacity]:
-                    rider.assigned_driver = driver.id
-                
-                total_distance += driver.total_distance
-                total_riders_matched += len(driver.assigned_riders)
-                
-                matches.append({
-                    'driver_id': driver.id,
-                    'driver_location': driver.location.to_dict(),
-                    'riders': [r.to_dict() for r in assigned_riders[:driver.capacity]],
-                    'route': [loc.to_dict() for loc in route],
-                    'distance': round(driver.total_distance, 2),
-                    'cost': round(driver.total_distance * 2.5, 2)  # $2.5 per km
-                })
+        timer.start('metrics')
+        total_distance = sum(driver.total_distance for driver in self.drivers if driver.assigned_riders)
+        total_riders_matched = sum(len(driver.assigned_riders) for driver in self.drivers)
         
         # Calculate efficiency metrics
-        solo_distance = sum(
-            self.haversine_distance(r.pickup, r.dropoff)
-            for r in self.riders
-        )
+        solo_distance = float(self.cost_provider.pairwise_distance(
+            self.riders.pickup_coords(), self.riders.dropoff_coords()
+        ).sum())
         
         savings_percent = ((solo_distance - total_distance) / solo_distance * 100) if solo_distance > 0 else 0
+        timer.stop()
         
-        return {
+        result = {
             'success': True,
             'matches': matches,
+            'unmatched_riders': self.riders.ids[unmatched].tolist(),
             'metrics': {
                 'total_riders': len(self.riders),
                 'total_drivers': len(self.drivers),
@@ -364,11 +2502,22 @@ class RideSharingOptimizer:
                 'total_distance': round(total_distance, 2),
                 'solo_distance': round(solo_distance, 2),
                 'savings_percent': round(savings_percent, 2),
-                'total_cost': round(total_distance * 2.5, 2),
-                'cost_per_rider': round((total_distance * 2.5) / total_riders_matched, 2) if total_riders_matched > 0 else 0
+                'total_cost': round(total_distance * COST_PER_KM, 2),
+                'cost_per_rider': round((total_distance * COST_PER_KM) / total_riders_matched, 2) if total_riders_matched > 0 else 0,
+                'mode': mode,
+                'clustering_method': clustering if mode == 'cluster' else None,
+                'clustering_ms': round(clustering_ms, 1),
+                'deadline_ms': deadline_ms,
+                'deadline_overrun_ms': deadline_overrun_ms(start_time, deadline_ms),
+                'distance_cache': self._cache_metrics(results),
+                'timings': timer.to_dict(),
+                'solver': self._solver_metrics(results),
+                'elapsed_ms': round((time.perf_counter() - start_time) * 1000, 1)
             }
         }
-
+        if mode == 'shareability':
+            result['metrics']['shareability'] = shareability
+        return result
 
 # Example usage
 if __name__ == "__main__":
@@ -0,0 +1,158 @@
+"""
+Result cache for repeated optimization requests
+Keys each request on a hash of its canonical JSON (riders, drivers and
+solver settings), so retried and polled batches are answered from memory
+instead of re-running clustering and every route search, and identical
+requests arriving together share one run
+"""
+
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+RESULT_CACHE_MAX_ENTRIES = 256  # results kept at once
+RESULT_CACHE_MAX_RIDERS = 200_000  # riders over all kept results, a bound on their memory
+RESULT_CACHE_TTL_S = 300  # how long a result is served again
+
+
+def cache_key(riders: List[Dict], drivers: List[Dict], options: Dict) -> str:
+    """
+    SHA-256 of the request as canonical JSON: object keys sorted and no
+    whitespace, so payloads that differ only in formatting share a key.
+    List order is kept, since clustering may depend on it.
+    """
+    canonical = json.dumps({'riders': riders, 'drivers': drivers, 'options': options},
+                           sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+class ResultCache:
+    """
+    Thread-safe, bounded LRU cache of optimize() results with a TTL.
+    
+    At most max_entries results are kept, holding at most max_riders riders
+    between them; the least recently used are evicted first, and results
+    older than ttl_s are never served. Results are shared with every caller
+    that gets them, so they must not be modified.
+    """
+    
+    def __init__(self, max_entries: int = RESULT_CACHE_MAX_ENTRIES,
+                 max_riders: int = RESULT_CACHE_MAX_RIDERS, ttl_s: float = RESULT_CACHE_TTL_S):
+        self.max_entries = max_entries
+        self.max_riders = max_riders
+        self.ttl_s = ttl_s
+        self.entries = OrderedDict()  # key -> (stored at, riders, result)
+        self.riders = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+    
+    def __len__(self):
+        return len(self.entries)
+    
+    def get(self, key: str) -> Tuple[Optional[Dict], float]:
+        """The cached result for key and its age in seconds, or (None, 0)"""
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] > self.ttl_s:
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None, 0.0
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[2], time.monotonic() - entry[0]
+    
+    def put(self, key: str, result: Dict, n_riders: int):
+        """Keep a result for key, evicting the least recently used to stay in bounds"""
+        if n_riders > self.max_riders or self.max_entries <= 0:
+            return
+        with self._lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (time.monotonic(), n_riders, result)
+            self.riders += n_riders
+            while len(self.entries) > self.max_entries or self.riders > self.max_riders:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+    
+    def _remove(self, key: str):
+        _, n_riders, _ = self.entries.pop(key)
+        self.riders -= n_riders
+    
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+            self.riders = 0
+            self.hits = self.misses = self.evictions = 0
+    
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'size': len(self.entries),
+                'riders': self.riders,
+                'max_entries': self.max_entries
+            }
+
+
+class _Flight:
+    """One call in progress and, once done is set, its value or error"""
+    __slots__ = ('done', 'value', 'error')
+    
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Runs at most one call per key at a time.
+    
+    A caller asking for a key whose call is still running waits for it and
+    shares its value (or its exception) instead of starting another, so a
+    burst of identical requests costs one solve. Nothing is kept once the
+    call returns; that is the result cache's job.
+    """
+    
+    def __init__(self):
+        self.flights = {}  # key -> _Flight in progress
+        self.shared = 0
+        self._lock = threading.Lock()
+    
+    def run(self, key: str, call: Callable[[], Any]) -> Tuple[Any, bool]:
+        """call's value, or that of the identical call already running, and whether it was shared"""
+        with self._lock:
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.flights[key] = _Flight()
+            else:
+                self.shared += 1
+        
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value, True
+        
+        try:
+            flight.value = call()
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self.flights[key]
+            flight.done.set()
+        return flight.value, False
@@ -0,0 +1,192 @@
+"""
+Response serialization for the ride-sharing optimizer
+Turns optimize() results into a compact shape, where matches point into
+shared rider and driver tables instead of repeating every location as a
+dict, optionally with polyline-encoded coordinates, and encodes responses
+with the standard library or orjson
+"""
+
+import importlib.util
+import json
+import time
+import numpy as np
+from typing import Dict, List, Optional, Tuple
+
+RESPONSE_FORMATS = ('full', 'compact')
+ENCODERS = ('json', 'orjson')
+POLYLINE_PRECISION = 5  # decimal places kept, ~1 m; the precision map clients decode by default
+POLYLINE_MAX_CHUNKS = 7  # 5-bit chunks in the largest zigzagged delta
+
+
+def _orjson():
+    """Import orjson, which the fast encoder needs but the optimizer does not"""
+    try:
+        import orjson
+    except ImportError:
+        raise ImportError("The orjson encoder needs orjson (pip install orjson)") from None
+    return orjson
+
+
+def has_orjson() -> bool:
+    """Whether the orjson encoder can be used in this environment"""
+    return importlib.util.find_spec('orjson') is not None
+
+
+def encode_polyline(coords, precision: int = POLYLINE_PRECISION) -> str:
+    """
+    (lat, lon) pairs in the Encoded Polyline Algorithm Format: deltas of
+    the rounded coordinates, zigzagged and written as 5-bit chunks
+    """
+    points = np.round(np.asarray(coords, dtype=np.float64).reshape(-1, 2) * 10 ** precision).astype(np.int64)
+    if len(points) == 0:
+        return ''
+    deltas = np.diff(points, axis=0, prepend=0).ravel()
+    values = (deltas << 1) ^ (deltas >> 63)
+    
+    chunks = (values[:, None] >> (5 * np.arange(POLYLINE_MAX_CHUNKS))) & 0x1f
+    lengths = 1 + (values[:, None] >= 32 ** np.arange(1, POLYLINE_MAX_CHUNKS)).sum(axis=1)
+    used = np.arange(POLYLINE_MAX_CHUNKS) < lengths[:, None]
+    more = np.arange(POLYLINE_MAX_CHUNKS) < lengths[:, None] - 1  # every chunk but the last flags another
+    return ((chunks | (more * 0x20)) + 63)[used].astype(np.uint8).tobytes().decode('ascii')
+
+
+def decode_polyline(text: str, precision: int = POLYLINE_PRECISION) -> List[Tuple[float, float]]:
+    """The (lat, lon) pairs of an encoded polyline"""
+    values, value, shift = [], 0, 0
+    for byte in text.encode('ascii'):
+        chunk = byte - 63
+        value |= (chunk & 0x1f) << shift
+        shift += 5
+        if chunk < 0x20:
+            values.append(~(value >> 1) if value & 1 else value >> 1)
+            value, shift = 0, 0
+    points = np.cumsum(np.array(values, dtype=np.int64).reshape(-1, 2), axis=0) / 10 ** precision
+    return [tuple(point) for point in points.tolist()]
+
+
+def _coordinates(coords: List[Tuple[float, float]], polyline: bool):
+    return encode_polyline(coords) if polyline else [list(point) for point in coords]
+
+
+def compact_result(result: Dict, polyline: bool = False, optimizer=None) -> Dict:
+    """
+    An optimize() result with every location listed once.
+    
+    'riders' and 'drivers' are tables of the matched riders and drivers
+    (ids and coordinates, column by column), and each match names its
+    driver and stops by row in those tables. A rider's first stop is its
+    pickup and the second its dropoff; eta_min holds the minutes after
+    dispatch to every stop. With polyline, the coordinate columns are
+    encoded polylines instead of [lat, lon] lists. unmatched_riders and
+    metrics are as in the full result; per-match solver details are left
+    out (metrics.solver sums them up).
+    
+    optimizer, the one that produced result, lets the tables be sliced
+    from its rider table and its drivers' routes; without it (a cached or
+    background job result) they are read back from the full matches.
+    """
+    if optimizer is not None:
+        riders, drivers, matches = _tables_from_optimizer(result, optimizer)
+    else:
+        riders, drivers, matches = _tables_from_matches(result)
+    
+    compact = {
+        'success': result['success'],
+        'format': 'compact',
+        'riders': {
+            'id': riders[0],
+            'pickup': _coordinates(riders[1], polyline),
+            'dropoff': _coordinates(riders[2], polyline)
+        },
+        'drivers': {'id': drivers[0], 'location': _coordinates(drivers[1], polyline)},
+        'matches': matches,
+        'unmatched_riders': result.get('unmatched_riders', [])
+    }
+    for key in ('message', 'metrics'):
+        if key in result:
+            compact[key] = result[key]
+    return compact
+
+
+def _compact_match(driver: int, stops: List[int], eta_min: List[Optional[float]], match: Dict) -> Dict:
+    return {'driver': driver, 'stops': stops, 'eta_min': eta_min, 'distance': match['distance'], 'cost': match['cost']}
+
+
+def _tables_from_optimizer(result: Dict, optimizer) -> Tuple:
+    """Compact tables from the optimizer's RiderStore columns and its drivers' route orders"""
+    drivers_by_id = {driver.id: driver for driver in optimizer.drivers}
+    data = optimizer.riders.data
+    by_id = np.argsort(data['id'], kind='stable')
+    
+    driver_ids, locations, routes, matches = [], [], [], []
+    assigned = []
+    for match in result.get('matches', []):
+        driver = drivers_by_id[match['driver_id']]
+        driver_ids.append(driver.id)
+        locations.append((driver.location.lat, driver.location.lon))
+        routes.append([(stop.person_id, stop.type) for stop in driver.route[1:]])
+        assigned += driver.assigned_riders
+    
+    # Matched riders in match order as rows of the rider table
+    rider_ids = np.array(assigned, dtype=np.int64)
+    rows = by_id[np.searchsorted(data['id'], rider_ids, sorter=by_id)]
+    table_rows = {rider_id: row for row, rider_id in enumerate(rider_ids.tolist())}
+    
+    for position, (match, route) in enumerate(zip(result.get('matches', []), routes)):
+        etas = {eta['rider_id']: eta for eta in match['etas']}
+        stops = [table_rows[person] for person, _ in route]
+        eta_min = [etas.get(person, {}).get(f'{kind}_eta_min') for person, kind in route]
+        matches.append(_compact_match(position, stops, eta_min, match))
+    
+    pickups = np.column_stack([data['pickup_lat'][rows], data['pickup_lon'][rows]]).tolist()
+    dropoffs = np.column_stack([data['dropoff_lat'][rows], data['dropoff_lon'][rows]]).tolist()
+    return (rider_ids.tolist(), pickups, dropoffs), (driver_ids, locations), matches
+
+
+def _tables_from_matches(result: Dict) -> Tuple:
+    """Compact tables read back from the rider and route dicts of the full matches"""
+    rider_ids, pickups, dropoffs = [], [], []
+    driver_ids, locations = [], []
+    rider_rows, matches = {}, []
+    
+    for match in result.get('matches', []):
+        for rider in match['riders']:
+            rider_rows[rider['id']] = len(rider_ids)
+            rider_ids.append(rider['id'])
+            pickups.append((rider['pickup']['lat'], rider['pickup']['lon']))
+            dropoffs.append((rider['dropoff']['lat'], rider['dropoff']['lon']))
+        driver_ids.append(match['driver_id'])
+        locations.append((match['driver_location']['lat'], match['driver_location']['lon']))
+        
+        etas = {eta['rider_id']: eta for eta in match['etas']}
+        stops = [stop for stop in match['route'] if stop['type'] in ('pickup', 'dropoff')]
+        matches.append(_compact_match(
+            len(driver_ids) - 1, [rider_rows[stop['person_id']] for stop in stops],
+            [etas.get(stop['person_id'], {}).get(f"{stop['type']}_eta_min") for stop in stops], match
+        ))
+    
+    return (rider_ids, pickups, dropoffs), (driver_ids, locations), matches
+
+
+def encode_json(payload, encoder: str = 'json') -> bytes:
+    """payload as compact UTF-8 JSON, by the standard library or orjson"""
+    if encoder == 'orjson':
+        orjson = _orjson()
+        return orjson.dumps(payload, option=orjson.OPT_SERIALIZE_NUMPY)
+    if encoder != 'json':
+        raise ValueError(f"Unknown encoder {encoder!r}; use one of {ENCODERS}")
+    return json.dumps(payload, separators=(',', ':')).encode('utf-8')
+
+
+def serialize_result(result: Dict, response: str = 'full', polyline: bool = False,
+                     encoder: str = 'json', optimizer=None) -> Tuple[bytes, float]:
+    """
+    The encoded response body of a result and the milliseconds spent
+    shaping and encoding it; optimizer is passed on to compact_result
+    """
+    if response not in RESPONSE_FORMATS:
+        raise ValueError(f"Unknown response format {response!r}; use one of {RESPONSE_FORMATS}")
+    start = time.perf_counter()
+    payload = compact_result(result, polyline, optimizer) if response == 'compact' else result
+    body = encode_json(payload, encoder)
+    return body, (time.perf_counter() - start) * 1000
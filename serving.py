@@ -0,0 +1,105 @@
+"""
+Production serving support for the ride-sharing optimizer API
+Admission control that bounds the solves a worker process runs and queues
+at once, the request limits that go with it, and a warm-up that loads the
+solver stack before a preforking server starts its workers
+"""
+
+import threading
+from contextlib import contextmanager
+
+from threadpoolctl import threadpool_limits
+
+MAX_ACTIVE_SOLVES = 1  # solves running at once per worker process; they are CPU bound
+MAX_QUEUED_SOLVES = 4  # further solves waiting for a slot before requests get 429
+QUEUE_TIMEOUT_S = 30  # longest a queued solve waits for a slot
+RETRY_AFTER_S = 2  # Retry-After sent with 429 responses
+MAX_QUEUED_JOBS = 32  # background jobs waiting for a worker before submissions get 429
+MAX_REQUEST_MB = 100  # largest request body accepted, bulk uploads included
+
+
+class Overloaded(Exception):
+    """Raised when a solve is turned away because every slot and queue place is taken"""
+
+
+class SolveLimiter:
+    """
+    Admission control for the solves of one process.
+    
+    At most max_active solves run at once and at most max_queued more wait
+    for a slot, each for up to queue_timeout_s. Anything beyond that is
+    turned away at once with Overloaded, so a burst gets fast 429s instead
+    of piling up behind the solver until the server times requests out.
+    """
+    
+    def __init__(self, max_active: int = MAX_ACTIVE_SOLVES, max_queued: int = MAX_QUEUED_SOLVES,
+                 queue_timeout_s: float = QUEUE_TIMEOUT_S):
+        self.max_active = max_active
+        self.max_queued = max_queued
+        self.queue_timeout_s = queue_timeout_s
+        self.active = 0
+        self.queued = 0
+        self.rejected = 0
+        self._slots = threading.BoundedSemaphore(max_active)
+        self._lock = threading.Lock()
+    
+    @contextmanager
+    def slot(self, background: bool = False):
+        """
+        Hold one solve slot for the body of a with statement, waiting in the
+        queue if need be. Background solves (jobs, which their own queue
+        already bounds) wait for a slot as long as it takes, outside the
+        queue, and are never turned away.
+        """
+        if background:
+            self._slots.acquire()
+            with self._lock:
+                self.active += 1
+        else:
+            with self._lock:
+                if self.active + self.queued >= self.max_active + self.max_queued:
+                    self.rejected += 1
+                    raise Overloaded(f'{self.active} solves running and {self.queued} queued')
+                self.queued += 1
+            
+            acquired = self._slots.acquire(timeout=self.queue_timeout_s)
+            with self._lock:
+                self.queued -= 1
+                if acquired:
+                    self.active += 1
+                else:
+                    self.rejected += 1
+            if not acquired:
+                raise Overloaded(f'No solve slot within {self.queue_timeout_s} s')
+        
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.active -= 1
+            self._slots.release()
+    
+    def stats(self):
+        with self._lock:
+            return {'active': self.active, 'queued': self.queued, 'rejected': self.rejected}
+
+
+def warm_up():
+    """
+    Run one small optimization so the solver's lazily loaded code and
+    first-call setup are paid for now, e.g. in a server's master process
+    before it forks its workers. Native thread pools are held to one
+    thread meanwhile, since a forked child cannot use a pool its parent
+    started.
+    """
+    from optimizer import RideSharingOptimizer
+    
+    riders = [
+        {'id': 1, 'pickup': [40.7589, -73.9851], 'dropoff': [40.7614, -73.9776]},
+        {'id': 2, 'pickup': [40.7580, -73.9855], 'dropoff': [40.7620, -73.9700]},
+        {'id': 3, 'pickup': [40.7500, -73.9900], 'dropoff': [40.7650, -73.9750]},
+    ]
+    drivers = [{'id': 1, 'location': [40.7550, -73.9870], 'capacity': 4}]
+    with threadpool_limits(limits=1):
+        # exact_max_nodes=0 sends the route through OR-Tools, not only the exact solver
+        RideSharingOptimizer(workers=1, exact_max_nodes=0).optimize(riders, drivers, deadline_ms=200)
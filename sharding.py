@@ -0,0 +1,350 @@
+"""
+Geographic sharding for metro-wide batches
+Splits riders and drivers into square tiles, optimizes the tiles on their
+own (in parallel when workers allow), then gives riders left over at tile
+edges a second pass over a grid shifted by half a tile with overlapping
+drivers, so the work grows with the number of tiles rather than with the
+square of the city
+"""
+
+import math
+import os
+import time
+import numpy as np
+from scipy.spatial import cKDTree
+from typing import Callable, Dict, List, Optional, Tuple
+
+from optimizer import (RideSharingOptimizer, RiderStore, Driver, Location, COST_PER_KM, KM_PER_DEGREE,
+                       UNASSIGNED, deadline_overrun_ms, drivers_to_array, riders_to_array, run_solves,
+                       get_distance_cache)
+
+SHARD_TILE_KM = 5.0  # tile side
+SHARD_OVERLAP_KM = 1.0  # in the second pass, drivers this close to a tile also serve its riders
+RECONCILE_SHARE = 0.2  # share of the deadline kept for the shifted second pass
+RECONCILE_MAX_RIDERS = 1000  # fewer leftover riders are reconciled in one piece instead
+
+
+def tile_grid(lats: np.ndarray, lons: np.ndarray, origin: Tuple[float, float],
+              tile_km: float) -> Tuple[np.ndarray, np.ndarray]:
+    """Fractional (row, column) tile coordinates of points on a local km grid"""
+    rows = (lats - origin[0]) * KM_PER_DEGREE / tile_km
+    cols = (lons - origin[1]) * KM_PER_DEGREE * math.cos(math.radians(origin[0])) / tile_km
+    return rows, cols
+
+
+def lend_drivers(homes: List[Tuple[int, int]], driver_rc: np.ndarray, capacities: np.ndarray,
+                 demand: Dict[Tuple[int, int], int], centers: Dict[Tuple[int, int], np.ndarray],
+                 reach: float) -> List[Tuple[int, int]]:
+    """
+    Move spare drivers to tiles with more riders than seats.
+    
+    homes holds each driver's tile, driver_rc their fractional tile
+    coordinates, demand the riders and centers the mean pickup of every tile
+    with riders. Drivers a tile can spare (those farthest from its riders
+    first, all of them in tiles without riders) go to the tiles short the
+    most seats, nearest first, if within reach tiles of their riders.
+    Returns the new homes.
+    """
+    homes = list(homes)
+    members = {}
+    for row, home in enumerate(homes):
+        members.setdefault(home, []).append(row)
+    seats = {tile: int(capacities[rows].sum()) for tile, rows in members.items()}
+    
+    spare = []
+    for tile, rows in members.items():
+        surplus = seats[tile] - demand.get(tile, 0)
+        if tile in centers:
+            rows = sorted(rows, key=lambda row: -np.hypot(*(driver_rc[row] - centers[tile])))
+        for row in rows:
+            if capacities[row] <= surplus:
+                surplus -= capacities[row]
+                spare.append(row)
+    
+    short = sorted((tile for tile in demand if demand[tile] > seats.get(tile, 0)),
+                   key=lambda tile: seats.get(tile, 0) - demand[tile])
+    if not spare or not short:
+        return homes
+    
+    tree = cKDTree(driver_rc[spare])
+    lent = np.zeros(len(spare), dtype=bool)
+    for tile in short:
+        missing = demand[tile] - seats.get(tile, 0)
+        nearby = tree.query_ball_point(centers[tile], reach)
+        for i in sorted(nearby, key=lambda i: np.hypot(*(driver_rc[spare[i]] - centers[tile]))):
+            if missing <= 0:
+                break
+            if not lent[i]:
+                lent[i] = True
+                homes[spare[i]] = tile
+                missing -= capacities[spare[i]]
+    return homes
+
+
+def shard_rows(riders: np.ndarray, drivers: np.ndarray, tile_km: float, overlap_km: float = 0.0,
+               offset: float = 0.0, reach_km: Optional[float] = None) -> List[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    """
+    Split riders by the tile of their pickup and give every tile the drivers
+    inside it or within overlap_km of its edges. Returns (rider rows, driver
+    rows, which of those drivers belong to the tile) per tile that has
+    riders; a driver near a corner may be in up to four tiles. offset shifts
+    the grid by that fraction of a tile. With reach_km, tiles short of seats
+    borrow spare drivers within that distance of their riders (see
+    lend_drivers).
+    """
+    origin = (float(riders['pickup_lat'].min()), float(riders['pickup_lon'].min()))
+    rider_r, rider_c = tile_grid(riders['pickup_lat'], riders['pickup_lon'], origin, tile_km)
+    driver_r, driver_c = tile_grid(drivers['lat'], drivers['lon'], origin, tile_km)
+    driver_rc = np.column_stack([driver_r, driver_c]) + offset
+    margin = overlap_km / tile_km
+    
+    keys = np.floor(np.column_stack([rider_r, rider_c]) + offset).astype(np.int64)
+    tiles, labels = np.unique(keys, axis=0, return_inverse=True)
+    labels = labels.ravel()
+    order = np.argsort(labels, kind='stable')
+    bounds = np.searchsorted(labels[order], np.arange(len(tiles) + 1))
+    tiles = [tuple(tile) for tile in tiles.tolist()]
+    
+    homes = [(r, c) for r, c in np.floor(driver_rc).astype(np.int64).tolist()]
+    if reach_km is not None:
+        demand = {tile: int(bounds[i + 1] - bounds[i]) for i, tile in enumerate(tiles)}
+        centers = {
+            tile: np.array([rider_r[order[bounds[i]:bounds[i + 1]]].mean(),
+                            rider_c[order[bounds[i]:bounds[i + 1]]].mean()]) + offset
+            for i, tile in enumerate(tiles)
+        }
+        homes = lend_drivers(homes, driver_rc, drivers['capacity'], demand, centers, reach_km / tile_km)
+    
+    # Driver rows per tile, including the neighbours they overlap, and whether it is their own
+    tile_drivers = {}
+    for row, (r, c) in enumerate(driver_rc.tolist()):
+        tile_drivers.setdefault(homes[row], []).append((row, True))
+        if not margin:
+            continue
+        for tile_r in range(math.floor(r - margin), math.floor(r + margin) + 1):
+            for tile_c in range(math.floor(c - margin), math.floor(c + margin) + 1):
+                if (tile_r, tile_c) != homes[row]:
+                    tile_drivers.setdefault((tile_r, tile_c), []).append((row, False))
+    
+    shards = []
+    for i, tile in enumerate(tiles):
+        members = tile_drivers.get(tile, [])
+        shards.append((order[bounds[i]:bounds[i + 1]],
+                       np.array([row for row, _ in members], dtype=np.int64),
+                       np.array([home for _, home in members], dtype=bool)))
+    return shards
+
+
+def optimize_tile(riders: np.ndarray, drivers: np.ndarray, settings: Dict, options: Dict) -> Dict:
+    """Optimize one tile on a fresh single-process optimizer (runs in pool workers)"""
+    if len(drivers) == 0:
+        return {'success': False, 'matches': [], 'unmatched_riders': riders['id'].tolist()}
+    return RideSharingOptimizer(workers=1, **settings).optimize(riders, drivers, **options)
+
+
+class ShardedOptimizer(RideSharingOptimizer):
+    """
+    RideSharingOptimizer that can split a batch into geographic tiles.
+    
+    optimize() takes the usual arguments plus tile_km; without it the batch
+    is optimized as a whole. With it, every tile is first optimized
+    independently with the riders and drivers inside it, tiles in parallel
+    on the workers. Leftover riders and idle drivers then get one more pass
+    on a grid shifted by half a tile, so riders cut off at an edge now sit in
+    the middle of a tile, and drivers within overlap_km of a tile may serve
+    it too. A driver matched in more than one tile of that pass keeps the
+    match of the tile it stands in (or its fullest). Sharded runs are not
+    profiled.
+    """
+    
+    def optimize(self, riders, drivers, workers: Optional[int] = None,
+                 deadline_ms: Optional[float] = None, tile_km: Optional[float] = None,
+                 overlap_km: float = SHARD_OVERLAP_KM, progress: Optional[Callable[[str, float], None]] = None,
+                 **options) -> Dict:
+        if tile_km is None:
+            return super().optimize(riders, drivers, workers=workers, deadline_ms=deadline_ms,
+                                    progress=progress, **options)
+        
+        start_time = time.perf_counter()
+        workers = self.workers if workers is None else workers
+        rider_table = riders if isinstance(riders, np.ndarray) else riders_to_array(riders)
+        driver_table = drivers if isinstance(drivers, np.ndarray) else drivers_to_array(drivers)
+        if len(rider_table) == 0 or len(driver_table) == 0:
+            return super().optimize(rider_table, driver_table, workers=workers, **options)
+        
+        settings = {
+            'exact_max_nodes': self.exact_max_nodes,
+            'index_cell_km': self.driver_index.cell_km,
+            'cost_provider': self.cost_provider
+        }
+        # Drivers are lent between tiles only as far as a typical rider's wait allows
+        reach_km = float(self.cost_provider.reach_km(np.median(rider_table['max_wait_time'])))
+        rider_rows = np.arange(len(rider_table))
+        driver_rows = np.arange(len(driver_table))
+        matches, results, rounds = [], [], []
+        
+        for offset, margin_km, share in ((0.0, 0.0, 1 - RECONCILE_SHARE), (0.5, overlap_km, 1.0)):
+            if len(rider_rows) == 0 or len(driver_rows) == 0:
+                break
+            
+            if offset and len(rider_rows) <= RECONCILE_MAX_RIDERS:
+                tiles = [(rider_rows, driver_rows, np.ones(len(driver_rows), dtype=bool))]
+            else:
+                tiles = [
+                    (rider_rows[tile_riders], driver_rows[tile_drivers], home)
+                    for tile_riders, tile_drivers, home in shard_rows(
+                        rider_table[rider_rows], driver_table[driver_rows], tile_km, margin_km, offset,
+                        None if margin_km else reach_km
+                    )
+                ]
+            
+            # Tiles share this pass's part of what is left of the deadline, like route searches
+            tile_options = {name: value for name, value in options.items() if name != 'profile'}
+            if deadline_ms is not None:
+                remaining_ms = max(deadline_ms - (time.perf_counter() - start_time) * 1000, 0.0) * share
+                concurrency = min(len(tiles), 1 if workers == 1 else (workers or os.cpu_count() or 1))
+                tile_options['deadline_ms'] = remaining_ms * concurrency / len(tiles)
+            
+            if progress is not None:
+                progress('sharding', 0.0)
+            args = [
+                [rider_table[tile_riders] for tile_riders, _, _ in tiles],
+                [driver_table[tile_drivers] for _, tile_drivers, _ in tiles],
+                [settings] * len(tiles),
+                [tile_options] * len(tiles)
+            ]
+            tile_results = run_solves(
+                optimize_tile, args, self.process_pool(workers) if workers != 1 and len(tiles) > 1 else None,
+                None if progress is None else lambda _, fraction: progress('sharding', fraction)
+            )
+            
+            kept, conflicts = self._reconcile(tiles, tile_results, driver_table)
+            matches += kept
+            results += [result for result in tile_results if 'metrics' in result]
+            
+            matched_riders = {rider['id'] for match in kept for rider in match['riders']}
+            busy_drivers = {match['driver_id'] for match in kept}
+            rider_rows = rider_rows[~np.isin(rider_table['id'][rider_rows], list(matched_riders))]
+            driver_rows = driver_rows[~np.isin(driver_table['id'][driver_rows], list(busy_drivers))]
+            rounds.append({
+                'tiles': len(tiles),
+                'riders_matched': len(matched_riders),
+                'conflicts': conflicts,
+                'slowest_tile_ms': max((result['metrics']['elapsed_ms'] for result in tile_results
+                                        if 'metrics' in result), default=0.0)
+            })
+        
+        return self._merge(rider_table, driver_table, matches, results, rounds, start_time,
+                           deadline_ms, tile_km, overlap_km, options)
+    
+    def _reconcile(self, tiles: List[Tuple[np.ndarray, np.ndarray, np.ndarray]], tile_results: List[Dict],
+                   driver_table: np.ndarray) -> Tuple[List[Dict], int]:
+        """
+        Matches to keep from one pass, at most one per driver: the one in the
+        tile it stands in if it was matched there, otherwise its fullest.
+        Returns (matches, number of matches dropped).
+        """
+        candidates = {}
+        for tile_index, result in enumerate(tile_results):
+            for match in result['matches']:
+                candidates.setdefault(match['driver_id'], []).append((tile_index, match))
+        
+        home = {}
+        for tile_index, (_, tile_drivers, at_home) in enumerate(tiles):
+            for driver_id in driver_table['id'][tile_drivers[at_home]].tolist():
+                home[driver_id] = tile_index
+        
+        kept, conflicts = [], 0
+        for driver_id, offers in candidates.items():
+            at_home = [match for tile_index, match in offers if tile_index == home.get(driver_id)]
+            kept.append(at_home[0] if at_home else max(
+                (match for _, match in offers), key=lambda match: (len(match['riders']), -match['distance'])
+            ))
+            conflicts += len(offers) - 1
+        return kept, conflicts
+    
+    def _merge(self, rider_table: np.ndarray, driver_table: np.ndarray, matches: List[Dict],
+               results: List[Dict], rounds: List[Dict], start_time: float, deadline_ms: Optional[float],
+               tile_km: float, overlap_km: float, options: Dict) -> Dict:
+        """One optimize()-shaped result over every tile, with this optimizer's state updated to match"""
+        self.riders = RiderStore(rider_table.copy())
+        self.riders.data['assigned_driver'] = UNASSIGNED
+        self.driver_table = driver_table
+        self.drivers = [
+            Driver(int(d['id']), (float(d['lat']), float(d['lon'])), int(d['capacity']))
+            for d in driver_table
+        ]
+        self.index_drivers()
+        
+        rows_by_id = {rider_id: row for row, rider_id in enumerate(rider_table['id'].tolist())}
+        drivers_by_id = {driver.id: driver for driver in self.drivers}
+        for match in matches:
+            rider_ids = [rider['id'] for rider in match['riders']]
+            self.riders.assign(np.array([rows_by_id[i] for i in rider_ids], dtype=np.int64), match['driver_id'])
+            driver = drivers_by_id[match['driver_id']]
+            driver.assigned_riders = rider_ids
+            driver.route = [Location(stop['lat'], stop['lon'], stop['type'], stop['person_id'])
+                            for stop in match['route']]
+            driver.total_distance = match['distance']
+        
+        unmatched = self.riders.data['assigned_driver'] == UNASSIGNED
+        total_distance = sum(match['distance'] for match in matches)
+        riders_matched = len(rider_table) - int(unmatched.sum())
+        solo_distance = float(self.cost_provider.pairwise_distance(
+            self.riders.pickup_coords(), self.riders.dropoff_coords()
+        ).sum())
+        savings_percent = ((solo_distance - total_distance) / solo_distance * 100) if solo_distance > 0 else 0
+        
+        timings, statuses, hits, misses = {}, {}, 0, 0
+        for result in results:
+            metrics = result['metrics']
+            for stage, timing in metrics['timings'].items():
+                total = timings.setdefault(stage, {'wall_ms': 0.0, 'cpu_ms': 0.0})
+                total['wall_ms'] += timing['wall_ms']
+                total['cpu_ms'] += timing['cpu_ms']
+            for status, count in metrics['solver']['statuses'].items():
+                statuses[status] = statuses.get(status, 0) + count
+            hits += metrics['distance_cache']['hits']
+            misses += metrics['distance_cache']['misses']
+        
+        mode = options.get('mode', 'cluster')
+        cache = get_distance_cache()
+        return {
+            'success': True,
+            'matches': matches,
+            'unmatched_riders': rider_table['id'][unmatched].tolist(),
+            'metrics': {
+                'total_riders': len(rider_table),
+                'total_drivers': len(driver_table),
+                'riders_matched': riders_matched,
+                'total_distance': round(total_distance, 2),
+                'solo_distance': round(solo_distance, 2),
+                'savings_percent': round(savings_percent, 2),
+                'total_cost': round(total_distance * COST_PER_KM, 2),
+                'cost_per_rider': round((total_distance * COST_PER_KM) / riders_matched, 2) if riders_matched > 0 else 0,
+                'mode': mode,
+                'clustering_method': options.get('clustering', 'kmeans') if mode == 'cluster' else None,
+                'clustering_ms': round(sum(result['metrics']['clustering_ms'] for result in results), 1),
+                'deadline_ms': deadline_ms,
+                'deadline_overrun_ms': deadline_overrun_ms(start_time, deadline_ms),
+                'distance_cache': {
+                    'enabled': cache is not None,
+                    'hits': hits,
+                    'misses': misses,
+                    'hit_rate': round(hits / (hits + misses), 4) if hits + misses else 0.0,
+                    'size': len(cache) if cache is not None else 0
+                },
+                'timings': {stage: {k: round(v, 1) for k, v in t.items()} for stage, t in timings.items()},
+                'solver': {
+                    'solves': sum(result['metrics']['solver']['solves'] for result in results),
+                    'wall_ms': round(sum(result['metrics']['solver']['wall_ms'] for result in results), 1),
+                    'cpu_ms': round(sum(result['metrics']['solver']['cpu_ms'] for result in results), 1),
+                    'slowest_ms': max((result['metrics']['solver']['slowest_ms'] for result in results), default=0.0),
+                    'first_solution_only': sum(result['metrics']['solver']['first_solution_only'] for result in results),
+                    'warm_started': sum(result['metrics']['solver']['warm_started'] for result in results),
+                    'statuses': statuses
+                },
+                'sharding': {'tile_km': tile_km, 'overlap_km': overlap_km, 'passes': rounds},
+                'elapsed_ms': round((time.perf_counter() - start_time) * 1000, 1)
+            }
+        }
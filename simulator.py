@@ -0,0 +1,263 @@
+"""
+Fleet simulator for offline load testing of dispatch settings
+Replays or synthesizes a stream of ride requests, dispatches waiting riders
+to idle drivers with the optimizer every batch interval, moves drivers along
+the routes it returns and reports dispatch throughput and latency, fleet
+utilization and rider waits over the whole simulated period
+"""
+
+import argparse
+import heapq
+import json
+import time
+import numpy as np
+from typing import Dict, List
+
+from benchmark_suite import synthetic_city, DISTRIBUTIONS
+from optimizer import RideSharingOptimizer
+
+DEFAULT_BATCH_INTERVAL_S = 30
+DEFAULT_MAX_WAIT_MIN = 15
+PERCENTILES = (50, 90, 95, 99)
+
+# Event kinds; simultaneous events are handled in this order, so drivers
+# finishing and riders arriving at a dispatch's instant are part of it
+DRIVER_FREE, REQUEST, DISPATCH = range(3)
+
+
+def synthetic_demand(duration_s: float, riders_per_min: float, distribution: str = 'uniform',
+                     max_wait_time: float = DEFAULT_MAX_WAIT_MIN, seed: int = 0) -> List[Dict]:
+    """
+    Ride requests arriving as a Poisson process over duration_s, with
+    pickups and dropoffs placed like synthetic_city's riders. Each request
+    carries its request_time in seconds from the start.
+    """
+    rng = np.random.default_rng(seed)
+    times = np.sort(rng.uniform(0, duration_s, rng.poisson(riders_per_min * duration_s / 60)))
+    riders, _ = synthetic_city(len(times), distribution, n_drivers=1, seed=seed)
+    return [
+        {'id': int(r['id']),
+         'pickup': [float(r['pickup_lat']), float(r['pickup_lon'])],
+         'dropoff': [float(r['dropoff_lat']), float(r['dropoff_lon'])],
+         'max_wait_time': max_wait_time,
+         'request_time': round(float(t), 3)}
+        for r, t in zip(riders, times)
+    ]
+
+
+def synthetic_fleet(n_drivers: int, capacity: int = 4, seed: int = 0) -> List[Dict]:
+    """Drivers scattered over the same area as synthetic_city's"""
+    _, drivers = synthetic_city(1, n_drivers=n_drivers, capacity=capacity, seed=seed)
+    return [{'id': int(d['id']), 'location': [float(d['lat']), float(d['lon'])], 'capacity': int(d['capacity'])}
+            for d in drivers]
+
+
+def percentiles(values, points=PERCENTILES) -> Dict:
+    """Percentiles, mean and max of values, rounded; empty without values"""
+    if len(values) == 0:
+        return {}
+    values = np.asarray(values, dtype=np.float64)
+    summary = {f'p{p}': round(float(np.percentile(values, p)), 2) for p in points}
+    summary['mean'] = round(float(values.mean()), 2)
+    summary['max'] = round(float(values.max()), 2)
+    return summary
+
+
+class FleetSimulator:
+    """
+    Discrete-event simulation of a fleet dispatched in batches.
+    
+    Requests arrive at their request_time (seconds from the start) and wait
+    for the next dispatch. Every batch_interval_s the waiting riders are
+    optimized against the idle drivers; a driver drives its route at the
+    ETAs in the result and is idle again after its last dropoff, where that
+    rider got off. Riders still waiting past their max_wait_time give up.
+    
+    With apply_latency, routes start only once the optimizer has returned,
+    so a slow dispatch costs simulated time as it would on the road.
+    optimize_kwargs (mode, deadline_ms, clustering, ...) go to every
+    optimize() call, and optimizer can be any object with the same
+    optimize(), e.g. a ShardedOptimizer.
+    """
+    
+    def __init__(self, drivers: List[Dict], optimizer=None,
+                 batch_interval_s: float = DEFAULT_BATCH_INTERVAL_S, apply_latency: bool = True,
+                 **optimize_kwargs):
+        if batch_interval_s <= 0:
+            raise ValueError("batch_interval_s must be positive")
+        self.drivers = {d['id']: dict(d) for d in drivers}
+        self.optimizer = optimizer or RideSharingOptimizer(workers=1)
+        self.batch_interval_s = batch_interval_s
+        self.apply_latency = apply_latency
+        self.optimize_kwargs = optimize_kwargs
+    
+    def run(self, requests: List[Dict]) -> Dict:
+        """Simulate until every request is served or given up and report on the run"""
+        wall_start = time.perf_counter()
+        events = []  # (time, kind, sequence, payload)
+        sequence = 0
+        
+        def push(at, kind, payload=None):
+            nonlocal sequence
+            heapq.heappush(events, (at, kind, sequence, payload))
+            sequence += 1
+        
+        for request in requests:
+            push(float(request.get('request_time', 0)), REQUEST, request)
+        if requests:
+            push(self.batch_interval_s, DISPATCH)
+        
+        idle = set(self.drivers)
+        waiting = {}  # rider id -> request, in arrival order
+        arrivals_left = len(requests)
+        riders = {}  # rider id -> request, dispatch, pickup and dropoff times
+        busy_s = 0.0
+        onboard_s = 0.0
+        latencies_ms, batch_sizes, assigned = [], [], []
+        overruns = 0
+        now = 0.0
+        
+        while events:
+            now, kind, _, payload = heapq.heappop(events)
+            
+            if kind == DRIVER_FREE:
+                driver_id, location = payload
+                self.drivers[driver_id]['location'] = location
+                idle.add(driver_id)
+            
+            elif kind == REQUEST:
+                waiting[payload['id']] = payload
+                riders[payload['id']] = {'requested': now}
+                arrivals_left -= 1
+            
+            else:
+                # Riders out of time give up; the rest may wait as long as they have left
+                batch = []
+                for rider_id, request in list(waiting.items()):
+                    waited_min = (now - riders[rider_id]['requested']) / 60
+                    left_min = request.get('max_wait_time', DEFAULT_MAX_WAIT_MIN) - waited_min
+                    if left_min <= 0:
+                        riders[rider_id]['abandoned'] = now
+                        del waiting[rider_id]
+                    else:
+                        batch.append({'id': rider_id, 'pickup': request['pickup'],
+                                      'dropoff': request['dropoff'], 'max_wait_time': left_min})
+                
+                if batch and idle:
+                    drivers = [self.drivers[driver_id] for driver_id in sorted(idle)]
+                    start = time.perf_counter()
+                    result = self.optimizer.optimize(batch, drivers, **self.optimize_kwargs)
+                    latency_ms = (time.perf_counter() - start) * 1000
+                    latencies_ms.append(latency_ms)
+                    batch_sizes.append(len(batch))
+                    overruns += latency_ms > self.batch_interval_s * 1000
+                    departure = now + latency_ms / 1000 if self.apply_latency else now
+                    
+                    matched = 0
+                    for match in result.get('matches', []):
+                        etas = {eta['rider_id']: eta for eta in match['etas']}
+                        for rider_id, eta in etas.items():
+                            record = riders[rider_id]
+                            record['dispatched'] = departure
+                            record['picked_up'] = departure + eta['pickup_eta_min'] * 60
+                            record['dropped_off'] = departure + eta['dropoff_eta_min'] * 60
+                            onboard_s += record['dropped_off'] - record['picked_up']
+                            del waiting[rider_id]
+                        
+                        finish = max(riders[rider_id]['dropped_off'] for rider_id in etas)
+                        busy_s += finish - now
+                        last = match['route'][-1]
+                        idle.discard(match['driver_id'])
+                        push(finish, DRIVER_FREE, (match['driver_id'], [last['lat'], last['lon']]))
+                        matched += len(etas)
+                    assigned.append(matched)
+                
+                if waiting or arrivals_left:
+                    push(now + self.batch_interval_s, DISPATCH)
+        
+        served = [r for r in riders.values() if 'dropped_off' in r]
+        span_s = max([now] + [r['dropped_off'] for r in served])
+        optimizer_s = sum(latencies_ms) / 1000
+        
+        return {
+            'simulated_s': round(span_s, 1),
+            'wall_s': round(time.perf_counter() - wall_start, 3),
+            'settings': {'batch_interval_s': self.batch_interval_s, 'apply_latency': self.apply_latency,
+                         **self.optimize_kwargs},
+            'riders': {
+                'requested': len(riders),
+                'served': len(served),
+                'abandoned': sum('abandoned' in r for r in riders.values())
+            },
+            'dispatch': {
+                'batches': len(latencies_ms),
+                'decisions': sum(batch_sizes),
+                'assignments': sum(assigned),
+                'decisions_per_s': round(sum(batch_sizes) / optimizer_s, 1) if optimizer_s else None,
+                'batch_size': percentiles(batch_sizes),
+                'latency_ms': percentiles(latencies_ms),
+                'overruns': int(overruns)
+            },
+            'fleet': {
+                'drivers': len(self.drivers),
+                'utilization': round(busy_s / (span_s * len(self.drivers)), 4) if span_s and self.drivers else 0,
+                'riders_per_busy_vehicle': round(onboard_s / busy_s, 2) if busy_s else 0
+            },
+            'wait_min': percentiles([(r['picked_up'] - r['requested']) / 60 for r in served]),
+            'ride_min': percentiles([(r['dropped_off'] - r['picked_up']) / 60 for r in served])
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulate a dispatched fleet over a stream of ride requests")
+    parser.add_argument('--duration-min', type=float, default=60)
+    parser.add_argument('--rate', type=float, default=10, help="ride requests per minute")
+    parser.add_argument('--distribution', choices=DISTRIBUTIONS, default='uniform')
+    parser.add_argument('--replay', help="JSON list of requests with request_time (s) instead of synthetic demand")
+    parser.add_argument('--drivers', type=int, default=50)
+    parser.add_argument('--capacity', type=int, default=4)
+    parser.add_argument('--interval-s', type=float, nargs='+', default=[DEFAULT_BATCH_INTERVAL_S],
+                        help="batch intervals to compare, one run each")
+    parser.add_argument('--deadline-ms', type=float)
+    parser.add_argument('--mode', default='cluster')
+    parser.add_argument('--no-latency', action='store_true', help="start routes without waiting for the optimizer")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-o', '--output', help="write the reports to this JSON file")
+    args = parser.parse_args(argv)
+    
+    if args.replay:
+        with open(args.replay) as f:
+            requests = json.load(f)
+    else:
+        requests = synthetic_demand(args.duration_min * 60, args.rate, args.distribution, seed=args.seed)
+    
+    print("\n" + "=" * 60)
+    print(f"Fleet Simulation: {len(requests)} requests, {args.drivers} drivers")
+    print("=" * 60)
+    
+    reports = []
+    for interval in args.interval_s:
+        simulator = FleetSimulator(synthetic_fleet(args.drivers, args.capacity, args.seed),
+                                   batch_interval_s=interval, apply_latency=not args.no_latency,
+                                   deadline_ms=args.deadline_ms, mode=args.mode)
+        report = simulator.run(requests)
+        reports.append(report)
+        
+        dispatch, riders = report['dispatch'], report['riders']
+        print(f"\nEvery {interval:g} s: {riders['served']} served, {riders['abandoned']} gave up")
+        print(f"  {dispatch['batches']} batches, {dispatch['decisions_per_s']} decisions/s, "
+              f"latency {dispatch['latency_ms']}, {dispatch['overruns']} overruns")
+        print(f"  utilization {report['fleet']['utilization']:.1%}, "
+              f"{report['fleet']['riders_per_busy_vehicle']} riders per busy vehicle")
+        print(f"  wait {report['wait_min']} min")
+    
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(reports, f, indent=2)
+        print(f"\nReports written to {args.output}")
+    
+    print("\n" + "=" * 60 + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""
+Prometheus telemetry for the ride-sharing optimizer
+Adds up the timings, solver outcomes and match counts of finished
+optimizations and renders them, with point-in-time gauges, in the
+Prometheus text exposition format
+"""
+
+import threading
+from typing import Dict, Iterable, Optional, Tuple
+
+DURATION_BUCKETS_S = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+METRIC_PREFIX = 'ridesharing_'
+
+# name -> (type, help)
+COUNTERS = {
+    'optimizations_total': ('counter', 'Finished optimizations by mode'),
+    'optimization_failures_total': ('counter', 'Optimizations that raised an error'),
+    'stage_seconds_total': ('counter', 'Wall time spent in each optimization stage'),
+    'stage_cpu_seconds_total': ('counter', 'CPU time of the optimizing thread in each stage'),
+    'route_solves_total': ('counter', 'Route solves by search status'),
+    'route_solve_seconds_total': ('counter', 'Wall time of route solves'),
+    'route_solve_cpu_seconds_total': ('counter', 'CPU time of route solves, wherever they ran'),
+    'deadline_overruns_total': ('counter', 'Optimizations that finished after their deadline_ms'),
+    'deadline_overrun_seconds_total': ('counter', 'Time optimizations ran past their deadline_ms'),
+    'riders_total': ('counter', 'Riders submitted for optimization'),
+    'riders_matched_total': ('counter', 'Riders matched to a driver'),
+    'responses_total': ('counter', 'Optimization results sent, by response format and encoder'),
+    'response_bytes_total': ('counter', 'Encoded size of optimization results sent'),
+    'response_encode_seconds_total': ('counter', 'Time spent shaping and encoding optimization results'),
+    'requests_rejected_total': ('counter', 'Requests turned away, by reason: overloaded or too_large'),
+}
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def format_labels(labels: Labels) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in labels) + '}'
+
+
+class Telemetry:
+    """
+    Process-wide totals over optimize() results.
+    
+    observe takes the metrics dict of a result; everything is kept as
+    monotonic counters plus one duration histogram, as Prometheus expects.
+    Totals are per process, so a server with several worker processes
+    exports one series set per process.
+    """
+    
+    def __init__(self, buckets: Iterable[float] = DURATION_BUCKETS_S):
+        self.buckets = tuple(buckets)
+        self.counters = {name: {} for name in COUNTERS}
+        self.duration_counts = [0] * len(self.buckets)
+        self.duration_sum = 0.0
+        self.duration_count = 0
+        self._lock = threading.Lock()
+    
+    def _add(self, name: str, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        self.counters[name][key] = self.counters[name].get(key, 0) + value
+    
+    def observe(self, metrics: Dict):
+        """Count one finished optimization from its result['metrics']"""
+        seconds = metrics['elapsed_ms'] / 1000
+        with self._lock:
+            self._add('optimizations_total', 1, mode=metrics['mode'])
+            self._add('riders_total', metrics['total_riders'])
+            self._add('riders_matched_total', metrics['riders_matched'])
+            
+            for stage, timing in metrics.get('timings', {}).items():
+                self._add('stage_seconds_total', timing['wall_ms'] / 1000, stage=stage)
+                self._add('stage_cpu_seconds_total', timing['cpu_ms'] / 1000, stage=stage)
+            
+            solver = metrics.get('solver')
+            if solver is not None:
+                for status, count in solver['statuses'].items():
+                    self._add('route_solves_total', count, status=status)
+                self._add('route_solve_seconds_total', solver['wall_ms'] / 1000)
+                self._add('route_solve_cpu_seconds_total', solver['cpu_ms'] / 1000)
+            
+            if metrics.get('deadline_overrun_ms'):
+                self._add('deadline_overruns_total', 1)
+                self._add('deadline_overrun_seconds_total', metrics['deadline_overrun_ms'] / 1000)
+            
+            self.duration_sum += seconds
+            self.duration_count += 1
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    self.duration_counts[i] += 1
+    
+    def observe_response(self, response: str, encoder: str, size: int, seconds: float):
+        """Count one result sent to a client, its size and how long it took to encode"""
+        with self._lock:
+            self._add('responses_total', 1, format=response, encoder=encoder)
+            self._add('response_bytes_total', size, format=response)
+            self._add('response_encode_seconds_total', seconds, encoder=encoder)
+    
+    def observe_rejection(self, reason: str):
+        """Count one request answered with 429 or 413 without being optimized"""
+        with self._lock:
+            self._add('requests_rejected_total', 1, reason=reason)
+    
+    def observe_failure(self):
+        with self._lock:
+            self._add('optimization_failures_total', 1)
+    
+    def render(self, gauges: Optional[Dict[str, Tuple[str, Dict[Labels, float]]]] = None) -> str:
+        """
+        Every series in the Prometheus text format. gauges maps further metric
+        names to (help, {labels: value}) for values sampled at scrape time.
+        """
+        lines = []
+        with self._lock:
+            for name, (kind, description) in COUNTERS.items():
+                lines += [f'# HELP {METRIC_PREFIX}{name} {description}', f'# TYPE {METRIC_PREFIX}{name} {kind}']
+                series = self.counters[name] or {(): 0}
+                for labels, value in sorted(series.items()):
+                    lines.append(f'{METRIC_PREFIX}{name}{format_labels(labels)} {value}')
+            
+            name = METRIC_PREFIX + 'optimization_duration_seconds'
+            lines += [f'# HELP {name} Wall time of whole optimizations', f'# TYPE {name} histogram']
+            for bound, count in zip(self.buckets, self.duration_counts):
+                lines.append(f'{name}_bucket{{le="{bound:g}"}} {count}')
+            lines += [
+                f'{name}_bucket{{le="+Inf"}} {self.duration_count}',
+                f'{name}_sum {self.duration_sum}',
+                f'{name}_count {self.duration_count}'
+            ]
+        
+        for name, (description, series) in (gauges or {}).items():
+            lines += [f'# HELP {METRIC_PREFIX}{name} {description}', f'# TYPE {METRIC_PREFIX}{name} gauge']
+            for labels, value in sorted(series.items()):
+                lines.append(f'{METRIC_PREFIX}{name}{format_labels(labels)} {value}')
+        
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,146 @@
+"""
+Example usage and testing of the Streaming Dispatcher
+"""
+
+import numpy as np
+
+from dispatcher import StreamingDispatcher, cheapest_insertion
+from optimizer import Location, solve_route
+
+def test_cheapest_insertion():
+    """Insertion respects capacity and picks the cheapest positions"""
+    print("=" * 60)
+    print("Test 1: Cheapest Insertion")
+    print("=" * 60)
+    
+    start = Location(40.7500, -73.9900, 'driver', 1)
+    stops = [
+        Location(40.7520, -73.9880, 'pickup', 10),
+        Location(40.7600, -73.9800, 'dropoff', 10),
+    ]
+    pickup = Location(40.7530, -73.9870, 'pickup', 11)
+    dropoff = Location(40.7590, -73.9810, 'dropoff', 11)
+    
+    # Room for both: share the ride between the existing pickup and dropoff
+    i, j, added = cheapest_insertion(start, stops, 0, 2, pickup, dropoff)
+    assert (i, j) == (1, 1)
+    print(f"\nCapacity 2: pickup after {i} stops, dropoff after {j}, +{added:.3f} km")
+    
+    # One seat: the new rider has to ride before or after the existing one
+    i, j, added = cheapest_insertion(start, stops, 0, 1, pickup, dropoff)
+    assert (i, j) in ((0, 0), (2, 2))
+    print(f"Capacity 1: pickup after {i} stops, dropoff after {j}, +{added:.3f} km")
+    
+    # Full vehicle
+    assert cheapest_insertion(start, stops, 1, 1, pickup, dropoff) is None
+    
+    print("\n" + "=" * 60)
+
+def test_streaming_events():
+    """Riders, cancellations and driver updates only touch the affected routes"""
+    print("\nTest 2: Streaming Events")
+    print("=" * 60)
+    
+    dispatcher = StreamingDispatcher(pickup_radius_km=5.0)
+    dispatcher.load(
+        riders=[{'id': 1, 'pickup': [40.7200, -74.0000], 'dropoff': [40.7250, -73.9950]}],
+        drivers=[
+            {'id': 1, 'location': [40.7205, -73.9990], 'capacity': 2},
+            {'id': 2, 'location': [40.7805, -73.9695], 'capacity': 2},
+        ]
+    )
+    
+    # A rider uptown goes to the uptown driver without touching driver 1
+    event = dispatcher.add_rider({'id': 2, 'pickup': [40.7800, -73.9700], 'dropoff': [40.7850, -73.9650]})
+    assert event['driver_id'] == 2 and event['affected_drivers'] == [2]
+    print(f"\nRider 2 -> driver {event['driver_id']} in {event['elapsed_ms']} ms")
+    
+    # Another downtown rider shares driver 1's route
+    event = dispatcher.add_rider({'id': 3, 'pickup': [40.7210, -73.9990], 'dropoff': [40.7260, -73.9940]})
+    assert event['driver_id'] == 1
+    
+    # Nobody is within the pickup radius of this rider, so they wait
+    event = dispatcher.add_rider({'id': 4, 'pickup': [40.6400, -73.7800], 'dropoff': [40.6500, -73.7900]})
+    assert event['driver_id'] is None and dispatcher.pending == [4]
+    
+    # A driver coming online nearby picks up the waiting rider
+    event = dispatcher.add_driver({'id': 3, 'location': [40.6450, -73.7850], 'capacity': 2})
+    assert event['affected_drivers'] == [3] and dispatcher.pending == []
+    
+    # A cancellation only re-solves the cancelled rider's route
+    event = dispatcher.cancel_rider(3)
+    assert event['affected_drivers'] == [1]
+    assert dispatcher.drivers[1].assigned_riders == [1]
+    
+    event = dispatcher.add_rider({'id': 5, 'pickup': [40.7205, -73.9995], 'dropoff': [40.7255, -73.9945]})
+    assert event['driver_id'] == 1
+    
+    # Picking up and moving keeps onboard riders in the route
+    event = dispatcher.complete_stop(1)
+    assert event['stop_type'] == 'pickup'
+    onboard = event['rider_id']
+    dispatcher.update_driver(1, (40.7230, -73.9970))
+    route = dispatcher.drivers[1].route
+    assert [loc.person_id for loc in route if loc.type == 'pickup'] == [r for r in (1, 5) if r != onboard]
+    assert sum(1 for loc in route if loc.type == 'dropoff') == 2
+    
+    snapshot = dispatcher.snapshot()
+    assert snapshot['metrics']['riders_matched'] == 4
+    assert snapshot['metrics']['riders_pending'] == 0
+    
+    print(f"Routes: {[(m['driver_id'], [r['id'] for r in m['riders']]) for m in snapshot['matches']]}")
+    print(f"Total Distance: {snapshot['metrics']['total_distance']} km")
+    
+    print("\n" + "=" * 60)
+
+def test_rolling_horizon():
+    """Re-solves start from the current route and never move stops already visited"""
+    print("\nTest 3: Rolling Horizon Warm Starts")
+    print("=" * 60)
+    
+    rng = np.random.default_rng(4)
+    pickups = rng.uniform([40.72, -74.00], [40.78, -73.95], (12, 2))
+    dropoffs = pickups + rng.uniform(-0.02, 0.02, (12, 2))
+    
+    # A warm start from a good route keeps it, locked stops stay right after the start
+    coords = np.vstack([[40.75, -73.98], pickups[:6], dropoffs[:6]])
+    cold = solve_route(coords, 6, 200, exact_max_nodes=0)
+    warm = solve_route(coords, 6, 200, exact_max_nodes=0, initial_order=cold['order'])
+    assert warm['warm_started'] and not cold['warm_started']
+    assert warm['distance'] <= cold['distance'] + 1e-9
+    
+    locked = [0, 4, 2] + [node for node in cold['order'][1:] if node not in (4, 2)]
+    pinned = solve_route(coords, 6, 200, exact_max_nodes=0, initial_order=locked, locked_stops=2)
+    assert pinned['order'][:3] == [0, 4, 2]
+    
+    dispatcher = StreamingDispatcher(pickup_radius_km=20)
+    dispatcher.load([], [{'id': 1, 'location': [40.75, -73.98], 'capacity': 8}])
+    for i, (pickup, dropoff) in enumerate(zip(pickups, dropoffs)):
+        dispatcher.add_rider({'id': i + 1, 'pickup': pickup.tolist(), 'dropoff': dropoff.tolist()})
+    
+    picked = []
+    while len(dispatcher.onboard[1]) < 2:
+        picked.append(dispatcher.complete_stop(1))
+    onboard = set(dispatcher.onboard[1])
+    before = dispatcher.drivers[1].total_distance
+    
+    event = dispatcher.tick()
+    route = dispatcher.drivers[1].route
+    assert event['event'] == 'reoptimized' and event['distance_saved'] >= -1e-9
+    assert dispatcher.drivers[1].total_distance <= before + 1e-9
+    assert not [stop for stop in route if stop.type == 'pickup' and stop.person_id in onboard]
+    assert sorted(dispatcher.drivers[1].assigned_riders) == sorted(r for r in dispatcher.riders)
+    
+    print(f"Stops completed: {[(e['stop_type'], e['rider_id']) for e in picked]}")
+    print(f"Tick: {event['distance_saved']} km saved in {event['elapsed_ms']:.1f} ms")
+    
+    print("\n" + "=" * 60)
+
+if __name__ == "__main__":
+    print("\n🚗 Streaming Dispatcher - Test Suite\n")
+    
+    test_cheapest_insertion()
+    test_streaming_events()
+    test_rolling_horizon()
+    
+    print("\n✅ All tests completed!\n")
@@ -0,0 +1,141 @@
+"""
+Example usage and testing of bulk ingestion
+"""
+
+import io
+import json
+import os
+import tempfile
+import numpy as np
+
+from app import app
+from ingest import read_riders, read_drivers, write_matches, match_columns, main, MATCH_COLUMNS
+from optimizer import RideSharingOptimizer, RIDER_DTYPE, DRIVER_DTYPE, UNASSIGNED
+
+RIDERS_CSV = (
+    "id,pickup_lat,pickup_lon,dropoff_lat,dropoff_lon,max_wait_time\n"
+    "1,40.7589,-73.9851,40.7614,-73.9776,15\n"
+    "2,40.7580,-73.9855,40.7620,-73.9700,20\n"
+    "3,40.7500,-73.9900,40.7650,-73.9750,15\n"
+    "4,40.9500,-73.7000,40.9600,-73.6900,5\n"
+)
+
+DRIVERS_NDJSON = (
+    '{"id": 1, "location": [40.7550, -73.9870], "capacity": 4}\n'
+    '{"id": 2, "lat": 40.7490, "lon": -73.9920}\n'
+)
+
+def test_read_formats():
+    """CSV and NDJSON load into the optimizer's structured arrays"""
+    print("=" * 60)
+    print("Test 1: Reading Bulk Files")
+    print("=" * 60)
+    
+    riders = read_riders(io.BytesIO(RIDERS_CSV.encode()), 'csv')
+    drivers = read_drivers(io.BytesIO(DRIVERS_NDJSON.encode()), 'ndjson')
+    
+    assert riders.dtype == RIDER_DTYPE and drivers.dtype == DRIVER_DTYPE
+    assert riders['id'].tolist() == [1, 2, 3, 4]
+    assert riders['max_wait_time'].tolist() == [15, 20, 15, 5]
+    assert (riders['assigned_driver'] == UNASSIGNED).all()
+    assert drivers['capacity'].tolist() == [4, 4]  # missing capacity falls back to the default
+    assert np.allclose(drivers['lat'], [40.7550, 40.7490])
+    
+    # The same riders as NDJSON in the API's nested shape, without the optional column
+    ndjson = ''.join(
+        json.dumps({'id': int(r['id']), 'pickup': [r['pickup_lat'], r['pickup_lon']],
+                    'dropoff': [r['dropoff_lat'], r['dropoff_lon']]}) + '\n'
+        for r in riders
+    )
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'riders.ndjson')
+        with open(path, 'w') as f:
+            f.write(ndjson)
+        nested = read_riders(path)
+    assert np.allclose(nested['dropoff_lon'], riders['dropoff_lon'])
+    assert (nested['max_wait_time'] == 15).all()
+    
+    try:
+        read_riders(io.BytesIO(b"id,pickup_lat\n1,40.7\n"), 'csv')
+        assert False, "missing required columns should be rejected"
+    except ValueError as e:
+        print(f"\nRejected: {e}")
+    
+    print(f"Read {len(riders)} riders and {len(drivers)} drivers")
+    print("\n" + "=" * 60)
+
+def test_write_matches():
+    """Matches come out as one row per rider in every text format, and via the API"""
+    print("\nTest 2: Writing Matches")
+    print("=" * 60)
+    
+    riders = read_riders(io.BytesIO(RIDERS_CSV.encode()), 'csv')
+    drivers = read_drivers(io.BytesIO(DRIVERS_NDJSON.encode()), 'ndjson')
+    submitted = riders.copy()
+    result = RideSharingOptimizer().optimize(riders, drivers, pickup_radius_km=5)
+    
+    # The optimizer records assignments in its own copy, never in the caller's table
+    assert np.array_equal(riders, submitted) and (riders['assigned_driver'] == UNASSIGNED).all()
+    
+    table = match_columns(result)
+    assert sorted(table['rider_id'].tolist()) == [1, 2, 3, 4]
+    unmatched = table['driver_id'] == UNASSIGNED
+    assert table['rider_id'][unmatched].tolist() == result['unmatched_riders'] == [4]
+    assert np.isnan(table['route_cost'][unmatched]).all()
+    
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'matches.csv')
+        write_matches(result, path)
+        with open(path) as f:
+            lines = f.read().splitlines()
+        assert lines[0] == ','.join(MATCH_COLUMNS) and len(lines) == 5
+        
+        rider_path, driver_path = os.path.join(directory, 'riders.csv'), os.path.join(directory, 'drivers.ndjson')
+        with open(rider_path, 'w') as f:
+            f.write(RIDERS_CSV)
+        with open(driver_path, 'w') as f:
+            f.write(DRIVERS_NDJSON)
+        main([rider_path, driver_path, '-o', os.path.join(directory, 'cli.ndjson'), '--pickup-radius-km', '5'])
+        with open(os.path.join(directory, 'cli.ndjson')) as f:
+            rows = [json.loads(line) for line in f]
+        assert len(rows) == 4 and rows[-1]['driver_id'] == UNASSIGNED and rows[-1]['route_cost'] is None
+    
+    client = app.test_client()
+    response = client.post('/api/optimize/bulk', content_type='multipart/form-data', data={
+        'riders': (io.BytesIO(RIDERS_CSV.encode()), 'riders.csv'),
+        'drivers': (io.BytesIO(DRIVERS_NDJSON.encode()), 'drivers.ndjson'),
+        'pickup_radius_km': '5',
+        'output': 'csv'
+    })
+    assert response.status_code == 200 and response.mimetype == 'text/csv'
+    assert len(response.data.decode().splitlines()) == 5
+    
+    response = client.post('/api/optimize/bulk', content_type='multipart/form-data', data={
+        'riders': (io.BytesIO(RIDERS_CSV.encode()), 'riders.txt'),
+        'drivers': (io.BytesIO(DRIVERS_NDJSON.encode()), 'drivers.ndjson')
+    })
+    assert response.status_code == 400
+    
+    try:
+        import pyarrow
+    except ImportError:
+        print("\npyarrow not installed, skipping Parquet and Arrow round trips")
+    else:
+        for fmt in ('parquet', 'arrow'):
+            buffer = io.BytesIO()
+            write_matches(result, buffer, fmt)
+            table = (pyarrow.parquet.read_table(io.BytesIO(buffer.getvalue())) if fmt == 'parquet'
+                     else pyarrow.ipc.open_file(io.BytesIO(buffer.getvalue())).read_all())
+            assert table.column_names == list(MATCH_COLUMNS) and table.num_rows == 4
+    
+    print(f"\n{result['metrics']['riders_matched']} riders matched, "
+          f"{len(result['unmatched_riders'])} unmatched")
+    print("\n" + "=" * 60)
+
+if __name__ == "__main__":
+    print("\n🚗 Bulk Ingestion - Test Suite\n")
+    
+    test_read_formats()
+    test_write_matches()
+    
+    print("\n✅ All tests completed!\n")
@@ -0,0 +1,141 @@
+"""
+Example usage and testing of the asynchronous optimization jobs
+"""
+
+import time
+
+from app import app
+from jobs import JobManager
+from optimizer import RideSharingOptimizer
+from serving import Overloaded, SolveLimiter
+
+RIDERS = [
+    {'id': 1, 'pickup': [40.7589, -73.9851], 'dropoff': [40.7614, -73.9776]},
+    {'id': 2, 'pickup': [40.7580, -73.9855], 'dropoff': [40.7620, -73.9700]},
+    {'id': 3, 'pickup': [40.7500, -73.9900], 'dropoff': [40.7650, -73.9750]},
+]
+
+DRIVERS = [
+    {'id': 1, 'location': [40.7550, -73.9870], 'capacity': 4},
+    {'id': 2, 'location': [40.7490, -73.9920], 'capacity': 3},
+]
+
+def wait_for(job, timeout=30):
+    deadline = time.time() + timeout
+    while not job.finished and time.time() < deadline:
+        time.sleep(0.02)
+    return job
+
+def test_job_lifecycle():
+    """Jobs run on their own optimizers, report progress and can be cancelled"""
+    print("=" * 60)
+    print("Test 1: Job Lifecycle")
+    print("=" * 60)
+    
+    optimizers = []
+    
+    def factory():
+        optimizers.append(RideSharingOptimizer(exact_max_nodes=0))
+        return optimizers[-1]
+    
+    manager = JobManager(factory, workers=1)
+    
+    job = wait_for(manager.submit(RIDERS, DRIVERS, deadline_ms=500))
+    assert job.status == 'done' and job.stage == 'done' and job.progress == 1.0
+    assert job.result['metrics']['riders_matched'] == 3
+    print(f"\nFinished in {job.finished_at - job.started_at:.3f}s")
+    
+    # A long job keeps the single worker busy while the next one waits in the queue
+    many = [
+        {'id': i + 1, 'pickup': [40.70 + i * 0.002, -74.00], 'dropoff': [40.71 + i * 0.002, -73.99]}
+        for i in range(32)
+    ]
+    fleet = [{'id': i + 1, 'location': [40.70 + i * 0.008, -73.995], 'capacity': 4} for i in range(8)]
+    running = manager.submit(many, fleet)
+    queued = manager.submit(RIDERS, DRIVERS)
+    
+    while running.status != 'running':
+        time.sleep(0.01)
+    assert manager.cancel(queued.id).status == 'cancelled'
+    
+    manager.cancel(running.id)
+    assert wait_for(running, timeout=10).status == 'cancelled'
+    print(f"Cancelled while {running.stage} at {running.progress:.0%}")
+    
+    # Every job got a fresh optimizer; the cancelled queued one never started
+    assert len(optimizers) == 2 and optimizers[0] is not optimizers[1]
+    
+    # Failures are reported, not raised
+    failed = wait_for(manager.submit(RIDERS, DRIVERS, clustering='spectral'))
+    assert failed.status == 'failed' and 'spectral' in failed.error
+    manager.shutdown()
+    
+    # Jobs share the solve slots with requests: one waits, queued, while a request holds the only slot
+    limiter = SolveLimiter(max_active=1, max_queued=0)
+    manager = JobManager(factory, workers=1, solve_slot=lambda: limiter.slot(background=True))
+    with limiter.slot():
+        waiting = manager.submit(RIDERS, DRIVERS)
+        time.sleep(0.1)
+        assert waiting.status == 'queued' and waiting.started_at is None
+    assert wait_for(waiting).status == 'done'
+    
+    # ...and a request is turned away while a job holds it
+    blocker = manager.submit(many, fleet)
+    while blocker.status != 'running':
+        time.sleep(0.01)
+    try:
+        with limiter.slot():
+            raise AssertionError('request got a slot held by a job')
+    except Overloaded:
+        pass
+    manager.cancel(blocker.id)
+    assert wait_for(blocker, timeout=10).status == 'cancelled'
+    assert limiter.stats() == {'active': 0, 'queued': 0, 'rejected': 1}
+    
+    manager.shutdown()
+    print("\n" + "=" * 60)
+
+def test_job_endpoints():
+    """Submit, poll and fetch a job through the API"""
+    print("\nTest 2: Job Endpoints")
+    print("=" * 60)
+    
+    client = app.test_client()
+    response = client.post('/api/jobs', json={'riders': RIDERS, 'drivers': DRIVERS, 'deadline_ms': 500})
+    assert response.status_code == 202
+    job_id = response.get_json()['job_id']
+    
+    status = client.get(f'/api/jobs/{job_id}').get_json()
+    deadline = time.time() + 30
+    while status['status'] in ('queued', 'running') and time.time() < deadline:
+        time.sleep(0.02)
+        status = client.get(f'/api/jobs/{job_id}').get_json()
+    assert status['status'] == 'done'
+    
+    result = client.get(f'/api/jobs/{job_id}/result')
+    assert result.status_code == 200 and result.get_json()['metrics']['riders_matched'] == 3
+    
+    assert client.get('/api/jobs/missing').status_code == 404
+    
+    # Finished jobs are counted in the Prometheus metrics
+    exported = client.get('/api/metrics').data.decode()
+    assert 'ridesharing_optimizations_total{mode="cluster"}' in exported
+    assert 'ridesharing_jobs{status="done"}' in exported
+    assert client.post('/api/jobs', json={'riders': RIDERS}).status_code == 400
+    
+    # Unknown settings are the client's mistake, not a server error
+    for url in ('/api/jobs', '/api/optimize'):
+        for name, value in (('clustering', 'dbscan'), ('mode', 'greedy')):
+            response = client.post(url, json={'riders': RIDERS, 'drivers': DRIVERS, name: value})
+            assert response.status_code == 400 and value in response.get_json()['error']
+    
+    print(f"\nJob {job_id}: {status['status']}")
+    print("\n" + "=" * 60)
+
+if __name__ == "__main__":
+    print("\n🚗 Optimization Jobs - Test Suite\n")
+    
+    test_job_lifecycle()
+    test_job_endpoints()
+    
+    print("\n✅ All tests completed!\n")
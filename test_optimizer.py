@@ -2,7 +2,22 @@
 Example usage and testing of the Ride-Sharing Optimizer
 """
 
-from optimizer import RideSharingOptimizer
+import itertools
+import json
+import os
+import pickle
+import tempfile
+import threading
+
+import numpy as np
+from ortools.constraint_solver import pywrapcp
+
+import optimizer as optimizer_module
+
+from optimizer import (RideSharingOptimizer, Location, Rider, RiderStore, GridIndex, DistanceCache,
+                       MatrixCostProvider, build_pickup_delivery_model, configure_distance_cache,
+                       write_cost_matrix, haversine_matrix, haversine_pairwise, solve_pickup_delivery,
+                       solve_exact_dp, solve_route)
 
 def test_basic_optimization():
     """Test basic optimization with sample data"""
@@ -141,9 +156,723 @@ def test_optimal_clustering():
     print("\n" + "=" * 60)
     return result
 
+def test_vectorized_haversine():
+    """Vectorized distance engine matches the scalar Haversine formula"""
+    print("\nTest 5: Vectorized Haversine")
+    print("=" * 60)
+    
+    optimizer = RideSharingOptimizer()
+    
+    points = [
+        Location(40.7589, -73.9851, 'pickup'),
+        Location(40.7614, -73.9776, 'dropoff'),
+        Location(40.7500, -73.9900, 'pickup'),
+        Location(40.7205, -73.9990, 'driver'),
+    ]
+    coords = np.array([[p.lat, p.lon] for p in points])
+    
+    full = haversine_matrix(coords)
+    for i, a in enumerate(points):
+        for j, b in enumerate(points):
+            assert abs(full[i, j] - optimizer.haversine_distance(a, b)) < 1e-9
+    
+    rect = haversine_matrix(coords[:1], coords[1:], dtype=np.float32)
+    assert rect.shape == (1, 3) and rect.dtype == np.float32
+    
+    meters = haversine_matrix(coords, meters=True)
+    assert meters.dtype == np.int64
+    assert meters[0, 1] == int(optimizer.haversine_distance(points[0], points[1]) * 1000)
+    
+    pairwise = haversine_pairwise(coords[:2], coords[2:])
+    assert np.allclose(pairwise, [full[0, 2], full[1, 3]])
+    
+    print(f"\nMax matrix error: {np.abs(full - optimizer.calculate_distance_matrix(points)).max():.2e}")
+    
+    print("\n" + "=" * 60)
+
+def test_parallel_matches_sequential():
+    """Process-pool route solving returns the same matches as sequential solving"""
+    print("\nTest 6: Parallel Route Solving")
+    print("=" * 60)
+    
+    riders = [
+        {'id': 1, 'pickup': [40.7200, -74.0000], 'dropoff': [40.7250, -73.9950]},
+        {'id': 2, 'pickup': [40.7210, -73.9990], 'dropoff': [40.7260, -73.9940]},
+        {'id': 3, 'pickup': [40.7205, -73.9995], 'dropoff': [40.7255, -73.9945]},
+        {'id': 4, 'pickup': [40.7800, -73.9700], 'dropoff': [40.7850, -73.9650]},
+        {'id': 5, 'pickup': [40.7810, -73.9690], 'dropoff': [40.7860, -73.9640]},
+        {'id': 6, 'pickup': [40.7805, -73.9695], 'dropoff': [40.7855, -73.9645]},
+    ]
+    
+    drivers = [
+        {'id': 1, 'location': [40.7205, -73.9990], 'capacity': 3},
+        {'id': 2, 'location': [40.7805, -73.9695], 'capacity': 3},
+    ]
+    
+    sequential = RideSharingOptimizer(exact_max_nodes=0).optimize(riders, drivers)
+    with RideSharingOptimizer(workers=2, exact_max_nodes=0) as optimizer:
+        parallel = optimizer.optimize(riders, drivers)
+        pool = optimizer.process_pool(2)
+        again = optimizer.optimize(riders, drivers)
+        assert optimizer.process_pool(2) is pool  # one pool serves every call
+    assert optimizer._pool is None
+    
+    assert [m['driver_id'] for m in parallel['matches']] == [m['driver_id'] for m in sequential['matches']]
+    assert [m['route'] for m in parallel['matches']] == [m['route'] for m in sequential['matches']]
+    assert [m['route'] for m in again['matches']] == [m['route'] for m in sequential['matches']]
+    for key in ('riders_matched', 'total_distance', 'solo_distance', 'savings_percent'):
+        assert parallel['metrics'][key] == sequential['metrics'][key]
+    
+    print(f"\nMatches: {len(parallel['matches'])}")
+    print(f"Total Distance: {parallel['metrics']['total_distance']:.2f} km")
+    
+    print("\n" + "=" * 60)
+
+def test_deadline_budget():
+    """A global deadline is split across route searches and reported per match"""
+    print("\nTest 7: Deadline Budget")
+    print("=" * 60)
+    
+    optimizer = RideSharingOptimizer(exact_max_nodes=5)
+    
+    riders = [
+        {'id': i+1, 
+         'pickup': [40.70 + i*0.005, -74.00 + i*0.003], 
+         'dropoff': [40.71 + i*0.005, -73.99 + i*0.003]}
+        for i in range(12)
+    ]
+    
+    drivers = [
+        {'id': 1, 'location': [40.705, -73.995], 'capacity': 4},
+        {'id': 2, 'location': [40.725, -73.985], 'capacity': 4},
+        {'id': 3, 'location': [40.745, -73.975], 'capacity': 2},
+    ]
+    
+    result = optimizer.optimize(riders, drivers, deadline_ms=1500)
+    
+    assert result['metrics']['deadline_ms'] == 1500
+    assert result['metrics']['elapsed_ms'] < 3000
+    for match in result['matches']:
+        solver = match['solver']
+        assert solver['method'] == ('exact' if len(match['riders']) <= 2 else 'ortools')
+        if solver['method'] == 'ortools':
+            assert 0 < solver['budget_ms'] <= 1500
+        print(f"\n  Driver {match['driver_id']}: {solver}")
+    assert result['metrics']['deadline_overrun_ms'] == max(result['metrics']['elapsed_ms'] - 1500, 0)
+    
+    # Budgets below the floor, and searches past the deadline, only build a first solution
+    hurried = RideSharingOptimizer(exact_max_nodes=0).optimize(riders, drivers, deadline_ms=1)
+    assert hurried['metrics']['solver']['first_solution_only'] == hurried['metrics']['solver']['solves'] == 3
+    assert all(match['solver']['first_solution_only'] for match in hurried['matches'])
+    assert hurried['metrics']['deadline_overrun_ms'] < 500
+    assert RideSharingOptimizer().optimize(riders, drivers)['metrics']['deadline_overrun_ms'] is None
+    
+    print(f"\nElapsed: {result['metrics']['elapsed_ms']} ms, "
+          f"{hurried['metrics']['deadline_overrun_ms']} ms over a 1 ms deadline")
+    
+    print("\n" + "=" * 60)
+
+def test_exact_dp_routes():
+    """The exact DP is feasible and never worse than the OR-Tools search"""
+    print("\nTest 8: Exact DP Routes")
+    print("=" * 60)
+    
+    coords = np.array([
+        [40.7550, -73.9870],  # driver
+        [40.7589, -73.9851], [40.7500, -73.9900], [40.7520, -73.9880], [40.7580, -73.9855],  # pickups
+        [40.7614, -73.9776], [40.7650, -73.9750], [40.7600, -73.9720], [40.7620, -73.9700],  # dropoffs
+    ])
+    n_riders = 4
+    
+    for capacity in (1, 2, 4):
+        order, distance = solve_exact_dp(coords, capacity)
+        _, search_distance = solve_pickup_delivery(coords, capacity, time_limit_ms=1000)
+        
+        # Every stop visited once, pickups before dropoffs, load within capacity
+        assert order[0] == 0 and sorted(order) == list(range(len(coords)))
+        load = 0
+        for node in order[1:]:
+            load += 1 if node <= n_riders else -1
+            assert 0 <= load <= capacity
+            if node > n_riders:
+                assert order.index(node - n_riders) < order.index(node)
+        
+        assert distance <= search_distance + 1e-2
+        print(f"\nCapacity {capacity}: order {order}, {distance:.3f} km (OR-Tools {search_distance:.3f} km)")
+    
+    assert solve_exact_dp(coords, 0) is None
+    
+    # With time windows the DP returns the shortest order that keeps to them
+    km = haversine_matrix(coords)
+    minutes = km * 60 / optimizer_module.AVERAGE_SPEED_KMH
+    wait, ride = optimizer_module.rider_time_limits(minutes, 1, [2, 5, 5, 2], 1.2)
+    feasible = [
+        [0] + list(stops) for stops in itertools.permutations(range(1, len(coords)))
+        if all(stops.index(r) < stops.index(r + n_riders) for r in range(1, n_riders + 1))
+        and optimizer_module.within_time_limits([0] + list(stops), minutes, 1, wait, ride)
+    ]
+    shortest = min(sum(km[a, b] for a, b in zip(order, order[1:] + [0])) for order in feasible)
+    order, distance = solve_exact_dp(coords, 4, distances=km, minutes=minutes, wait_limits=wait, ride_limits=ride)
+    assert optimizer_module.within_time_limits(order, minutes, 1, wait, ride)
+    assert abs(distance - shortest) < 1e-9 and distance > solve_exact_dp(coords, 4)[1]
+    assert solve_exact_dp(coords, 4, minutes=minutes, wait_limits=np.zeros(n_riders)) is None
+    
+    print("\n" + "=" * 60)
+
+def test_capacity_balanced_assignment():
+    """Clusters never exceed their driver's capacity and leftovers are reported"""
+    print("\nTest 9: Capacity-Balanced Assignment")
+    print("=" * 60)
+    
+    optimizer = RideSharingOptimizer()
+    
+    # Seven riders around one hotspot, only five seats in total
+    riders = [
+        {'id': i+1, 
+         'pickup': [40.7500 + i*0.001, -73.9900 + i*0.001], 
+         'dropoff': [40.7600 + i*0.001, -73.9800 + i*0.001]}
+        for i in range(6)
+    ] + [{'id': 7, 'pickup': [40.7800, -73.9600], 'dropoff': [40.7850, -73.9650]}]
+    
+    drivers = [
+        {'id': 1, 'location': [40.7790, -73.9610], 'capacity': 3},
+        {'id': 2, 'location': [40.7500, -73.9900], 'capacity': 2},
+    ]
+    
+    result = optimizer.optimize(riders, drivers)
+    
+    capacities = {d['id']: d['capacity'] for d in drivers}
+    matched = [r['id'] for m in result['matches'] for r in m['riders']]
+    for match in result['matches']:
+        assert len(match['riders']) <= capacities[match['driver_id']]
+    
+    assert len(matched) == 5
+    assert sorted(matched + result['unmatched_riders']) == list(range(1, 8))
+    assert result['metrics']['riders_matched'] == 5
+    
+    # Batches too large for the Hungarian method are matched on a sparse graph, just as well
+    exact_cells = optimizer_module.EXACT_ASSIGNMENT_MAX_CELLS
+    optimizer_module.EXACT_ASSIGNMENT_MAX_CELLS = 0
+    try:
+        sparse = RideSharingOptimizer().optimize(riders, drivers)
+    finally:
+        optimizer_module.EXACT_ASSIGNMENT_MAX_CELLS = exact_cells
+    assert sorted(sparse['unmatched_riders']) == sorted(result['unmatched_riders'])
+    assert {m['driver_id']: len(m['riders']) for m in sparse['matches']} == \
+        {m['driver_id']: len(m['riders']) for m in result['matches']}
+    
+    print(f"\nMatched: {sorted(matched)}")
+    print(f"Unmatched: {result['unmatched_riders']}")
+    
+    print("\n" + "=" * 60)
+
+def test_driver_spatial_index():
+    """Grid index queries agree with brute force and follow driver moves"""
+    print("\nTest 10: Driver Spatial Index")
+    print("=" * 60)
+    
+    rng = np.random.default_rng(7)
+    coords = np.column_stack([rng.uniform(40.60, 40.90, 500), rng.uniform(-74.10, -73.80, 500)])
+    
+    index = GridIndex(cell_km=0.5)
+    for i, (lat, lon) in enumerate(coords):
+        index.insert(i, lat, lon)
+    
+    center = (40.75, -73.95)
+    distances = haversine_matrix([center], coords)[0]
+    
+    within = index.query_radius(*center, 3.0)
+    assert sorted(i for i, _ in within) == sorted(np.flatnonzero(distances <= 3.0).tolist())
+    
+    nearest = index.nearest(*center, k=5)
+    assert [i for i, _ in nearest] == np.argsort(distances)[:5].tolist()
+    
+    # Moving and removing drivers is reflected in later queries
+    index.move(nearest[0][0], 40.95, -73.70)
+    index.remove(nearest[1][0])
+    assert [i for i, _ in index.nearest(*center, k=3)] == np.argsort(distances)[2:5].tolist()
+    assert len(index) == 499
+    
+    # Only drivers within the pickup radius can be matched
+    riders = [{'id': 1, 'pickup': [40.7500, -73.9900], 'dropoff': [40.7600, -73.9800]}]
+    drivers = [
+        {'id': 1, 'location': [40.8500, -73.9000], 'capacity': 4},
+        {'id': 2, 'location': [40.7520, -73.9880], 'capacity': 4},
+    ]
+    optimizer = RideSharingOptimizer()
+    result = optimizer.optimize(riders, drivers, pickup_radius_km=2.0)
+    assert [m['driver_id'] for m in result['matches']] == [2]
+    assert optimizer.nearest_drivers(40.7500, -73.9900, k=1)[0][0] == 2
+    
+    result = optimizer.optimize(riders, drivers[:1], pickup_radius_km=2.0)
+    assert result['matches'] == [] and result['unmatched_riders'] == [1]
+    
+    # The index is kept across calls and only drivers that changed are touched
+    driver_index = optimizer.driver_index
+    assert len(driver_index) == 1 and 2 not in driver_index
+    optimizer.update_driver_location(1, 40.7510, -73.9890)
+    result = optimizer.optimize(riders, [{**drivers[0], 'location': [40.7510, -73.9890]}], pickup_radius_km=2.0)
+    assert optimizer.driver_index is driver_index and optimizer.index_drivers() == 0
+    assert [m['driver_id'] for m in result['matches']] == [1]
+    
+    print(f"\nDrivers within 3 km: {len(within)}")
+    print(f"Nearest 5: {[i for i, _ in nearest]}")
+    
+    print("\n" + "=" * 60)
+
+def test_clustering_backends():
+    """Every clustering backend partitions the riders and reports its timing"""
+    print("\nTest 11: Clustering Backends")
+    print("=" * 60)
+    
+    rng = np.random.default_rng(3)
+    riders = [
+        {'id': i+1,
+         'pickup': [float(40.70 + rng.random() * 0.1), float(-74.02 + rng.random() * 0.09)],
+         'dropoff': [float(40.70 + rng.random() * 0.1), float(-74.02 + rng.random() * 0.09)]}
+        for i in range(60)
+    ]
+    drivers = [
+        {'id': i+1, 'location': [40.70 + i * 0.01, -74.00 + i * 0.005], 'capacity': 4}
+        for i in range(8)
+    ]
+    
+    optimizer = RideSharingOptimizer()
+    for method in ('kmeans', 'minibatch', 'grid', 'warm'):
+        result = optimizer.optimize(riders, drivers, clustering=method)
+        
+        metrics = result['metrics']
+        assert metrics['clustering_method'] == method
+        assert metrics['clustering_ms'] >= 0
+        assert metrics['riders_matched'] + len(result['unmatched_riders']) == len(riders)
+        print(f"\n  {method:<10} {metrics['clustering_ms']:>7.1f} ms  savings {metrics['savings_percent']}%")
+    
+    # Warm starts reuse the previous centroids
+    previous = optimizer.cluster_centers.copy()
+    clusters = optimizer.cluster_riders(len(previous), 'warm')
+    assert sum(len(c) for c in clusters.values()) == len(riders)
+    assert np.allclose(optimizer.cluster_centers, previous, atol=1e-3)
+    
+    try:
+        optimizer.cluster_riders(4, 'spectral')
+        assert False, 'unknown clustering method accepted'
+    except ValueError:
+        pass
+    
+    print("\n" + "=" * 60)
+
+def test_columnar_rider_store():
+    """Riders live in a structured array and only returned riders become objects"""
+    print("\nTest 12: Columnar Rider Store")
+    print("=" * 60)
+    
+    riders = [
+        {'id': i+1,
+         'pickup': [40.70 + i*0.001, -74.00 + i*0.001],
+         'dropoff': [40.71 + i*0.001, -73.99 + i*0.001]}
+        for i in range(40)
+    ]
+    drivers = [{'id': 1, 'location': [40.7005, -73.9995], 'capacity': 4}]
+    
+    optimizer = RideSharingOptimizer()
+    result = optimizer.optimize(riders, drivers)
+    
+    store = optimizer.riders
+    assert isinstance(store, RiderStore) and len(store) == 40
+    assert np.allclose(store.pickup_coords()[3], riders[3]['pickup'])
+    
+    # Only the four matched riders were materialized, and their assignment is in the table
+    matched = [r['id'] for r in result['matches'][0]['riders']]
+    assert len(store._views) == 4
+    assert sorted(store.ids[store.data['assigned_driver'] == 1].tolist()) == sorted(matched)
+    assert len(result['unmatched_riders']) == 36
+    
+    # Views keep the object API and serialize like before
+    rider = store[0]
+    assert isinstance(rider, Rider) and rider.pickup.type == 'pickup'
+    assert not hasattr(rider, '__dict__') and not hasattr(rider.pickup, '__dict__')
+    json.dumps(result)
+    
+    print(f"\nTable: {store.data.nbytes} bytes for {len(store)} riders")
+    print(f"Views built: {len(store._views)}")
+    
+    print("\n" + "=" * 60)
+
+def test_distance_cache():
+    """Repeated route solves reuse cached distances, bounded by LRU eviction"""
+    print("\nTest 13: Distance Cache")
+    print("=" * 60)
+    
+    coords = np.array([[40.7550, -73.9870], [40.7589, -73.9851], [40.7614, -73.9776]])
+    cache = DistanceCache(max_entries=4, precision=5)
+    
+    km = cache.matrix(coords)
+    assert np.allclose(km, haversine_matrix(coords), atol=1e-3)
+    assert (cache.hits, cache.misses, len(cache)) == (0, 3, 3)
+    
+    # Sub-meter jitter lands on the same keys
+    cache.matrix(coords + 1e-7)
+    assert (cache.hits, cache.misses) == (3, 3)
+    
+    # A fourth point adds three pairs, evicting the two least recently used
+    cache.matrix(np.vstack([coords[:1], [[40.7700, -73.9700]]]))
+    cache.matrix(np.vstack([coords[1:], [[40.7700, -73.9700]]]))
+    assert len(cache) == 4
+    
+    # Each thread sees only its own lookups, whatever the others do meanwhile
+    before = cache.thread_counts()
+    worker = threading.Thread(target=cache.matrix, args=(coords,))
+    worker.start()
+    worker.join()
+    cache.matrix(coords[:2])
+    hits, misses = cache.thread_counts()
+    assert hits + misses - sum(before) == 1
+    
+    # Warm restarts load what the previous process saved
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'distances.npz')
+        cache.save(path)
+        restored = DistanceCache(precision=5, path=path)
+        assert restored.entries == cache.entries
+        assert len(DistanceCache(precision=4, path=path)) == 0
+    
+    # optimize() reports the lookups of its own route solves
+    riders = [
+        {'id': 1, 'pickup': [40.7589, -73.9851], 'dropoff': [40.7614, -73.9776]},
+        {'id': 2, 'pickup': [40.7580, -73.9855], 'dropoff': [40.7620, -73.9700]},
+    ]
+    drivers = [{'id': 1, 'location': [40.7550, -73.9870], 'capacity': 4}]
+    
+    configure_distance_cache()
+    try:
+        optimizer = RideSharingOptimizer()
+        cold = optimizer.optimize(riders, drivers)['metrics']['distance_cache']
+        warm = optimizer.optimize(riders, drivers)['metrics']['distance_cache']
+        assert cold['misses'] == 10 and cold['hits'] == 0
+        assert warm['misses'] == 0 and warm['hits'] == 10
+    finally:
+        configure_distance_cache()
+    
+    print(f"\nCold: {cold}")
+    print(f"Warm: {warm}")
+    
+    print("\n" + "=" * 60)
+
+def test_matrix_cost_provider():
+    """Routes can be priced on a memory-mapped road-network matrix"""
+    print("\nTest 14: Matrix Cost Provider")
+    print("=" * 60)
+    
+    # A 10 x 10 street grid whose roads are 40% longer than straight lines
+    lat, lon = np.meshgrid(np.linspace(40.70, 40.79, 10), np.linspace(-74.01, -73.92, 10), indexing='ij')
+    nodes = np.column_stack([lat.ravel(), lon.ravel()])
+    road_km = haversine_matrix(nodes) * 1.4
+    
+    riders = [
+        {'id': 1, 'pickup': [40.7200, -73.9900], 'dropoff': [40.7500, -73.9600]},
+        {'id': 2, 'pickup': [40.7300, -73.9800], 'dropoff': [40.7600, -73.9500]},
+    ]
+    drivers = [{'id': 1, 'location': [40.7100, -74.0000], 'capacity': 4}]
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        write_cost_matrix(tmp, nodes, road_km)
+        provider = MatrixCostProvider(tmp)
+        assert isinstance(provider.distance_km, np.memmap) and len(provider) == 100
+        
+        # Points on the grid snap to their own node and read the matrix directly
+        snapped, offsets = provider.snap(nodes[[3, 57]])
+        assert snapped.tolist() == [3, 57] and np.allclose(offsets, 0, atol=1e-9)
+        assert np.allclose(provider.distance_matrix(nodes[[3, 57]])[0, 1], road_km[3, 57], rtol=1e-6)
+        
+        # Workers reopen the same files instead of receiving the matrix
+        assert len(pickle.dumps(provider)) < 1000
+        assert pickle.loads(pickle.dumps(provider)).path == provider.path
+        slow = pickle.loads(pickle.dumps(MatrixCostProvider(tmp, speed_kmh=15)))
+        assert slow.speed_kmh == 15 and pickle.loads(pickle.dumps(provider)).speed_kmh == provider.speed_kmh
+        
+        straight = RideSharingOptimizer().optimize(riders, drivers)
+        road = RideSharingOptimizer(cost_provider=provider).optimize(riders, drivers)
+    
+    assert road['metrics']['riders_matched'] == 2
+    ratio = road['metrics']['total_distance'] / straight['metrics']['total_distance']
+    assert 1.3 < ratio < 1.5
+    
+    # Every cost method is abstract, so partial providers fail when created
+    try:
+        optimizer_module.CostProvider()
+        assert False, 'CostProvider is abstract'
+    except TypeError:
+        pass
+    assert road['metrics']['solo_distance'] > straight['metrics']['solo_distance']
+    
+    print(f"\nStraight-line route: {straight['metrics']['total_distance']} km")
+    print(f"Road-network route: {road['metrics']['total_distance']} km")
+    
+    print("\n" + "=" * 60)
+
+def test_native_callbacks():
+    """Matrix-registered transits build the same model as Python callbacks"""
+    print("\nTest 15: Native Callbacks")
+    print("=" * 60)
+    
+    coords = np.array([
+        [40.7550, -73.9870],
+        [40.7589, -73.9851], [40.7580, -73.9855], [40.7500, -73.9900],
+        [40.7614, -73.9776], [40.7620, -73.9700], [40.7650, -73.9750],
+    ])
+    meter_matrix = haversine_matrix(coords, meters=True)
+    
+    # The first solution depends only on the arc costs, so both models must agree
+    objectives = []
+    for native in (False, True):
+        manager, routing = build_pickup_delivery_model(meter_matrix, 2, native)
+        search_parameters = pywrapcp.DefaultRoutingSearchParameters()
+        search_parameters.solution_limit = 1
+        solution = routing.SolveWithParameters(search_parameters)
+        objectives.append(solution.ObjectiveValue())
+    
+    assert objectives[0] == objectives[1]
+    print(f"\nFirst-solution objective: {objectives[1]} m with either callback kind")
+    
+    print("\n" + "=" * 60)
+
+def test_joint_mode():
+    """One multi-vehicle model routes every driver in a region together"""
+    print("\nTest 16: Joint Multi-Vehicle Mode")
+    print("=" * 60)
+    
+    riders = [
+        {'id': 1, 'pickup': [40.7589, -73.9851], 'dropoff': [40.7614, -73.9776]},
+        {'id': 2, 'pickup': [40.7580, -73.9855], 'dropoff': [40.7620, -73.9700]},
+        {'id': 3, 'pickup': [40.7500, -73.9900], 'dropoff': [40.7650, -73.9750]},
+        {'id': 4, 'pickup': [40.7300, -74.0000], 'dropoff': [40.7350, -73.9950]},
+        {'id': 5, 'pickup': [40.7310, -74.0010], 'dropoff': [40.7360, -73.9960]},
+        {'id': 6, 'pickup': [40.6400, -73.7800], 'dropoff': [40.6500, -73.7900]},
+    ]
+    drivers = [
+        {'id': 1, 'location': [40.7550, -73.9870], 'capacity': 2},
+        {'id': 2, 'location': [40.7290, -74.0020], 'capacity': 2},
+    ]
+    
+    result = RideSharingOptimizer().optimize(riders, drivers, mode='joint', pickup_radius_km=5)
+    assert result['success'] and result['metrics']['mode'] == 'joint'
+    
+    # The airport rider is out of reach; everyone else is served exactly once
+    assert result['unmatched_riders'] == [6]
+    served = [r['id'] for match in result['matches'] for r in match['riders']]
+    assert sorted(served) == [1, 2, 3, 4, 5]
+    
+    for match in result['matches']:
+        assert match['solver']['method'] == 'joint'
+        load = 0
+        for stop in match['route'][1:]:
+            load += 1 if stop['type'] == 'pickup' else -1
+            assert 0 <= load <= 2
+        assert load == 0
+    
+    # A spread-out city with the default wait and detour windows and no deadline still gets served
+    rng = np.random.default_rng(7)
+    pickups = np.column_stack([rng.uniform(40.70, 40.80, 30), rng.uniform(-74.02, -73.93, 30)])
+    dropoffs = pickups + rng.uniform(-0.02, 0.02, (30, 2))
+    locations = np.column_stack([rng.uniform(40.70, 40.80, 8), rng.uniform(-74.02, -73.93, 8)])
+    city_riders = [{'id': i + 1, 'pickup': pickups[i].tolist(), 'dropoff': dropoffs[i].tolist()} for i in range(30)]
+    city_drivers = [{'id': i + 1, 'location': locations[i].tolist(), 'capacity': 4} for i in range(8)]
+    city = RideSharingOptimizer().optimize(city_riders, city_drivers, mode='joint')['metrics']
+    assert city['riders_matched'] >= 25
+    
+    try:
+        RideSharingOptimizer().optimize(riders, drivers, mode='fleet')
+        assert False, 'unknown modes must be rejected'
+    except ValueError:
+        pass
+    
+    print(f"\nRoutes: {[(m['driver_id'], [r['id'] for r in m['riders']]) for m in result['matches']]}")
+    print(f"Total Distance: {result['metrics']['total_distance']} km")
+    
+    print("\n" + "=" * 60)
+
+def test_time_windows():
+    """Pickups respect max_wait_time, rides respect the detour limit, matches carry ETAs"""
+    print("\nTest 17: Time Windows")
+    print("=" * 60)
+    
+    # Stops along one avenue, in km north of the driver
+    km = 1 / 111.19
+    coords = np.array([[40.75, -73.99]] + [[40.75 + d * km, -73.99] for d in (1.0, 1.1, -1.0, 3.0)])
+    
+    # The shortest round trip carries rider 0 north before heading south...
+    untimed = solve_route(coords, 2)
+    assert untimed['method'] == 'exact' and untimed['order'] == [0, 1, 2, 4, 3]
+    
+    # ...which is longer than rider 0 may ride, so the exact solver takes the shortest order that fits
+    timed = solve_route(coords, 2, time_limit_ms=200, wait_limits=[15, 15], max_detour_factor=1.0)
+    assert timed['method'] == 'exact' and timed['dropped'] == []
+    arrival = dict(zip(timed['order'], timed['arrivals']))
+    assert arrival[3] - arrival[1] <= 2 * 2.0 + 5 + 1e-6
+    assert timed['order'] != untimed['order']
+    
+    # Riders nobody can reach in time send the route to OR-Tools, which leaves them out
+    late = solve_route(coords, 2, time_limit_ms=200, wait_limits=[15, 1], max_detour_factor=1.0)
+    assert late['method'] == 'ortools' and late['dropped'] == [1]
+    
+    # A rider who cannot be reached in time is pruned; the others get ETAs
+    riders = [
+        {'id': 1, 'pickup': [40.7589, -73.9851], 'dropoff': [40.7614, -73.9776], 'max_wait_time': 10},
+        {'id': 2, 'pickup': [40.7580, -73.9855], 'dropoff': [40.7620, -73.9700], 'max_wait_time': 10},
+        {'id': 3, 'pickup': [40.8500, -73.9400], 'dropoff': [40.8600, -73.9300], 'max_wait_time': 5},
+    ]
+    drivers = [{'id': 1, 'location': [40.7550, -73.9870], 'capacity': 4}]
+    
+    for mode in ('cluster', 'joint'):
+        result = RideSharingOptimizer().optimize(riders, drivers, mode=mode, deadline_ms=1000)
+        assert result['unmatched_riders'] == [3]
+        
+        etas = {eta['rider_id']: eta for eta in result['matches'][0]['etas']}
+        assert sorted(etas) == [1, 2]
+        for rider_id, eta in etas.items():
+            assert 0 < eta['pickup_eta_min'] <= 10
+            assert eta['pickup_eta_min'] < eta['dropoff_eta_min']
+        print(f"\n{mode}: ETAs {list(etas.values())}")
+    
+    print("\n" + "=" * 60)
+
+def test_instrumentation():
+    """Stage and per-route timings, solver outcomes and optional profiles in the metrics"""
+    print("\nTest 18: Instrumentation")
+    print("=" * 60)
+    
+    rng = np.random.default_rng(7)
+    pickups = np.column_stack([rng.uniform(40.70, 40.80, 30), rng.uniform(-74.02, -73.93, 30)])
+    dropoffs = pickups + rng.uniform(-0.02, 0.02, (30, 2))
+    locations = np.column_stack([rng.uniform(40.70, 40.80, 8), rng.uniform(-74.02, -73.93, 8)])
+    riders = [{'id': i + 1, 'pickup': pickups[i].tolist(), 'dropoff': dropoffs[i].tolist()} for i in range(30)]
+    drivers = [{'id': i + 1, 'location': locations[i].tolist(), 'capacity': 4} for i in range(8)]
+    
+    stages = []
+    result = RideSharingOptimizer().optimize(riders, drivers, deadline_ms=1000, profile=True,
+                                             progress=lambda stage, fraction: stages.append(stage))
+    metrics = result['metrics']
+    
+    # Stages arrive in order and the user's progress callback still hears them
+    assert list(metrics['timings']) == ['load', 'clustering', 'assignment', 'routing', 'metrics']
+    assert set(stages) == {'clustering', 'assignment', 'routing'}
+    assert sum(t['wall_ms'] for t in metrics['timings'].values()) <= metrics['elapsed_ms'] + 1
+    
+    assert metrics['solver']['solves'] == len(result['matches'])
+    assert sum(metrics['solver']['statuses'].values()) == metrics['solver']['solves']
+    for match in result['matches']:
+        solver = match['solver']
+        assert solver['cpu_ms'] >= 0 and solver['objective'] is not None
+        if solver['method'] == 'exact':
+            assert solver['status'] == 'optimal'
+            assert abs(solver['objective'] - match['distance'] * 1000) < 10
+        else:
+            assert solver['status'] in ('success', 'partial_success_local_optimum_not_reached')
+    
+    assert 0 < len(metrics['profile']) <= 25
+    assert any('_optimize' in row['function'] for row in metrics['profile'])
+    assert 'profile' not in RideSharingOptimizer().optimize(riders, drivers, deadline_ms=500)['metrics']
+    
+    # Joint models with ride limits over several vehicles still find routes
+    joint = RideSharingOptimizer().optimize(riders, drivers, deadline_ms=1000, mode='joint')['metrics']
+    assert joint['riders_matched'] > 0 and 'timings' in joint
+    
+    print(f"\nTimings: {metrics['timings']}")
+    print(f"Solver: {metrics['solver']}")
+    print(f"Joint mode matched {joint['riders_matched']} of 30 riders")
+    
+    print("\n" + "=" * 60)
+
+def test_shareability_mode():
+    """Only riders whose trips fit together share a car, at most three to a trip"""
+    print("\nTest 19: Shareability Mode")
+    print("=" * 60)
+    
+    # A morning commute: everyone leaves one neighbourhood for another
+    rng = np.random.default_rng(11)
+    pickups = np.column_stack([rng.normal(40.750, 0.004, 60), rng.normal(-73.990, 0.004, 60)])
+    dropoffs = np.column_stack([rng.normal(40.780, 0.004, 60), rng.normal(-73.960, 0.004, 60)])
+    locations = np.column_stack([rng.normal(40.750, 0.01, 30), rng.normal(-73.990, 0.01, 30)])
+    riders = [{'id': i + 1, 'pickup': pickups[i].tolist(), 'dropoff': dropoffs[i].tolist()} for i in range(60)]
+    drivers = [{'id': i + 1, 'location': locations[i].tolist(), 'capacity': 4} for i in range(30)]
+    
+    result = RideSharingOptimizer().optimize(riders, drivers, mode='shareability')
+    metrics = result['metrics']
+    assert metrics['mode'] == 'shareability' and set(metrics['shareability']['trips']) == {'1', '2', '3'}
+    
+    served = [r['id'] for match in result['matches'] for r in match['riders']]
+    assert len(served) == len(set(served)) == metrics['riders_matched']
+    assert len(served) + len(result['unmatched_riders']) == 60
+    assert len({match['driver_id'] for match in result['matches']}) == len(result['matches'])
+    assert all(len(match['riders']) <= 3 for match in result['matches'])
+    
+    # Pooled trips drive fewer km per rider than geographic clusters
+    clustered = RideSharingOptimizer().optimize(riders, drivers)['metrics']
+    per_rider = metrics['total_distance'] / metrics['riders_matched']
+    assert per_rider < clustered['total_distance'] / clustered['riders_matched']
+    
+    # The straight-line bounds only drop pairs exact pricing rejects, and chunks price like one batch
+    provider = optimizer_module.HaversineCostProvider()
+    limits = haversine_pairwise(pickups, dropoffs) * 1.5 + provider.reach_km(optimizer_module.DETOUR_ALLOWANCE_MIN)
+    pairs = np.array(list(itertools.combinations(range(60), 2)))
+    pair_km, _ = optimizer_module.evaluate_trips(pairs, pickups, dropoffs, limits, provider)
+    chunked_km, _ = optimizer_module.evaluate_trips(pairs, pickups, dropoffs, limits, provider, chunk=100)
+    bounded = optimizer_module.pair_within_limits(pairs, pickups, dropoffs, limits)
+    assert np.array_equal(pair_km, chunked_km) and bounded[np.isfinite(pair_km)].all()
+    
+    # A graph out of time keeps only the singles it priced up front
+    late = optimizer_module.shareability_graph(pickups, dropoffs, np.full(60, 15.0), None, provider, deadline=0)
+    assert len(late) == 2 and len(late[1][0]) == 0
+    
+    # Small selections are solved exactly
+    small = RideSharingOptimizer().optimize(riders[:12], drivers[:6], mode='shareability')['metrics']
+    assert small['shareability']['selection'] == 'ilp'
+    
+    print(f"\nShareability: {metrics['riders_matched']}/60 riders, {per_rider:.2f} km per rider, "
+          f"{metrics['shareability']}")
+    print(f"Clusters: {clustered['riders_matched']}/60 riders, "
+          f"{clustered['total_distance'] / clustered['riders_matched']:.2f} km per rider")
+    
+    print("\n" + "=" * 60)
+
+def test_warm_start_across_calls():
+    """A second optimize() on the same fleet starts its route searches from the first call's routes"""
+    print("\nTest 20: Warm Starts Across Calls")
+    print("=" * 60)
+    
+    rng = np.random.default_rng(5)
+    pickups = rng.uniform([40.74, -73.99], [40.76, -73.97], (24, 2))
+    dropoffs = pickups + rng.uniform(-0.01, 0.01, (24, 2))
+    riders = [{'id': i + 1, 'pickup': pickups[i].tolist(), 'dropoff': dropoffs[i].tolist()} for i in range(24)]
+    drivers = [{'id': i + 1, 'location': [40.75 + 0.005 * i, -73.98], 'capacity': 6} for i in range(4)]
+    
+    optimizer = RideSharingOptimizer(exact_max_nodes=0)
+    first = optimizer.optimize(riders, drivers, deadline_ms=400)
+    assert first['metrics']['solver']['warm_started'] == 0
+    
+    # Every driver who served riders seeds their next search; the others have no route to reuse
+    served = {match['driver_id'] for match in first['matches'] if match['riders']}
+    second = optimizer.optimize(riders, drivers, deadline_ms=400)
+    assert served and set(optimizer.previous_routes) == served
+    assert {match['driver_id'] for match in second['matches'] if match['solver']['warm_started']} == served
+    
+    # The next horizon tick: one rider was picked up and left the batch. Routes
+    # the old order no longer fits in start cold
+    tick = optimizer.optimize(riders[1:], drivers, deadline_ms=400)
+    assert tick['metrics']['solver']['warm_started'] > 0
+    
+    # Routes are kept per driver: a different fleet starts cold
+    others = [{**driver, 'id': driver['id'] + 100} for driver in drivers]
+    assert optimizer.optimize(riders, others, deadline_ms=400)['metrics']['solver']['warm_started'] == 0
+    
+    print(f"\nCold: {first['metrics']['total_distance']} km, "
+          f"warm: {second['metrics']['total_distance']} km")
+    
+    print("\n" + "=" * 60)
+
 def performance_benchmark():
     """Benchmark the optimization performance"""
-    print("\nTest 5: Performance Benchmark")
+    print("\nTest 21: Performance Benchmark")
     print("=" * 60)
     
     import time
@@ -194,6 +923,22 @@ if __name__ == "__main__":
     test_high_capacity()
     test_single_rider()
     test_optimal_clustering()
+    test_vectorized_haversine()
+    test_parallel_matches_sequential()
+    test_deadline_budget()
+    test_exact_dp_routes()
+    test_capacity_balanced_assignment()
+    test_driver_spatial_index()
+    test_clustering_backends()
+    test_columnar_rider_store()
+    test_distance_cache()
+    test_matrix_cost_provider()
+    test_native_callbacks()
+    test_joint_mode()
+    test_time_windows()
+    test_instrumentation()
+    test_shareability_mode()
+    test_warm_start_across_calls()
     performance_benchmark()
     
     print("\n✅ All tests completed!\n")
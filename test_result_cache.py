@@ -0,0 +1,151 @@
+"""
+Example usage and testing of the optimization result cache
+"""
+
+import threading
+import time
+
+import app as server
+from app import app, result_cache
+from result_cache import ResultCache, SingleFlight, cache_key
+
+RIDERS = [
+    {'id': 1, 'pickup': [40.7589, -73.9851], 'dropoff': [40.7614, -73.9776]},
+    {'id': 2, 'pickup': [40.7580, -73.9855], 'dropoff': [40.7620, -73.9700]},
+    {'id': 3, 'pickup': [40.7500, -73.9900], 'dropoff': [40.7650, -73.9750]},
+]
+
+DRIVERS = [
+    {'id': 1, 'location': [40.7550, -73.9870], 'capacity': 4},
+]
+
+def test_result_cache():
+    """Keys ignore formatting, entries expire and the cache stays within its bounds"""
+    print("=" * 60)
+    print("Test 1: Result Cache")
+    print("=" * 60)
+    
+    options = {'mode': 'cluster', 'deadline_ms': None}
+    reordered = [{'dropoff': r['dropoff'], 'pickup': r['pickup'], 'id': r['id']} for r in RIDERS]
+    assert cache_key(RIDERS, DRIVERS, options) == cache_key(reordered, DRIVERS, dict(reversed(options.items())))
+    assert cache_key(RIDERS, DRIVERS, options) != cache_key(RIDERS, DRIVERS, {**options, 'mode': 'joint'})
+    assert cache_key(RIDERS, DRIVERS, options) != cache_key(RIDERS[::-1], DRIVERS, options)
+    
+    cache = ResultCache(max_entries=2, max_riders=5, ttl_s=0.2)
+    cache.put('a', {'n': 1}, 2)
+    cache.put('b', {'n': 2}, 2)
+    assert cache.get('a')[0] == {'n': 1}
+    cache.put('c', {'n': 3}, 2)  # over both bounds: 'b' is the least recently used
+    assert cache.get('b') == (None, 0.0) and len(cache) == 2 and cache.riders == 4
+    cache.put('huge', {'n': 4}, 6)
+    assert cache.get('huge')[0] is None
+    
+    time.sleep(0.25)
+    assert cache.get('a')[0] is None and len(cache) == 1
+    
+    stats = cache.stats()
+    assert stats['hits'] == 1 and stats['evictions'] == 1
+    
+    # Callers of a key already in flight wait for that call and share its value or error
+    flights, release = SingleFlight(), threading.Event()
+    calls, shared = [], []
+    
+    def slow():
+        calls.append(1)
+        release.wait(5)
+        return 'solved'
+    
+    leader = threading.Thread(target=lambda: flights.run('k', slow))
+    leader.start()
+    while 'k' not in flights.flights:
+        time.sleep(0.01)
+    follower = threading.Thread(target=lambda: shared.append(flights.run('k', slow)))
+    follower.start()
+    while flights.shared == 0:
+        time.sleep(0.01)
+    release.set()
+    leader.join(5)
+    follower.join(5)
+    assert calls == [1] and shared == [('solved', True)] and not flights.flights
+    
+    try:
+        flights.run('k', lambda: 1 / 0)
+        assert False, 'the error reaches the caller'
+    except ZeroDivisionError:
+        pass
+    assert flights.run('k', lambda: 'again') == ('again', False)
+    
+    print(f"\nStats: {stats}")
+    print("\n" + "=" * 60)
+
+def test_cached_responses():
+    """Identical requests are answered from the cache with status headers"""
+    print("\nTest 2: Cached Responses")
+    print("=" * 60)
+    
+    result_cache.clear()
+    client = app.test_client()
+    payload = {'riders': RIDERS, 'drivers': DRIVERS, 'deadline_ms': 1000}
+    
+    first = client.post('/api/optimize', json=payload)
+    second = client.post('/api/optimize', json=payload)
+    assert first.headers['X-Cache'] == 'MISS' and second.headers['X-Cache'] == 'HIT'
+    assert 'Age' in second.headers and second.json == first.json
+    
+    # Other response shapes reuse the stored result; other settings do not
+    compact = client.post('/api/optimize', json={**payload, 'response': 'compact'})
+    assert compact.headers['X-Cache'] == 'HIT' and compact.json['format'] == 'compact'
+    assert client.post('/api/optimize', json={**payload, 'mode': 'joint'}).headers['X-Cache'] == 'MISS'
+    
+    refreshed = client.post('/api/optimize', json=payload, headers={'Cache-Control': 'no-cache'})
+    assert refreshed.headers['X-Cache'] == 'BYPASS'
+    profiled = client.post('/api/optimize', json={**payload, 'profile': True})
+    assert profiled.headers['X-Cache'] == 'BYPASS'
+    
+    metrics = client.get('/api/metrics').data.decode()
+    assert 'ridesharing_result_cache_lookups{result="hit"} 2' in metrics
+    
+    # An identical request arriving mid-solve shares that solve
+    release, new_optimizer = threading.Event(), server.new_optimizer
+    
+    def gated_optimizer():
+        release.wait(5)
+        return new_optimizer()
+    
+    server.new_optimizer = gated_optimizer
+    try:
+        burst = {**payload, 'deadline_ms': 900}
+        statuses = []
+        posts = [threading.Thread(target=lambda: statuses.append(
+            app.test_client().post('/api/optimize', json=burst).headers['X-Cache'])) for _ in range(2)]
+        shared = server.in_flight.shared
+        for post in posts:
+            post.start()
+        while server.in_flight.shared == shared:
+            time.sleep(0.01)
+        release.set()
+        for post in posts:
+            post.join(10)
+    finally:
+        server.new_optimizer = new_optimizer
+    assert sorted(statuses) == ['HIT', 'MISS']
+    
+    # With the cache turned off nothing is stored and every answer is a BYPASS
+    cache = server.result_cache
+    server.result_cache = ResultCache(max_entries=0)
+    try:
+        statuses = [client.post('/api/optimize', json=payload).headers['X-Cache'] for _ in range(2)]
+    finally:
+        server.result_cache = cache
+    assert statuses == ['BYPASS', 'BYPASS']
+    
+    print(f"\nCache: {result_cache.stats()}")
+    print("\n" + "=" * 60)
+
+if __name__ == "__main__":
+    print("\n🚗 Result Cache - Test Suite\n")
+    
+    test_result_cache()
+    test_cached_responses()
+    
+    print("\n✅ All tests completed!\n")
@@ -0,0 +1,123 @@
+"""
+Example usage and testing of compact responses and encoders
+"""
+
+import json
+
+import app as server
+from app import app
+from optimizer import RideSharingOptimizer
+from sharding import ShardedOptimizer
+from serialization import compact_result, encode_polyline, decode_polyline, serialize_result
+
+RIDERS = [
+    {'id': 1, 'pickup': [40.7589, -73.9851], 'dropoff': [40.7614, -73.9776]},
+    {'id': 2, 'pickup': [40.7580, -73.9855], 'dropoff': [40.7620, -73.9700]},
+    {'id': 3, 'pickup': [40.7500, -73.9900], 'dropoff': [40.7650, -73.9750]},
+    {'id': 4, 'pickup': [40.7520, -73.9880], 'dropoff': [40.7400, -73.9950]},
+]
+
+DRIVERS = [
+    {'id': 1, 'location': [40.7550, -73.9870], 'capacity': 4},
+    {'id': 2, 'location': [40.7490, -73.9920], 'capacity': 3},
+]
+
+def test_compact_result():
+    """Compact results list every location once and rebuild the full routes"""
+    print("=" * 60)
+    print("Test 1: Compact Results")
+    print("=" * 60)
+    
+    # The example from the polyline format's documentation
+    assert encode_polyline([(38.5, -120.2), (40.7, -120.95), (43.252, -126.453)]) == '_p~iF~ps|U_ulLnnqC_mqNvxq`@'
+    assert decode_polyline('_p~iF~ps|U_ulLnnqC_mqNvxq`@') == [(38.5, -120.2), (40.7, -120.95), (43.252, -126.453)]
+    assert encode_polyline([]) == '' and decode_polyline('') == []
+    
+    optimizer = RideSharingOptimizer()
+    result = optimizer.optimize(RIDERS, DRIVERS)
+    compact = compact_result(result)
+    
+    # The optimizer's rider table and routes give the same tables as the full matches
+    assert compact_result(result, optimizer=optimizer) == compact
+    sharded = ShardedOptimizer()
+    tiled = sharded.optimize(RIDERS, DRIVERS, tile_km=1)
+    assert compact_result(tiled, polyline=True, optimizer=sharded) == compact_result(tiled, polyline=True)
+    riders, drivers = compact['riders'], compact['drivers']
+    assert sorted(riders['id']) == [r['id'] for r in RIDERS]
+    assert compact['metrics'] == result['metrics']
+    
+    for match, full in zip(compact['matches'], result['matches']):
+        assert drivers['id'][match['driver']] == full['driver_id']
+        route = [drivers['location'][match['driver']]]
+        seen = set()
+        for row in match['stops']:
+            route.append(riders['dropoff' if row in seen else 'pickup'][row])
+            seen.add(row)
+        assert route == [[stop['lat'], stop['lon']] for stop in full['route']]
+        
+        etas = {eta['rider_id']: eta for eta in full['etas']}
+        first = [match['stops'].index(row) == i for i, row in enumerate(match['stops'])]
+        expected = [etas[riders['id'][row]]['pickup_eta_min' if pickup else 'dropoff_eta_min']
+                    for row, pickup in zip(match['stops'], first)]
+        assert match['eta_min'] == expected
+    
+    encoded = compact_result(result, polyline=True)
+    pickups = decode_polyline(encoded['riders']['pickup'])
+    assert all(abs(a - b) < 1e-5 for point, exact in zip(pickups, riders['pickup']) for a, b in zip(point, exact))
+    
+    full_body, _ = serialize_result(result)
+    compact_body, _ = serialize_result(result, 'compact', polyline=True)
+    assert json.loads(full_body) == result and len(compact_body) < len(full_body) / 2
+    
+    print(f"Full response {len(full_body)} bytes, compact with polylines {len(compact_body)} bytes")
+    print("\n" + "=" * 60)
+
+def test_response_options():
+    """The API picks the response shape and encoder per request and reports the encode time"""
+    print("\nTest 2: Response Options")
+    print("=" * 60)
+    
+    client = app.test_client()
+    response = client.post('/api/optimize', json={'riders': RIDERS, 'drivers': DRIVERS})
+    assert response.status_code == 200 and 'route' in response.json['matches'][0]
+    assert response.headers['Server-Timing'].startswith('encode;dur=')
+    
+    response = client.post('/api/optimize', json={'riders': RIDERS, 'drivers': DRIVERS,
+                                                  'response': 'compact', 'polyline': True})
+    assert response.json['format'] == 'compact' and isinstance(response.json['riders']['pickup'], str)
+    
+    response = client.post('/api/optimize', json={'riders': RIDERS, 'drivers': DRIVERS, 'response': 'tiny'})
+    assert response.status_code == 400
+    
+    # Servers without orjson turn the encoder down as a bad request
+    has_orjson = server.has_orjson
+    server.has_orjson = lambda: False
+    try:
+        response = client.post('/api/optimize', json={'riders': RIDERS, 'drivers': DRIVERS, 'encoder': 'orjson'})
+    finally:
+        server.has_orjson = has_orjson
+    assert response.status_code == 400 and 'orjson' in response.json['error']
+    
+    try:
+        import orjson
+    except ImportError:
+        print("\norjson not installed, skipping the orjson encoder")
+    else:
+        response = client.post('/api/optimize', json={'riders': RIDERS, 'drivers': DRIVERS,
+                                                      'response': 'compact', 'encoder': 'orjson'})
+        assert response.status_code == 200 and response.json['format'] == 'compact'
+    
+    metrics = client.get('/api/metrics').data.decode()
+    assert 'ridesharing_responses_total{encoder="json",format="compact"}' in metrics
+    assert 'ridesharing_response_bytes_total{format="full"}' in metrics
+    
+    print(f"\n{response.headers['Server-Timing']}, {len(response.data)} bytes")
+    print("\n" + "=" * 60)
+
+if __name__ == "__main__":
+    print("\n🚗 Response Serialization - Test Suite\n")
+    
+    test_compact_result()
+    test_response_options()
+    
+    print("\n✅ All tests completed!\n")
@@ -0,0 +1,118 @@
+"""
+Example usage and testing of the production serving limits
+"""
+
+import os
+import tempfile
+import threading
+import time
+
+import app as server
+from app import app
+from benchmark_startup import warm_worker
+from serving import SolveLimiter, Overloaded, warm_up
+
+RIDERS = [
+    {'id': 1, 'pickup': [40.7589, -73.9851], 'dropoff': [40.7614, -73.9776]},
+    {'id': 2, 'pickup': [40.7580, -73.9855], 'dropoff': [40.7620, -73.9700]},
+]
+
+DRIVERS = [
+    {'id': 1, 'location': [40.7550, -73.9870], 'capacity': 4},
+]
+
+def test_solve_limiter():
+    """Solves beyond the running and queued limits are turned away at once"""
+    print("=" * 60)
+    print("Test 1: Solve Limiter")
+    print("=" * 60)
+    
+    limiter = SolveLimiter(max_active=1, max_queued=1, queue_timeout_s=5)
+    queued_done = threading.Event()
+    
+    def queued_solve():
+        with limiter.slot():
+            queued_done.set()
+    
+    with limiter.slot():
+        waiter = threading.Thread(target=queued_solve)
+        waiter.start()
+        while limiter.stats()['queued'] == 0:
+            time.sleep(0.01)
+        
+        try:
+            with limiter.slot():
+                assert False, 'a third solve must be rejected'
+        except Overloaded:
+            pass
+        assert limiter.stats() == {'active': 1, 'queued': 1, 'rejected': 1}
+    
+    waiter.join(5)
+    assert queued_done.is_set() and limiter.stats()['active'] == 0
+    
+    # Queued solves give up once their wait runs out
+    impatient = SolveLimiter(max_active=1, max_queued=1, queue_timeout_s=0.05)
+    with impatient.slot():
+        try:
+            with impatient.slot():
+                assert False, 'no slot frees up in time'
+        except Overloaded:
+            pass
+    
+    print(f"\nLimiter: {limiter.stats()}")
+    print("\n" + "=" * 60)
+
+def test_backpressure():
+    """Busy workers answer 429, oversized bodies 413, and preloaded workers fork ready"""
+    print("\nTest 2: Backpressure and Request Limits")
+    print("=" * 60)
+    
+    client = app.test_client()
+    payload = {'riders': RIDERS, 'drivers': DRIVERS}
+    limiter = server.solve_limiter
+    server.solve_limiter = SolveLimiter(max_active=1, max_queued=0)
+    try:
+        with server.solve_limiter.slot():
+            busy = client.post('/api/optimize', json=payload, headers={'Cache-Control': 'no-cache'})
+        assert busy.status_code == 429 and busy.headers['Retry-After']
+        assert client.post('/api/optimize', json=payload, headers={'Cache-Control': 'no-cache'}).status_code == 200
+    finally:
+        server.solve_limiter = limiter
+    
+    limit = app.config['MAX_CONTENT_LENGTH']
+    app.config['MAX_CONTENT_LENGTH'] = 200
+    try:
+        too_large = client.post('/api/optimize', json=payload)
+    finally:
+        app.config['MAX_CONTENT_LENGTH'] = limit
+    assert too_large.status_code == 413
+    
+    metrics = client.get('/api/metrics').data.decode()
+    assert 'ridesharing_requests_rejected_total{reason="overloaded"}' in metrics
+    assert 'ridesharing_requests_rejected_total{reason="too_large"}' in metrics
+    assert 'ridesharing_solves{state="active"} 0' in metrics
+    
+    warm_up()
+    times = warm_worker(payload)
+    assert times['status'] == 200
+    
+    # Workers save the distance cache through a temporary file of their own
+    path = server.DISTANCE_CACHE_PATH
+    with tempfile.TemporaryDirectory() as tmp:
+        server.DISTANCE_CACHE_PATH = os.path.join(tmp, 'distances.npz')
+        try:
+            server.save_distance_cache()
+        finally:
+            server.DISTANCE_CACHE_PATH = path
+        assert os.listdir(tmp) == ['distances.npz']
+    
+    print(f"\nForked worker ready in {times['ready_ms']:.1f} ms")
+    print("\n" + "=" * 60)
+
+if __name__ == "__main__":
+    print("\n🚗 Production Serving - Test Suite\n")
+    
+    test_solve_limiter()
+    test_backpressure()
+    
+    print("\n✅ All tests completed!\n")
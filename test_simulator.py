@@ -0,0 +1,72 @@
+"""
+Example usage and testing of the fleet simulator
+"""
+
+from simulator import FleetSimulator, synthetic_demand, synthetic_fleet
+
+def test_replayed_requests():
+    """Replayed riders wait for the next batch and reuse drivers once they are free"""
+    print("=" * 60)
+    print("Test 1: Replayed Requests")
+    print("=" * 60)
+    
+    requests = [
+        {'id': 1, 'pickup': [40.7589, -73.9851], 'dropoff': [40.7614, -73.9776], 'request_time': 5},
+        {'id': 2, 'pickup': [40.7500, -73.9900], 'dropoff': [40.7650, -73.9750], 'request_time': 20},
+        {'id': 3, 'pickup': [40.7400, -74.0000], 'dropoff': [40.7300, -73.9950],
+         'request_time': 40, 'max_wait_time': 0.1},
+    ]
+    drivers = [{'id': 1, 'location': [40.7550, -73.9870], 'capacity': 1}]
+    
+    report = FleetSimulator(drivers, batch_interval_s=30, apply_latency=False).run(requests)
+    
+    # Rider 1 leaves with the first batch, rider 2 once the single seat is free, rider 3 gives up
+    assert report['riders'] == {'requested': 3, 'served': 2, 'abandoned': 1}
+    assert report['dispatch']['batches'] == 2 and report['dispatch']['assignments'] == 2
+    assert report['dispatch']['batch_size']['max'] == 2
+    assert 0 < report['fleet']['utilization'] <= 1
+    assert report['fleet']['riders_per_busy_vehicle'] <= 1
+    assert report['wait_min']['p50'] > 0 and report['ride_min']['max'] > 0
+    
+    # A rider with part of a minute left still gets it, not a zero-minute window
+    hurried = [{'id': 1, 'pickup': [40.7589, -73.9851], 'dropoff': [40.7614, -73.9776],
+                'request_time': 10, 'max_wait_time': 1}]
+    nearby = [{'id': 1, 'location': [40.7562, -73.9851], 'capacity': 1}]
+    assert FleetSimulator(nearby, batch_interval_s=30, apply_latency=False).run(hurried)['riders']['served'] == 1
+    
+    print(f"\nRiders: {report['riders']}, simulated {report['simulated_s']} s")
+    print(f"Waits: {report['wait_min']} min")
+    print("\n" + "=" * 60)
+
+def test_synthetic_day():
+    """Synthetic demand runs end to end and every request is accounted for"""
+    print("\nTest 2: Synthetic Demand")
+    print("=" * 60)
+    
+    requests = synthetic_demand(20 * 60, riders_per_min=4, distribution='hotspot', seed=2)
+    assert all(a['request_time'] <= b['request_time'] for a, b in zip(requests, requests[1:]))
+    assert 40 < len(requests) < 120 and requests[-1]['request_time'] < 20 * 60
+    
+    report = FleetSimulator(synthetic_fleet(12, seed=2), batch_interval_s=60, deadline_ms=500).run(requests)
+    riders, dispatch = report['riders'], report['dispatch']
+    assert riders['served'] + riders['abandoned'] == riders['requested'] == len(requests)
+    assert dispatch['assignments'] == riders['served']
+    assert dispatch['decisions'] >= riders['served'] and dispatch['decisions_per_s'] > 0
+    assert dispatch['latency_ms']['p50'] <= dispatch['latency_ms']['p99'] <= dispatch['latency_ms']['max']
+    
+    # Nobody is picked up later than they were willing to wait, give or take the dispatch latency
+    assert report['wait_min']['max'] <= 15 + dispatch['latency_ms']['max'] / 60000
+    assert report['simulated_s'] >= requests[-1]['request_time']
+    
+    print(f"\n{riders}, {dispatch['batches']} batches at {dispatch['decisions_per_s']} decisions/s")
+    print(f"Latency: {dispatch['latency_ms']} ms")
+    print(f"Fleet: {report['fleet']}")
+    print("\n" + "=" * 60)
+
+if __name__ == "__main__":
+    print("\n🚗 Fleet Simulator - Test Suite\n")
+    
+    test_replayed_requests()
+    test_synthetic_day()
+    
+    print("\n✅ All tests completed!\n")
@@ -0,0 +1,19 @@
+"""
+WSGI entry point for serving the API in production
+    gunicorn -c gunicorn.conf.py wsgi:app
+Importing this module loads the API with the whole solver stack and runs
+one small optimization, so with preload_app the master pays for both once
+and every worker it forks is ready for its first request.
+
+The master's distance cache never sees a solve, so it must not be saved
+over the workers' copies at exit: workers save theirs from the worker_exit
+hook in gunicorn.conf.py instead
+"""
+
+import atexit
+
+from app import app, save_distance_cache
+from serving import warm_up
+
+warm_up()
+atexit.unregister(save_distance_cache)